@@ -1,18 +1,64 @@
 # -*- coding: utf-8 -*-
 
-from utils import createLogger, DBtools
-import time, sys
-from datetime import datetime
+from utils import createLogger, DBtools, tradeWriter, ingestQueue, candles, trades, tradeLog, backfill, priceCache
+import asyncio, json, random, signal, threading, time, sys
 from binance.client import Client
 from binance.websockets import BinanceSocketManager
 from credentials import credentials_binance, credentials_mysql
 
 class BTCreader():
-    def __init__(self):
+    #streams in every combined websocket (the URL has all the stream names)
+    streams_per_socket = 100
+    #combined streams endpoint, used by the asyncio engine
+    stream_url = 'wss://stream.binance.com:9443/stream?streams='
+    #seconds between the checks of the supervision loop
+    poll_interval = 1
+    #backoff of the reconnections of the asyncio engine (seconds)
+    backoff_base = 1
+    backoff_max = 60
+
+    def __init__(self, symbols=None, quote_asset=None, queue_size=10000,
+                 backpressure='block', writers=1, partition='day',
+                 retention=None, trade_log=None, store_db=True, report=None,
+                 report_interval=10, run=True, engine='threads', backfill_gaps=True,
+                 price_cache='data/prices', spill_path='spill/ingest.jsonl'):
+        """
+        symbols -> list of symbols to read (BTCUSDT by default).
+        quote_asset -> if defined, read all the symbols in trading with this
+        quote asset (i.e. USDT), taken from the exchange info.
+        All the symbols are read through combined (multiplex) streams, and
+        every symbol is stored in its own table by the same writers.
+        queue_size -> maximum number of trades waiting to be written.
+        backpressure -> policy when the queue is full: block, drop_oldest or
+        spill (to disk).
+        writers -> number of writer threads. They share the same DB, and each
+        one checks out its own connection from the pool (the pool has room
+        for them and for the connections of the main thread).
+        partition -> None, 'day' or 'month'. Period of the partitions of the
+        ticker tables, rotated every hour.
+        retention -> number of periods to keep (None keeps everything).
+        trade_log -> folder of a local append-only binary log of the trades
+        (one file per day per symbol, see utils.tradeLog). None to disable it.
+        store_db -> if False, the trades are stored only in the trade_log.
+        report -> optional function called every report_interval seconds with
+        a dict of the number of messages received by symbol since the last
+        report (used by the supervisor).
+        run -> if True, the reader runs until it is closed (see run()).
+        engine -> 'threads' reads the websockets with the BinanceSocketManager,
+        'asyncio' reads them with asyncio tasks in the main thread, with
+        exponential backoff on the reconnections.
+        backfill_gaps -> if True, the trades missed by the websocket (gaps in the
+        trade ids, i.e. after a reconnection or since the last run) are
+        downloaded with the REST API and stored.
+        price_cache -> folder where the last trade and 1m bar of every symbol
+        are published for other processes (see utils.priceCache). None to
+        disable it.
+        spill_path -> file of the trades spilled by the spill backpressure
+        policy. Every reader running at the same time needs its own file.
+        """
         #create the logger
         self.logger = createLogger.createLogger()
         
-        self.ticker = 'BTCUSDT'
         #read the credentials from the file
         self.__api_key = credentials_binance['key']
         self.__api_secret = credentials_binance['secret']
@@ -20,7 +66,15 @@ class BTCreader():
         self.__mysql_port = credentials_mysql['port']
         self.__mysql_user = credentials_mysql['user']
         self.__mysql_password = credentials_mysql['password']
+        if engine not in ('threads', 'asyncio'):
+            raise ValueError("Unknown engine {}, use threads or asyncio".format(engine))
+        self.engine = engine
         self.reconnect_count = 0
+        self.restart_ws = False
+        self.report = report
+        self.report_interval = report_interval
+        self.last_report = time.monotonic()
+        self.msg_count = {}
         
         #set no proxies, for the case that the proxy is configured in the system
         self.proxies = {
@@ -33,47 +87,296 @@ class BTCreader():
         
         self.exchange_info = self.client.get_exchange_info()
         self.logger.info("Client initialized")
+
+        self.symbols = self.select_symbols(symbols, quote_asset)
+        self.ticker = self.symbols[0]
+        self.logger.info("Reading {} symbols: {}".format(len(self.symbols), ', '.join(self.symbols)))
     
         #%% Websocket to get the MD
-        self.bm = BinanceSocketManager(self.client, user_timeout=60)
+        self.bm = BinanceSocketManager(self.client, user_timeout=60) if engine == 'threads' else None
 
-        #open DB class handle
-        self.db = DBtools.DB(host = self.__mysql_host,
-                        port=self.__mysql_port,
-                        user=self.__mysql_user,
-                        password=self.__mysql_password,
-                        db = 'binance',
-                        logger = self.logger)
+        #open DB class handle. The pool has a connection for every writer
+        #thread, the main thread, the stream of the candle backfill
+        #(DB.stream_rows checks out its own connection) and the thread that
+        #runs the jobs of the database in the asyncio engine
+        self.db = self.open_db(pool_size=writers + 3, partition=partition, retention=retention)
+        self.last_rotation = 0
+        self.trade_log = tradeLog.TradeLog(trade_log) if trade_log else None
+        self.store_db = store_db
+        #bounded queue drained by the writer threads into the DB
+        self.queue = ingestQueue.IngestQueue(self.create_writer,
+                                             maxsize=queue_size,
+                                             policy=backpressure,
+                                             workers=writers,
+                                             spill_path=spill_path,
+                                             logger=self.logger)
 
-        # start any sockets here, i.e a trade socket
-        self.createWS()
-        # then start the socket manager
-        self.startWS()
+        #candles built with the trades of every symbol, the closed bars go to
+        #the queue. The backfill thread merges the missed trades in them too
+        self.candles = {symbol: candles.CandleBuilder(symbol) for symbol in self.symbols}
+        self.candles_lock = threading.Lock()
+        #last prices published for the other processes (i.e. the telegram bot)
+        self.prices = {symbol: priceCache.PriceCache(symbol, price_cache, writer=True)
+                       for symbol in self.symbols} if price_cache else {}
+        self.backfillCandles()
+
+        #gaps in the trade ids, and the thread that recovers the missed trades
+        self.gaps = backfill.GapDetector()
+        self.backfiller = backfill.Backfiller(self.client, self.backfillTrade, on_filled=self.storeMerged,
+                                              logger=self.logger) if backfill_gaps else None
+        if self.backfiller is not None:
+            self.seedGaps()
+
+        if engine == 'threads':
+            # start any sockets here, i.e a trade socket
+            self.createWS()
+            # then start the socket manager
+            self.startWS()
+
+        if run:
+            self.run()
 
+    def run(self):
+        """
+        Supervise the websocket until the reader is closed by the user or by
+        an error. If the connection is lost, it is re-established.
+        """
+        if self.engine == 'asyncio':
+            return asyncio.run(self.run_async())
         try:
             while True:
+                time.sleep(self.poll_interval)
+                if self.restart_ws:
+                    self.restartWS()
+                if self.db.partition and time.monotonic() - self.last_rotation > 3600:
+                    self.rotatePartitions()
+                if self.db.stale_days:
+                    self.db.rebuild_stale_days()
+                if self.report is not None and time.monotonic() - self.last_report > self.report_interval:
+                    self.sendReport()
                 if not self.bm.isAlive():
-                    #if the connection is lost, wait for a second and reconnect.
-                    self.logger.error("The connection was lost, maybe from the server side")
-                    self.logger.debug("trying to reconnect")
-                    time.sleep(1)
-                    self.bm.start()
-                    if self.bm.isAlive():
-                        self.logger.debug("connection re-established")
-                    else:
-                        self.logger.error("Could not reconnect, sleeping for 1 minute and retry")
-                        time.sleep(60)
+                    self.reconnect()
         except KeyboardInterrupt:
             self.logger.info("BTCReader closed by user")
             self.closeWS()
-            self.db.close()
+            self.closeDB()
         except Exception:
             self.logger.exception("BTCReader closed by error")
             self.logger.debug("Clossing connection to the websocket and database")
             self.closeWS()
-            self.db.close()
+            self.closeDB()
             sys.exit()
 
+    def reconnect(self):
+        """
+        If the connection is lost, wait for a second and reconnect. If it can
+        not reconnect, wait for 1 minute before the next try.
+        """
+        self.logger.error("The connection was lost, maybe from the server side")
+        self.logger.debug("trying to reconnect")
+        time.sleep(1)
+        self.bm.start()
+        if self.bm.isAlive():
+            self.logger.debug("connection re-established")
+        else:
+            self.logger.error("Could not reconnect, sleeping for 1 minute and retry")
+            time.sleep(60)
+
+    def sendReport(self):
+        """
+        Send the number of messages received by symbol since the last report.
+        """
+        self.last_report = time.monotonic()
+        counts, self.msg_count = self.msg_count, {}
+        try:
+            self.report(counts)
+        except Exception:
+            self.logger.exception("Error sending the report")
+
+    def backoff(self, attempt):
+        """
+        Seconds to wait before the reconnection number attempt: exponential
+        backoff with full jitter, so the sockets do not reconnect all at once.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def run_async(self):
+        """
+        asyncio engine. Every combined websocket is read by its own task, and
+        the periodic jobs (rotation of partitions, reports) are tasks too, so
+        the loop is idle while there are no messages. SIGINT and SIGTERM close
+        the reader cleanly: the tasks are cancelled and the queue is flushed.
+        """
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            #a worker of the supervisor ignores SIGINT, keep it like that
+            if signal.getsignal(sig) is not signal.SIG_IGN:
+                loop.add_signal_handler(sig, stop.set)
+        streams = ['{}@trade'.format(symbol.lower()) for symbol in self.symbols]
+        tasks = [asyncio.create_task(self.read_socket(streams[i:i + self.streams_per_socket]))
+                 for i in range(0, len(streams), self.streams_per_socket)]
+        tasks.append(asyncio.create_task(self.periodic_jobs()))
+        waiter = asyncio.create_task(stop.wait())
+        try:
+            done, _ = await asyncio.wait(tasks + [waiter], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not waiter and task.exception() is not None:
+                    self.logger.error("BTCReader closed by error", exc_info=task.exception())
+            if waiter in done:
+                self.logger.info("BTCReader closed by user")
+        finally:
+            for task in tasks + [waiter]:
+                task.cancel()
+            await asyncio.gather(*tasks, waiter, return_exceptions=True)
+            self.logger.debug("Clossing connection to the websocket and database")
+            #the writers flush the queue in other threads, do not block the loop
+            await loop.run_in_executor(None, self.closeWS)
+            self.closeDB()
+
+    async def read_socket(self, streams):
+        """
+        Read a combined websocket forever. When the connection is lost it is
+        re-established after a backoff, that grows with every failed attempt
+        and is reset when the messages arrive again.
+        """
+        import websockets
+        url = self.stream_url + '/'.join(streams)
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            try:
+                async with websockets.connect(url, ping_interval=60, ping_timeout=60) as ws:
+                    self.logger.debug("Websocket connected with {} streams".format(len(streams)))
+                    async for message in ws:
+                        attempt = 0
+                        msg = json.loads(message)
+                        if self.queue.queue.full():
+                            #a put would block the loop, wait in a thread
+                            await loop.run_in_executor(None, self.process_message, msg)
+                        else:
+                            self.process_message(msg)
+                self.logger.error("The connection was closed, maybe from the server side")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.exception("The connection was lost")
+            self.reconnect_count += 1
+            delay = self.backoff(attempt)
+            attempt += 1
+            self.logger.debug("trying to reconnect in {:.1f} seconds".format(delay))
+            await asyncio.sleep(delay)
+
+    async def periodic_jobs(self):
+        """
+        Rotation of the partitions, rebuild of the stale days of the daily
+        summary and reports, for the asyncio engine.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.db.partition and time.monotonic() - self.last_rotation > 3600:
+                await loop.run_in_executor(None, self.runInThread, self.rotatePartitions)
+            if self.db.stale_days:
+                await loop.run_in_executor(None, self.runInThread, self.db.rebuild_stale_days)
+            if self.report is not None and time.monotonic() - self.last_report > self.report_interval:
+                self.sendReport()
+            await asyncio.sleep(self.poll_interval)
+
+    def select_symbols(self, symbols=None, quote_asset=None):
+        """
+        List of symbols to read. If quote_asset is defined, all the symbols in
+        trading with that quote asset in the exchange info.
+        """
+        if quote_asset:
+            return [s['symbol'] for s in self.exchange_info['symbols']
+                    if s['quoteAsset'] == quote_asset.upper() and s['status'] == 'TRADING']
+        if symbols:
+            return [symbol.upper() for symbol in symbols]
+        return ['BTCUSDT']
+
+    def open_db(self, pool_size=5, partition=None, retention=None):
+        """
+        Create a new handle to the database.
+        """
+        return DBtools.DB(host = self.__mysql_host,
+                          port=self.__mysql_port,
+                          user=self.__mysql_user,
+                          password=self.__mysql_password,
+                          db = 'binance',
+                          logger = self.logger,
+                          pool_size = pool_size,
+                          partition = partition,
+                          retention = retention,
+                          summary = True)
+
+    def create_writer(self):
+        """
+        Create a buffered writer for a writer thread.
+        """
+        return tradeWriter.TradeWriter(self.db, logger=self.logger,
+                                       trade_log=self.trade_log,
+                                       store_db=self.store_db)
+
+    def rotatePartitions(self):
+        """
+        Create the next partitions of the ticker tables and drop the ones out
+        of the retention.
+        """
+        self.last_rotation = time.monotonic()
+        for symbol in self.symbols:
+            try:
+                if self.db.exist_table(symbol):
+                    self.db.rotate_partitions(symbol)
+            except Exception:
+                self.logger.exception("Error rotating the partitions of {}".format(symbol))
+
+    def runInThread(self, function):
+        """
+        Run a job of the database (i.e. the rotation of the partitions) from a
+        thread of the executor (asyncio engine). The connection of the thread
+        goes back to the pool at the end, the next job may run in another
+        thread.
+        """
+        try:
+            return function()
+        finally:
+            self.db.release()
+
+    def backfillCandles(self):
+        """
+        Rebuild the bars not persisted since the last run from the trades
+        already stored in the database.
+        """
+        for symbol, builder in self.candles.items():
+            try:
+                count = builder.backfill(self.db, self.queue.put)
+                self.logger.info("{} bars of {} backfilled from the stored trades".format(count, symbol))
+            except Exception:
+                self.logger.exception("Error backfilling the candles of {}".format(symbol))
+
+    def seedGaps(self):
+        """
+        Start the gap detection from the last trade stored of every symbol, so
+        the trades missed since the last run are backfilled.
+        """
+        for symbol in self.symbols:
+            try:
+                if self.db.exist_table(symbol):
+                    self.gaps.seed(symbol, self.db.read_last_trade_id(symbol))
+            except Exception:
+                self.logger.exception("Error reading the last trade id of {}".format(symbol))
+
+    def closeDB(self):
+        """
+        Close the connections to the database of all the writers, the price
+        caches and the trade log.
+        """
+        self.db.close()
+        for cache in self.prices.values():
+            cache.close()
+        if self.trade_log is not None:
+            self.trade_log.close()
+
     def startWS(self):
         """
         Start the websocket communication
@@ -82,53 +385,102 @@ class BTCreader():
         
     def closeWS(self):
         """
-        Close the websocket communication
+        Close the websocket communication and wait until the writers flush the
+        trades still in the queue.
         """
-        self.bm.close()
+        if self.bm is not None:
+            self.bm.close()
+        if self.backfiller is not None:
+            self.backfiller.close(timeout=60)
+            self.logger.debug("Backfill stats: {}".format(self.backfiller.stats()))
+        self.logger.debug("Gap stats: {}".format(self.gaps.stats()))
+        self.queue.close()
+        self.logger.debug("Ingest stats: {}".format(self.queue.stats()))
         
     def createWS(self):
         """
-        Create the websocket and get the conn_key
+        Create the combined websockets of the trades of all the symbols, and
+        get the conn_keys. Every socket has at most streams_per_socket
+        streams.
+        """
+        streams = ['{}@trade'.format(symbol.lower()) for symbol in self.symbols]
+        self.conn_keys = [self.bm.start_multiplex_socket(streams[i:i + self.streams_per_socket], self.process_message)
+                          for i in range(0, len(streams), self.streams_per_socket)]
+        self.conn_key = self.conn_keys[0]
+
+    def restartWS(self):
+        """
+        Generate again the websocket after the max reconnect retries. It is
+        called from the main loop, so the callback thread never sleeps.
         """
-        self.conn_key = self.bm.start_trade_socket(self.ticker, self.process_message)
+        self.restart_ws = False
+        time.sleep(60)
+        self.logger.debug("Trying to generate again the WS")
+        self.createWS()
+        self.startWS()
+        if self.bm.isAlive():
+            self.logger.debug("And it's alive again!")
+        else:
+            self.logger.error("Ups, no this time budy")
         
+    def backfillTrade(self, symbol, trade):
+        """
+        Sink of the backfill thread. The missed trade is stored like the live
+        ones and merged in its candles. It is older than the live trades, so
+        it is not published to the price cache.
+        """
+        with self.candles_lock:
+            self.candles[symbol].merge(trade.trade_time, trade.price, trade.quantity, trade.trade_id)
+        self.queue.put(symbol, trade)
+
+    def storeMerged(self, symbol):
+        """
+        Store again the closed candles changed by the trades of a gap.
+        """
+        builder = self.candles[symbol]
+        with self.candles_lock:
+            merged = builder.pop_merged()
+        for interval, bar in merged:
+            self.queue.put(builder.table(interval), builder.to_row(bar))
+        if merged:
+            self.logger.info("{} candles of {} updated with the backfilled trades".format(len(merged), symbol))
+
     def process_message(self, msg):
         """"
-        The method to process the msg received in the WebSocket
+        The method to process the msg received in the WebSocket.
+        It only parses the message and puts the trade in the queue, the
+        database is written by the writer threads.
         """
+        #the combined streams wrap the message with the name of the stream
+        if 'data' in msg:
+            msg = msg['data']
         if msg['e'] == 'error':
             if msg['m'] == 'Max reconnect retries reached':
                 self.logger.error("Max recconect retries reached")
-                time.sleep(60)
-                self.logger.debug("Trying to generate again the WS")
-                # sleep gor 1 minute
-                self.createWS()
-                self.startWS()
-                if self.bm.isAlive():
-                    self.logger.debug("And it's alive again!")
-                else:
-                    self.logger.error("Ups, no this time budy")
+                # the main loop will wait 1 minute and generate again the WS
+                self.restart_ws = True
             else:
                 self.logger.error("Error in the message. The message said:{}".format(msg))
-                self.logger.debug("Sleeping for 1 sec to prevent more errors.")
-                time.sleep(1)
         else:
-            # process message normally
-            msg['E'] = datetime.fromtimestamp(int(msg['E'])/1000).strftime('%Y-%m-%d %H:%M:%S.%f')
-            msg['T'] = datetime.fromtimestamp(int(msg['T'])/1000).strftime('%Y-%m-%d %H:%M:%S.%f')
-            data = {'event_time':msg['E'],
-                    'trade_id':msg['t'],
-                    'price':msg['p'],
-                    'quantity':msg['q'],
-                    'bid_id':msg['b'],
-                    'ask_id':msg['a'],
-                    'trade_time':msg['T'],
-                    'maker':msg['m']}
-            #the ignore field will be ignored.
-            if not self.db.exist_table(msg['s']):
-                self.db.create_ticker_table(msg['s'])
-            self.db.appendMD(table=msg['s'],MD=data)
-            self.logger.debug("Trade stored in the database")
+            # process message normally, the ignore field will be ignored.
+            trade = trades.parse_trade(msg)
+            self.msg_count[msg['s']] = self.msg_count.get(msg['s'], 0) + 1
+            gap = self.gaps.check(msg['s'], trade.trade_id)
+            if gap is not None:
+                self.logger.error("Gap of {} trades in {} ({}-{})".format(gap[1] - gap[0] + 1, msg['s'], *gap))
+                if self.backfiller is not None:
+                    self.backfiller.request(msg['s'], *gap)
+            builder = self.candles[msg['s']]
+            cache = self.prices.get(msg['s'])
+            with self.candles_lock:
+                closed = builder.update(trade.trade_time, trade.price, trade.quantity, trade.trade_id)
+            for interval, bar in closed:
+                self.queue.put(builder.table(interval), builder.to_row(bar))
+                if cache is not None and interval == '1m':
+                    cache.publish_bar(bar)
+            if cache is not None:
+                cache.publish(trade)
+            self.queue.put(msg['s'], trade)
         
         
         
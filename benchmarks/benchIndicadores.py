@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the indicator layer (utils.indicadores and
+utils.indicadoresEngine) on synthetic BTCUSDT data of several sizes.
+
+Every indicator, the resampling of ticks to bars (getOHLC, getOHLC_fast) and
+the whole get_indicators pipeline are timed (best of several runs), and run
+once more under tracemalloc to record the peak memory, and the memory and
+blocks still allocated by the result. The data is deterministic (seeded), so
+two runs can be compared, and the results are saved as json.
+
+    python -m benchmarks.benchIndicadores --sizes 10000 100000 1000000
+    python -m benchmarks.benchIndicadores --sizes 10000000 --cases RSI ADX --repeat 1
+    python -m benchmarks.benchIndicadores --output new.json --compare old.json
+"""
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from utils import indicadores, indicadoresEngine
+from benchmarks.benchOHLC import synthetic_day
+
+#metrics compared between runs
+METRICS = ('seconds', 'peak_bytes')
+
+
+def synthetic_bars(bars, seed=0):
+    """
+    DataFrame of 1 minute BTCUSDT bars with Open, High, Low, Close and Volume,
+    as returned by getOHLC.
+    """
+    rng = np.random.default_rng(seed)
+    close = 10000 + np.cumsum(rng.normal(0, 5, bars))
+    open = np.r_[close[0], close[:-1]]
+    high = np.maximum(open, close) + rng.exponential(2, bars)
+    low = np.minimum(open, close) - rng.exponential(2, bars)
+    volume = rng.exponential(10, bars)
+    index = pd.date_range('2020-01-01', periods=bars, freq='1min', name='trade_time')
+    return pd.DataFrame({'Open': open, 'High': high, 'Low': low, 'Close': close, 'Volume': volume},
+                        index=index)
+
+
+#case -> (data, function of the data)
+CASES = {'MACD': ('bars', lambda df: indicadores.MACD(df, columna='Close')),
+         'RSI': ('bars', lambda df: indicadores.RSI(df, columna='Close')),
+         'VWAP': ('bars', lambda df: indicadores.VWAP(df, column_price='Close', column_volume='Volume')),
+         'ROC': ('bars', lambda df: indicadores.ROC(df, n=5, column_name='Close')),
+         'STOCHASTIC': ('bars', lambda df: indicadores.STOCHASTIC(df, column_name='Close')),
+         'BB': ('bars', lambda df: indicadores.BB(df, column_price='Close')),
+         'ATR': ('bars', lambda df: indicadores.ATR(df)),
+         'ADX': ('bars', lambda df: indicadores.ADX(df)),
+         'PCT_CHANGE': ('bars', lambda df: indicadores.PCT_CHANGE(df, col_name='Close')),
+         'EASYMOVEMENT': ('bars', lambda df: indicadores.EASYMOVEMENT(df)),
+         'CCI': ('bars', lambda df: indicadores.CCI(df)),
+         'get_indicators': ('bars', indicadores.get_indicators),
+         'engine.get_indicators': ('bars', indicadoresEngine.get_indicators),
+         'getOHLC': ('ticks', lambda df: indicadores.getOHLC(df, period='1min')),
+         'getOHLC_fast': ('ticks', lambda df: indicadores.getOHLC_fast(df, period='1min'))}
+
+
+def measure(function, df, repeat):
+    """
+    Best time of repeat runs, and the memory of one run under tracemalloc.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = function(df)
+        best = min(best, time.perf_counter() - t0)
+        del result
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    result = function(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    diff = tracemalloc.take_snapshot().compare_to(before, 'filename')
+    tracemalloc.stop()
+    del result
+    return {'seconds': best,
+            'peak_bytes': peak,
+            'retained_bytes': sum(stat.size_diff for stat in diff),
+            'blocks': sum(stat.count_diff for stat in diff)}
+
+
+def run(sizes, cases, repeat, seed=0):
+    """
+    Run the cases over every size, and return the list of results.
+    """
+    results = []
+    for size in sizes:
+        data = {'bars': synthetic_bars(size, seed)}
+        if any(CASES[case][0] == 'ticks' for case in cases):
+            data['ticks'] = synthetic_day(size, seed)
+        for case in cases:
+            kind, function = CASES[case]
+            result = {'case': case, 'data': kind, 'size': size}
+            try:
+                result.update(measure(function, data[kind], repeat if size < 1000000 else 1))
+            except Exception as e:
+                result['error'] = '{}: {}'.format(type(e).__name__, e)
+            results.append(result)
+            print('{:<24}{:>10}{:>12}{:>14}{:>14}{:>12}'.format(
+                case, size,
+                '{:.4f}'.format(result['seconds']) if 'seconds' in result else '-',
+                '{:.1f}'.format(result['peak_bytes'] / 2**20) if 'peak_bytes' in result else '-',
+                '{:.1f}'.format(result['retained_bytes'] / 2**20) if 'retained_bytes' in result else '-',
+                result['blocks'] if 'blocks' in result else '  ' + result['error']))
+    return results
+
+
+def compare(results, previous, tolerance):
+    """
+    List of the cases worse than in the previous run by more than tolerance.
+    """
+    old = {(r['case'], r['size']): r for r in previous['results']}
+    regressions = []
+    for result in results:
+        base = old.get((result['case'], result['size']))
+        if base is None:
+            continue
+        for metric in METRICS:
+            if not base.get(metric) or metric not in result:
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            if change > tolerance:
+                regressions.append('{} {} {}: {:.4g} -> {:.4g} ({:+.0%})'.format(
+                    result['case'], result['size'], metric, base[metric], result[metric], change))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the indicators')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='rows of the synthetic data (bars or ticks)')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every case (1 from 1M rows)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='json file with the results')
+    parser.add_argument('--compare', help='json file of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed change before flagging a regression')
+    args = parser.parse_args()
+
+    print('{:<24}{:>10}{:>12}{:>14}{:>14}{:>12}'.format('case', 'size', 'seconds', 'peak (MB)', 'retained (MB)', 'blocks'))
+    results = run(args.sizes, args.cases, args.repeat, args.seed)
+    report = {'meta': {'date': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'pandas': pd.__version__,
+                       'machine': platform.machine(),
+                       'seed': args.seed,
+                       'repeat': args.repeat},
+              'results': results}
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        report['regressions'] = regressions
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Results saved in {}'.format(args.output))
+    if regressions:
+        raise SystemExit(1)
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+End to end benchmark of the ingest path, without a Binance connection.
+
+Synthetic (or recorded) trade messages are replayed into
+BTCreader.process_message by a local stand-in of the BinanceSocketManager,
+at a constant rate, with bursts, or as fast as possible. The trades go
+through the ingest queue and the writers into a sink: a SQLite file (default)
+or the MySQL server of credentials.py. The benchmark reports the throughput,
+the p50/p99 latency of the batch inserts, the queue lag and the CPU per
+message, and compares them with a baseline. The baselines of every scenario
+are kept in benchmarks/baselines/ingest.json, measured on one machine: save
+them again (--save-baseline) before comparing runs on another machine.
+
+    python -m benchmarks.benchIngest --messages 200000 --rate 0
+    python -m benchmarks.benchIngest --rate 5000 --shape burst --burst-factor 10
+    python -m benchmarks.benchIngest --replay trades.jsonl --sink mysql
+    python -m benchmarks.benchIngest --save-baseline
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy as np
+import BTCreader as reader
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines', 'ingest.json')
+
+#metric -> True if higher is better
+METRICS = {'throughput': True,
+           'insert_p50_ms': False,
+           'insert_p99_ms': False,
+           'lag_p99_ms': False,
+           'cpu_us_per_msg': False}
+
+
+def synthetic_messages(messages, symbols=('BTCUSDT',), seed=0):
+    """
+    List of combined stream messages (json text, like they arrive in the
+    websocket) with trades of the symbols, round robin.
+    """
+    rng = np.random.default_rng(seed)
+    price = 10000 + np.cumsum(rng.normal(0, 0.5, messages))
+    quantity = rng.exponential(0.05, messages)
+    maker = rng.random(messages) > 0.5
+    start = 1577836800000
+    result = []
+    for i in range(messages):
+        symbol = symbols[i % len(symbols)]
+        t = start + i
+        result.append(json.dumps({'stream': '{}@trade'.format(symbol.lower()),
+                                  'data': {'e': 'trade', 'E': t, 's': symbol, 't': i // len(symbols),
+                                           'p': '{:.2f}'.format(price[i]), 'q': '{:.6f}'.format(quantity[i]),
+                                           'b': 2 * i, 'a': 2 * i + 1, 'T': t, 'm': bool(maker[i]), 'M': True}}))
+    return result
+
+
+def recorded_messages(path, messages=None):
+    """
+    Messages recorded from the websocket, one json per line.
+    """
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return lines[:messages] if messages else lines
+
+
+def schedule(rate, shape='constant', burst_factor=10, burst_length=1.0, burst_every=10.0):
+    """
+    Function of the elapsed seconds that returns the rate (messages by
+    second) of the shape. A rate of 0 means as fast as possible.
+    """
+    if shape == 'burst':
+        return lambda t: rate * burst_factor if t % burst_every < burst_length else rate
+    return lambda t: rate
+
+
+class FakeClient():
+    """
+    Stand-in of binance.client.Client, without requests.
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_exchange_info(self):
+        return {'symbols': []}
+
+
+class FakeSocketManager():
+    """
+    Stand-in of binance.websockets.BinanceSocketManager. The messages are
+    decoded and sent to the callbacks from its own thread, like the real one.
+    """
+    messages = []
+    rate = staticmethod(schedule(0))
+
+    def __init__(self, client, user_timeout=None):
+        self.callbacks = []
+        self.thread = None
+        self.stopped = threading.Event()
+        self.sent = 0
+        self.elapsed = 0.0
+
+    def start_multiplex_socket(self, streams, callback):
+        self.callbacks.append(callback)
+        return 'fake-{}'.format(len(self.callbacks))
+
+    def _replay(self):
+        callback = self.callbacks[0]
+        start = time.perf_counter()
+        due = 0.0
+        for message in self.messages:
+            if self.stopped.is_set():
+                break
+            rate = self.rate(due)
+            if rate:
+                due += 1.0 / rate
+                wait = due - (time.perf_counter() - start)
+                if wait > 0.001:
+                    time.sleep(wait)
+            callback(json.loads(message))
+            self.sent += 1
+        self.elapsed = time.perf_counter() - start
+
+    def start(self):
+        self.thread = threading.Thread(target=self._replay, name='fake-socket', daemon=True)
+        self.thread.start()
+
+    def isAlive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def close(self):
+        self.stopped.set()
+
+
+class SQLiteSink():
+    """
+    Stand-in of DBtools.DB with the methods used by the ingest path, over a
+    SQLite file. Every thread has its own connection.
+    """
+    partition = None
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.tables = set()
+        self.lock = threading.Lock()
+
+    @property
+    def con(self):
+        if not hasattr(self.local, 'con'):
+            self.local.con = sqlite3.connect(self.path, timeout=60)
+            self.local.con.execute('PRAGMA journal_mode=WAL')
+            self.local.con.execute('PRAGMA synchronous=NORMAL')
+        return self.local.con
+
+    def exist_table(self, table):
+        return table in self.tables
+
+    def create_table(self, table, columns, key):
+        with self.lock:
+            if table not in self.tables:
+                self.con.execute("CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY ({}))".format(
+                    table, ', '.join(columns), key))
+                self.tables.add(table)
+
+    def create_candle_table(self, table):
+        self.create_table(table, ['open_time', 'open', 'high', 'low', 'close', 'volume', 'trades'], 'open_time')
+
+    def read_last_candle(self, symbol='BTCUSDT', interval='1m'):
+        return None
+
+    def read_table_chunks(self, *args, **kwargs):
+        return iter(())
+
+    def appendMDmany(self, table, rows, ignore=True):
+        if hasattr(rows[0], '_fields'):
+            columns = rows[0]._fields
+            values = rows
+        else:
+            columns = list(rows[0].keys())
+            values = [[row[c] for c in columns] for row in rows]
+        if table not in self.tables:
+            self.create_table(table, columns, 'trade_id' if 'trade_id' in columns else 'open_time')
+        self.con.executemany("INSERT {}INTO {} ({}) VALUES ({})".format(
+            'OR IGNORE ' if ignore else '', table, ', '.join(columns), ', '.join('?' * len(columns))), values)
+        self.con.commit()
+        return len(rows)
+
+    def close(self):
+        pass
+
+
+class TimedSink():
+    """
+    Proxy of a sink that records the latency of every batch insert.
+    """
+    def __init__(self, sink):
+        self.sink = sink
+        self.latencies = []
+
+    def __getattr__(self, name):
+        return getattr(self.sink, name)
+
+    def appendMDmany(self, table, rows, ignore=True):
+        t0 = time.perf_counter()
+        n = self.sink.appendMDmany(table, rows, ignore=ignore)
+        self.latencies.append(time.perf_counter() - t0)
+        return n
+
+
+class BenchReader(reader.BTCreader):
+    """
+    BTCreader writing to the benchmark sink.
+    """
+    sink = None
+
+    def open_db(self, pool_size=5, partition=None, retention=None):
+        return self.sink
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(messages, rate_function, sink, writers=1, backpressure='block', queue_size=10000,
+        symbols=('BTCUSDT',)):
+    """
+    Replay the messages into a BTCreader and return the metrics.
+    """
+    reader.Client = FakeClient
+    reader.BinanceSocketManager = FakeSocketManager
+    FakeSocketManager.messages = messages
+    FakeSocketManager.rate = staticmethod(rate_function)
+    BenchReader.sink = TimedSink(sink)
+    cpu0 = cpu_time()
+    t0 = time.perf_counter()
+    bench = BenchReader(symbols=list(symbols), queue_size=queue_size, backpressure=backpressure,
+                        writers=writers, partition=None, run=False, backfill_gaps=False,
+                        price_cache=None)
+    #sample the queue while the messages are replayed
+    lags, depths = [], []
+    while bench.bm.isAlive():
+        stats = bench.queue.stats()
+        lags.append(stats['last_lag'])
+        depths.append(stats['depth'])
+        time.sleep(0.01)
+    bench.closeWS()
+    elapsed = time.perf_counter() - t0
+    cpu = cpu_time() - cpu0
+    stats = bench.queue.stats()
+    latencies = np.array(BenchReader.sink.latencies) * 1000
+    lags = np.array(lags or [0.0]) * 1000
+    sent = bench.bm.sent
+    return {'messages': sent,
+            'offered_rate': sent / bench.bm.elapsed if bench.bm.elapsed else 0.0,
+            'throughput': sent / elapsed,
+            'insert_batches': len(latencies),
+            'insert_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            'insert_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+            'lag_p50_ms': float(np.percentile(lags, 50)),
+            'lag_p99_ms': float(np.percentile(lags, 99)),
+            'lag_max_ms': stats['max_lag'] * 1000,
+            'max_depth': stats['max_depth'],
+            'dropped': stats['dropped'],
+            'spilled': stats['spilled'],
+            'cpu_us_per_msg': cpu / sent * 1e6 if sent else 0.0}
+
+
+def compare(result, baseline, tolerance):
+    """
+    List of the metrics worse than the baseline by more than tolerance.
+    """
+    regressions = []
+    for metric, higher_is_better in METRICS.items():
+        old, new = baseline.get(metric), result.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append('{}: {:.3f} -> {:.3f} ({:+.0%})'.format(metric, old, new, change))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End to end benchmark of the ingest path')
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--replay', help='file with recorded messages, one json per line')
+    parser.add_argument('--symbols', nargs='+', default=['BTCUSDT'])
+    parser.add_argument('--rate', type=float, default=0, help='messages by second, 0 as fast as possible')
+    parser.add_argument('--shape', choices=['constant', 'burst'], default='constant')
+    parser.add_argument('--burst-factor', type=float, default=10)
+    parser.add_argument('--burst-length', type=float, default=1.0, help='seconds of every burst')
+    parser.add_argument('--burst-every', type=float, default=10.0, help='seconds between bursts')
+    parser.add_argument('--writers', type=int, default=1)
+    parser.add_argument('--backpressure', choices=['block', 'drop_oldest', 'spill'], default='block')
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--sink', choices=['sqlite', 'mysql'], default='sqlite')
+    parser.add_argument('--db', default='binance_bench', help='MySQL database of the mysql sink')
+    parser.add_argument('--baseline', default=BASELINES, help='json file with the baselines')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed change before flagging a regression')
+    parser.add_argument('--output', help='json file with the results')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger(__name__)
+    reader.createLogger.createLogger = lambda: logger
+
+    if args.replay:
+        messages = recorded_messages(args.replay, args.messages)
+    else:
+        messages = synthetic_messages(args.messages, args.symbols)
+
+    if args.sink == 'mysql':
+        from credentials import credentials_mysql
+        from utils.DBtools import DB
+        sink = DB(host=credentials_mysql['host'],
+                  port=credentials_mysql['port'],
+                  user=credentials_mysql['user'],
+                  password=credentials_mysql['password'],
+                  logger=logger,
+                  db=args.db,
+                  pool_size=args.writers + 1)
+        sink.connect()
+        for symbol in args.symbols:
+            sink.drop_table(symbol)
+    else:
+        folder = tempfile.mkdtemp(prefix='benchIngest')
+        sink = SQLiteSink(os.path.join(folder, 'ingest.db'))
+
+    scenario = '{}-{}-{}-{}w-{}'.format(args.sink, args.shape, int(args.rate), args.writers, args.backpressure)
+    result = run(messages, schedule(args.rate, args.shape, args.burst_factor, args.burst_length, args.burst_every),
+                 sink, writers=args.writers, backpressure=args.backpressure,
+                 queue_size=args.queue_size, symbols=args.symbols)
+
+    print(scenario)
+    for metric, value in result.items():
+        print('{:<16}{:>14.3f}'.format(metric, value))
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    regressions = compare(result, baselines[scenario], args.tolerance) if scenario in baselines else []
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'scenario': scenario, 'result': result, 'regressions': regressions}, f, indent=2)
+    if args.save_baseline:
+        baselines[scenario] = result
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print('Baseline saved in {}'.format(args.baseline))
+    if regressions:
+        raise SystemExit(1)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the resampling of raw trades to OHLCV bars.
+
+A synthetic day of BTCUSDT trades is resampled to several periods with
+indicadores.getOHLC (pandas resample) and with indicadores.getOHLC_fast
+(one pass with segment reductions over epoch ms), and the results are
+checked to be the same.
+
+    python -m benchmarks.benchOHLC --trades 2000000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from utils import indicadores
+
+
+def synthetic_day(trades, seed=0):
+    """
+    DataFrame of a day of trades, indexed by trade_time, with trade_id, price
+    and quantity. 0.1% of the trades are duplicated, as after a reconnection.
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2020-01-01T00:00:00', 'ms').astype(np.int64)
+    times = np.sort(start + rng.integers(0, 24*60*60*1000, trades))
+    price = 10000 + np.cumsum(rng.normal(0, 0.5, trades))
+    quantity = rng.exponential(0.05, trades)
+    trade_id = np.arange(trades, dtype=np.int64)
+    dup = np.sort(rng.choice(trades, trades // 1000, replace=False))
+    take = np.sort(np.r_[np.arange(trades), dup])
+    return pd.DataFrame({'trade_id': trade_id[take], 'price': price[take], 'quantity': quantity[take]},
+                        index=pd.DatetimeIndex(times[take].astype('datetime64[ms]'), name='trade_time'))
+
+
+def best_of(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of getOHLC')
+    parser.add_argument('--trades', type=int, default=2000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = synthetic_day(args.trades)
+    print('{} trades'.format(len(df)))
+    print('{:<8}{:>14}{:>14}{:>10}{:>8}'.format('period', 'getOHLC (s)', 'fast (s)', 'speedup', 'same'))
+    for period in ['1s', '1min', '5min', '1h', '1D']:
+        old, ohlc = best_of(lambda: indicadores.getOHLC(df.drop_duplicates(subset='trade_id').copy(), period=period), args.repeat)
+        new, fast = best_of(lambda: indicadores.getOHLC_fast(df, period=period), args.repeat)
+        ohlc = ohlc.dropna(subset=['open'])
+        same = np.allclose(ohlc[['open', 'high', 'low', 'close', 'volume']].to_numpy(),
+                           fast[['open', 'high', 'low', 'close', 'volume']].to_numpy())
+        print('{:<8}{:>14.4f}{:>14.4f}{:>10.1f}{:>8}'.format(period, old, new, old / new, str(same)))
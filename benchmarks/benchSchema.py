@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the queries of the bot and the reader over the ticker table
+schema version 1 (no keys) and the current version.
+
+Two tables are filled with the same synthetic trades, and the queries of
+read_last_row, read_last_price and read_table (last hour) are timed on both.
+It needs a MySQL server configured in credentials.py.
+
+    python -m benchmarks.benchSchema --rows 1000000
+"""
+import argparse
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from credentials import credentials_mysql
+from utils.DBtools import DB, TICKER_TABLE, TICKER_TABLE_V1, TICKER_COLUMNS
+
+TABLES = {'BENCH_SCHEMA_V1': TICKER_TABLE_V1, 'BENCH_SCHEMA_V2': TICKER_TABLE}
+
+
+def fill(db, table, ddl, rows, chunksize=10000):
+    """
+    Create the table and fill it with synthetic trades, one per 100 ms.
+    """
+    db.check_connection()
+    db.cursor.execute("DROP TABLE IF EXISTS {};".format(table))
+    db.cursor.execute(ddl.format(table))
+    db.con.commit()
+    random.seed(0)
+    start = datetime(2020, 1, 1)
+    price = 10000.0
+    query = db.insert_query(table, TICKER_COLUMNS)
+    for first in range(0, rows, chunksize):
+        batch = []
+        for trade_id in range(first, min(first + chunksize, rows)):
+            price = max(price + random.gauss(0, 5), 1)
+            t = (start + timedelta(milliseconds=100*trade_id)).strftime('%Y-%m-%d %H:%M:%S.%f')
+            batch.append((t, trade_id, round(price, 2), round(random.random(), 6),
+                          trade_id*2, trade_id*2+1, t, random.random() > 0.5))
+        db.cursor.executemany(query, batch)
+        db.con.commit()
+    return start + timedelta(milliseconds=100*rows)
+
+
+def timeit(db, query, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        db.fetchall(query)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the ticker table schemas')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db', default='binance')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = DB(host=credentials_mysql['host'],
+            port=credentials_mysql['port'],
+            user=credentials_mysql['user'],
+            password=credentials_mysql['password'],
+            logger=logging.getLogger(__name__),
+            db=args.db)
+
+    results = {}
+    for table, ddl in TABLES.items():
+        t0 = time.perf_counter()
+        end = fill(db, table, ddl, args.rows)
+        load = time.perf_counter() - t0
+        start_date = (end - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+        queries = {'load ({} rows)'.format(args.rows): None,
+                   'read_last_row': "SELECT * FROM {} ORDER BY event_time DESC LIMIT 1;".format(table),
+                   'read_last_price': "SELECT price FROM {} ORDER BY event_time DESC LIMIT 1;".format(table),
+                   'read_table (1 hour)': "SELECT * FROM {} WHERE trade_time>'{}' ORDER BY trade_time ASC ;".format(table, start_date)}
+        results[table] = {name: (load if query is None else timeit(db, query, args.repeat))
+                          for name, query in queries.items()}
+
+    names = list(results['BENCH_SCHEMA_V1'].keys())
+    print('{:<25}{:>15}{:>15}{:>10}'.format('query', 'v1 (s)', 'v2 (s)', 'speedup'))
+    for name in names:
+        v1, v2 = results['BENCH_SCHEMA_V1'][name], results['BENCH_SCHEMA_V2'][name]
+        print('{:<25}{:>15.4f}{:>15.4f}{:>10.1f}'.format(name, v1, v2, v1 / v2 if v2 else float('inf')))
+    for table in TABLES:
+        db.cursor.execute("DROP TABLE IF EXISTS {};".format(table))
+    db.close()
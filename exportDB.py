@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Export the ticker tables to Parquet files partitioned by date. Every run
+exports only the trades not exported yet.
+
+    python exportDB.py BTCUSDT --folder data/parquet
+"""
+import argparse
+import logging
+from credentials import credentials_mysql
+from utils.DBtools import DB
+from utils import exporter
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export ticker tables to Parquet')
+    parser.add_argument('tables', nargs='+', help='tables (tickers) to export')
+    parser.add_argument('--folder', default='data/parquet', help='root folder of the Parquet files')
+    parser.add_argument('--chunksize', type=int, default=200000, help='rows per chunk')
+    parser.add_argument('--db', default='binance', help='database name')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    db = DB(host=credentials_mysql['host'],
+            port=credentials_mysql['port'],
+            user=credentials_mysql['user'],
+            password=credentials_mysql['password'],
+            logger=logger,
+            db=args.db)
+    for table in args.tables:
+        count = exporter.export_table(db, table, folder=args.folder, chunksize=args.chunksize, logger=logger)
+        logger.info("{} trades of {} exported to {}".format(count, table, args.folder))
+    db.close()
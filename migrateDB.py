@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Migrate the ticker tables to the current version of the schema.
+
+    python migrateDB.py BTCUSDT ETHUSDT
+    python migrateDB.py BTCUSDT --in-place
+    python migrateDB.py BTCUSDT --chunksize 100000
+    python migrateDB.py BTCUSDT --partition day
+    python migrateDB.py BTCUSDT --summary
+"""
+import argparse
+import logging
+from credentials import credentials_mysql
+from utils.DBtools import DB
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate ticker tables to the current schema')
+    parser.add_argument('tables', nargs='+', help='tables (tickers) to migrate')
+    parser.add_argument('--in-place', action='store_true', help='use ALTER TABLE instead of copying in chunks')
+    parser.add_argument('--chunksize', type=int, default=50000, help='rows per chunk when copying')
+    parser.add_argument('--partition', choices=['day', 'month'], help='also partition the tables by trade_time')
+    parser.add_argument('--summary', action='store_true', help='also rebuild the daily summary of the tables')
+    parser.add_argument('--db', default='binance', help='database name')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    db = DB(host=credentials_mysql['host'],
+            port=credentials_mysql['port'],
+            user=credentials_mysql['user'],
+            password=credentials_mysql['password'],
+            logger=logger,
+            db=args.db)
+    db.connect()
+    for table in args.tables:
+        db.migrate_ticker_table(table, chunksize=args.chunksize, in_place=args.in_place)
+        if args.partition and not db.list_partitions(table):
+            db.partition_table(table, period=args.partition)
+        if args.summary:
+            db.rebuild_daily_summary(table)
+    db.close()
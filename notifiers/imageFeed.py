@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Prefetched image URLs for the /dog and /cat commands of the telegram bot.
+
+The random image APIs are slow and sometimes return videos, so a background
+thread keeps a bounded ring of image URLs ready, and the commands only take
+one from it. All the requests share a pooled HTTP session.
+"""
+import collections
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def create_session(pool_size=10):
+    """
+    HTTP session with a pool of keep-alive connections, shared by all the
+    feeds and handlers.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ImageFeed():
+    def __init__(self, url, key, session=None, size=10, timeout=5,
+                 extensions=('jpg', 'jpeg', 'png'), logger=None):
+        """
+        url -> API that returns a json with the URL of a random image.
+        key -> key of the URL in the json (i.e. 'url' for random.dog).
+        session -> requests.Session used for the requests.
+        size -> maximum number of URLs prefetched.
+        timeout -> timeout of every request, in seconds.
+        extensions -> the URLs with other extensions are discarded.
+        """
+        if logger is None:
+            import logging
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+        self.url = url
+        self.key = key
+        self.session = session or create_session()
+        self.timeout = timeout
+        self.extensions = extensions
+        self.ring = collections.deque(maxlen=size)
+        self.cond = threading.Condition()
+        self.closed = False
+
+        #metrics
+        self.fetched = 0
+        self.discarded = 0
+        self.errors = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.thread = threading.Thread(target=self._fill, name='image-feed', daemon=True)
+        self.thread.start()
+
+    def fetch(self):
+        """
+        Request a random URL to the API. Return None if it is not an image.
+        """
+        url = self.session.get(self.url, timeout=self.timeout).json()[self.key]
+        if re.search("([^.]*)$", url).group(1).lower() not in self.extensions:
+            self.discarded += 1
+            return None
+        self.fetched += 1
+        return url
+
+    def _fill(self):
+        """
+        Prefetch thread. Keep the ring full, and wait when it is full. If the
+        API fails, wait a bit more after every error.
+        """
+        errors = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closed or len(self.ring) < self.ring.maxlen)
+                if self.closed:
+                    return
+            try:
+                url = self.fetch()
+                errors = 0
+            except Exception:
+                self.errors += 1
+                errors += 1
+                self.logger.exception("Error prefetching an image from {}".format(self.url))
+                time.sleep(min(60, 2 ** errors))
+                continue
+            if url is not None:
+                with self.cond:
+                    self.ring.append(url)
+                    self.cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Take a prefetched URL. If the ring is empty, wait for the prefetch
+        thread up to timeout seconds (the timeout of the requests by
+        default). Raise TimeoutError if there is no image yet.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self.cond:
+            if self.ring:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if not self.cond.wait_for(lambda: self.ring, timeout):
+                    raise TimeoutError("No image from {} in {} seconds".format(self.url, timeout))
+            url = self.ring.popleft()
+            self.cond.notify_all()
+            return url
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join(self.timeout)
+
+    def stats(self):
+        return {'ready': len(self.ring),
+                'fetched': self.fetched,
+                'discarded': self.discarded,
+                'errors': self.errors,
+                'hits': self.hits,
+                'misses': self.misses}
@@ -7,11 +7,10 @@ https://www.freecodecamp.org/news/learn-to-build-your-first-bot-in-telegram-with
 """
 
 from telegram.ext import Updater, CommandHandler, CallbackContext
-import requests
-import re
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from utils import indicadores
-import urllib, json
+from utils.priceCache import PriceCache
+from notifiers.imageFeed import ImageFeed, create_session
 from datetime import datetime, timedelta, time
 
 #Emojis
@@ -21,7 +20,28 @@ up_arrow = u'\U00002B06'
 
 class telegramBot():
     
-    def __init__(self, token, channel_id, DB, logger=None):
+    def __init__(self, token, channel_id, DB, logger=None, price_cache='data/prices',
+                 max_staleness=10, workers=8, handler_timeout=10, prefetch=10,
+                 dog_api='https://random.dog/woof.json',
+                 cat_api='http://aws.random.cat/meow', stats_interval=600, run=True):
+        """
+        token, channel_id -> credentials of the bot, and channel of the daily
+        message.
+        DB -> DBtools.DB instance with the prices. Every worker keeps its own
+        connection, so its pool needs at least workers + 1 connections (one
+        for the main thread).
+        price_cache -> folder of the prices published by the BTCreader.
+        max_staleness -> seconds of the cached price before reading the DB.
+        workers -> threads that run the commands, so the dispatcher never
+        waits for a slow command.
+        handler_timeout -> seconds before answering that a command is taking
+        too long.
+        prefetch -> image URLs kept ready for /dog and /cat.
+        dog_api, cat_api -> APIs of the random images (i.e. a local stub
+        server for the tests).
+        stats_interval -> seconds between the logs of stats() while polling.
+        run -> if True, start polling (see main()).
+        """
     #testing channel
     #channel_id = '-1001361357182'
     #BTCInfo channel
@@ -35,26 +55,89 @@ class telegramBot():
         #Store the DataBase class.
         self.db = DB
         self.db.connect()
-        
-        self.main()
+        #last price published by the BTCreader, the DB is used only if the
+        #price is older than max_staleness seconds
+        self.prices = PriceCache('BTCUSDT', price_cache) if price_cache else None
+        self.max_staleness = max_staleness
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.last_staleness = None
+        #the commands run in a pool of threads, and the images are prefetched
+        #with a pooled HTTP session
+        self.handler_timeout = handler_timeout
+        self.stats_interval = stats_interval
+        self.timeouts = 0
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tbot')
+        self.session = create_session(pool_size=workers)
+        self.dogs = ImageFeed(dog_api, 'url', session=self.session, size=prefetch,
+                              timeout=handler_timeout / 2, logger=self.logger)
+        self.cats = ImageFeed(cat_api, 'file', session=self.session, size=prefetch,
+                              timeout=handler_timeout / 2, logger=self.logger)
+
+        if run:
+            self.main()
+
+    def run_async(self, handler, timeout=None):
+        """
+        Wrap a command handler to run it in the pool of workers. If it does
+        not finish in timeout seconds (handler_timeout by default), the user
+        is told that it is taking too long.
+        """
+        timeout = timeout or self.handler_timeout
+        def callback(update, context):
+            future = self.pool.submit(self.run_handler, handler, update, context)
+            context.job_queue.run_once(lambda ctx: self.check_timeout(future, handler, update), timeout)
+        return callback
+
+    def run_handler(self, handler, update, context):
+        try:
+            handler(update, context)
+        except TimeoutError:
+            self.logger.error("Timeout in {}".format(handler.__name__))
+            self.reply_timeout(update)
+        except Exception:
+            self.logger.exception("Error in {}".format(handler.__name__))
+
+    def run_job(self, job, context):
+        try:
+            job(context)
+        except Exception:
+            self.logger.exception("Error in {}".format(job.__name__))
+
+    def check_timeout(self, future, handler, update):
+        if future.done():
+            return
+        self.timeouts += 1
+        #if it is still waiting for a worker, it is not needed anymore
+        future.cancel()
+        self.logger.error("{} is taking more than {} seconds".format(handler.__name__, self.handler_timeout))
+        self.reply_timeout(update)
+
+    def reply_timeout(self, update):
+        try:
+            update.message.reply_text('Estoy tardando demasiado, probá de nuevo en un rato')
+        except Exception:
+            self.logger.exception("Error sending the timeout message")
+
+    def last_price(self):
+        """
+        Last trade of BTCUSDT (price and trade_time). Read from the price
+        cache, or from the database if the cache is stale.
+        """
+        if self.prices is not None:
+            record = self.prices.read()
+            self.last_staleness = self.prices.staleness(record)
+            if record is not None and self.last_staleness <= self.max_staleness:
+                self.cache_hits += 1
+                return {'price': record['price'],
+                        'trade_time': datetime.utcfromtimestamp(record['trade_time'] / 1000)}
+            self.logger.info("The price cache is stale ({} s), reading the DB".format(self.last_staleness))
+        self.cache_misses += 1
+        return self.db.read_last_row()
 
-    def get_url(self):
-        contents = requests.get('https://random.dog/woof.json').json()    
-        url = contents['url']
-        return url
-    
-    def get_image_url(self):
-        allowed_extension = ['jpg','jpeg','png']
-        file_extension = ''
-        while file_extension not in allowed_extension:
-            url = self.get_url()
-            file_extension = re.search("([^.]*)$",url).group(1).lower()
-        return url
-    
-    
     def dog(self, update, context):
         self.logger.info('Wow, {} pidio la foto de un Perro!, este sabe!'.format(str(update.message.from_user.username)))
-        url = self.get_image_url()
+        url = self.dogs.get()
         chat_id = update.message.chat_id
         context.bot.send_photo(chat_id=chat_id, photo=url)
     
@@ -80,7 +163,7 @@ class telegramBot():
     
     def precioBTC(self, update, context):
         self.logger.info("{} quiere saber el precio del btc...".format(str(update.message.from_user.username)))
-        data = self.db.read_last_row()
+        data = self.last_price()
         context.bot.send_message(
             chat_id=update.message.chat_id,
             text="El último precio que tengo del BTC es: {} con fecha {} UTC".format(data['price'],data['trade_time'])
@@ -88,13 +171,28 @@ class telegramBot():
     
     def callback_daily(self, context: CallbackContext):
         self.logger.info("It's time for the daily price change!")
-        start_date = (datetime.now()-timedelta(days=2)).replace(hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S.%f')
-        data = self.db.read_table(start_date=start_date)
-        data.set_index('event_time', inplace=True)
-        ohlc = indicadores.getOHLC(data, period='1D')
-        #print(ohlc)
-        close_ytd = ohlc.loc[ohlc.index.day == (datetime.today()-timedelta(days=1)).day, 'close'].values
-        current_price = self.db.read_last_price()
+        #yesterday's close and the current price from the daily summary, in
+        #one lookup (today's close is the last trade stored)
+        today = datetime.utcnow().date()
+        days = {row['day']: row for row in self.db.read_daily_summary('BTCUSDT', days=2)}
+        yesterday = today - timedelta(days=1)
+        if yesterday in days:
+            close_ytd = days[yesterday]['close']
+        else:
+            #the last 1D bar is older if the reader was stopped yesterday
+            candle = self.db.read_last_candle(interval='1D')
+            if candle is not None and candle['open_time'].date() == yesterday:
+                close_ytd = candle['close']
+            else:
+                close_ytd = self.db.read_close('BTCUSDT', day=yesterday)
+        if close_ytd is None:
+            self.logger.warning("There is no close for {}, the daily message is not sent".format(yesterday))
+            return
+        close_ytd = float(close_ytd)
+        if today in days:
+            current_price = float(days[today]['close'])
+        else:
+            current_price = float(self.last_price()['price'])
     
         text = (
                 'Actualización del precio para el día de hoy:\n' +
@@ -116,23 +214,50 @@ class telegramBot():
     
     def cat(self, update, context):
         self.logger.info('Wow, {} pidio la foto de un gato!'.format(str(update.message.from_user.username)))
-        img_url = json.loads(urllib.request.urlopen('http://aws.random.cat/meow').read().decode())['file']
+        img_url = self.cats.get()
         context.bot.send_photo(chat_id=update.message.chat_id, photo=img_url)
     
     
     def main(self):
         updater = Updater(self.token, use_context=True)
         dp = updater.dispatcher
-        dp.add_handler(CommandHandler('dog',self.dog))
-        dp.add_handler(CommandHandler('cat',self.cat))
-        dp.add_handler(CommandHandler('start',self.help_callback))
-        dp.add_handler(CommandHandler('help',self.help_callback))
-        dp.add_handler(CommandHandler('precioBTC',self.precioBTC))
+        dp.add_handler(CommandHandler('dog',self.run_async(self.dog)))
+        dp.add_handler(CommandHandler('cat',self.run_async(self.cat)))
+        dp.add_handler(CommandHandler('start',self.run_async(self.help_callback)))
+        dp.add_handler(CommandHandler('help',self.run_async(self.help_callback)))
+        dp.add_handler(CommandHandler('precioBTC',self.run_async(self.precioBTC)))
         
-        #Add the daily message
+        #Add the daily message, it runs in the pool too to keep the job queue
+        #free for the timeouts
         j = updater.job_queue
-        j.run_daily(self.callback_daily, time=time(12, 0, 0))
+        j.run_daily(lambda context: self.pool.submit(self.run_job, self.callback_daily, context), time=time(12, 0, 0))
+        j.run_repeating(lambda context: self.logger.info("Bot stats: {}".format(self.stats())),
+                        interval=self.stats_interval, first=self.stats_interval)
     
         updater.start_polling()
         updater.idle()
+        self.close()
+
+    def stats(self):
+        """
+        Return the counters of the bot as a dict. price_staleness is the age
+        in seconds of the last write of the BTCreader to the price cache
+        (None if nothing was published), read now.
+        """
+        return {'price_staleness': self.prices.staleness() if self.prices is not None else None,
+                'last_staleness': self.last_staleness,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'timeouts': self.timeouts,
+                'dogs': self.dogs.stats(),
+                'cats': self.cats.stats()}
+
+    def close(self):
+        """
+        Stop the image feeds and the pool of workers.
+        """
+        self.dogs.close()
+        self.cats.close()
+        self.pool.shutdown(wait=True)
+        self.session.close()
     
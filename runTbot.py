@@ -8,15 +8,19 @@ from utils.DBtools import DB
 if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
     logger = logging.getLogger(__name__)   
+    #threads that run the commands, each one with its own connection
+    workers = 8
     
     db = DB(host=credentials_mysql['host'],
             port=credentials_mysql['port'],
             user=credentials_mysql['user'],
             password=credentials_mysql['password'],
             logger=logger,
-            db='binance')
+            db='binance',
+            pool_size=workers + 1)
     
     tBot(credentials_telegram['token_telegram'],
          credentials_telegram['channel_id'],
          DB=db,
-         logger=logger)
\ No newline at end of file
+         logger=logger,
+         workers=workers)
\ No newline at end of file
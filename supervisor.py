@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Read hundreds of symbols with several processes. The symbols are split in
+shards, and every shard is read by a BTCreader in its own process (with its
+own websockets, queue and DB writers). The supervisor restarts the workers
+that die, rebalances the symbols by message rate and logs the aggregate
+throughput.
+
+    python supervisor.py --quote-asset USDT --workers 4
+    python supervisor.py BTCUSDT ETHUSDT BNBUSDT --workers 2
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from utils import createLogger
+
+
+def balance(symbols, rates, n):
+    """
+    Split the symbols in n shards with similar message rate. Greedy bin
+    packing: the symbols are taken from the busiest one, and every symbol goes
+    to the shard with the lowest rate so far (or with less symbols, when the
+    rates are not known yet).
+    Return the list of shards and the list of rates of every shard.
+    """
+    shards = [[] for _ in range(n)]
+    loads = [0.0] * n
+    for symbol in sorted(symbols, key=lambda s: (-rates.get(s, 0.0), s)):
+        i = min(range(n), key=lambda j: (loads[j], len(shards[j])))
+        shards[i].append(symbol)
+        loads[i] += rates.get(symbol, 0.0)
+    return shards, loads
+
+
+def stop_reader(signum, frame):
+    """
+    Stop the reader of a worker like the user does with Ctrl+C, only once so
+    the reader can flush its queue.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def run_worker(index, symbols, reports, report_interval, reader_kwargs):
+    """
+    Entry point of a worker process. Run a BTCreader with the symbols of the
+    shard, and send its message counts to the supervisor.
+    The Ctrl+C of the terminal is handled only by the supervisor, which stops
+    the workers with SIGTERM.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, stop_reader)
+    from BTCreader import BTCreader
+
+    def report(counts):
+        reports.put((index, counts))
+
+    #every worker spills to its own file (i.e. spill/ingest-0.jsonl)
+    reader_kwargs = dict(reader_kwargs)
+    root, ext = os.path.splitext(reader_kwargs.get('spill_path', 'spill/ingest.jsonl'))
+    reader_kwargs['spill_path'] = '{}-{}{}'.format(root, index, ext)
+    BTCreader(symbols=symbols, report=report, report_interval=report_interval,
+              **reader_kwargs)
+
+
+class Worker():
+    """
+    A worker process and the shard of symbols it reads.
+    """
+    def __init__(self, index, symbols):
+        self.index = index
+        self.symbols = symbols
+        self.process = None
+        self.started = 0
+        self.retry_at = None
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class Supervisor():
+    #seconds a worker must be alive to restart it without waiting
+    min_uptime = 60
+
+    def __init__(self, symbols=None, quote_asset=None, workers=4,
+                 report_interval=10, rebalance_interval=600, tolerance=0.25,
+                 alpha=0.2, reader_kwargs=None, logger=None):
+        """
+        symbols -> list of symbols to read.
+        quote_asset -> if defined, read all the symbols in trading with this
+        quote asset (i.e. USDT), taken from the exchange info.
+        workers -> number of worker processes.
+        report_interval -> seconds between the reports of the workers (and the
+        throughput logs).
+        rebalance_interval -> seconds between rebalances of the shards.
+        tolerance -> the shards are rebalanced only when the busiest one has
+        more than (1 + tolerance) times the mean rate.
+        alpha -> smoothing factor of the message rate of every symbol.
+        reader_kwargs -> other arguments of every BTCreader (i.e. writers,
+        backpressure, partition). The index of the worker is added to the
+        spill_path, so the workers never share the spill file.
+        """
+        self.logger = logger or createLogger.createLogger()
+        self.report_interval = report_interval
+        self.rebalance_interval = rebalance_interval
+        self.tolerance = tolerance
+        self.alpha = alpha
+        self.reader_kwargs = reader_kwargs or {}
+        self.symbols = self.select_symbols(symbols, quote_asset)
+        n = max(1, min(workers, len(self.symbols)))
+        #messages by second of every symbol (smoothed)
+        self.rates = {}
+        self.counts = {}
+        self.received = 0
+        self.restarts = 0
+        self.rebalances = 0
+        self.reports = multiprocessing.Queue()
+        shards, _ = balance(self.symbols, self.rates, n)
+        self.workers = [Worker(i, shard) for i, shard in enumerate(shards)]
+        self.logger.info("Reading {} symbols with {} workers".format(len(self.symbols), n))
+
+    def select_symbols(self, symbols=None, quote_asset=None):
+        """
+        List of symbols to read. If quote_asset is defined, all the symbols in
+        trading with that quote asset in the exchange info.
+        """
+        if quote_asset:
+            from binance.client import Client
+            from credentials import credentials_binance
+            client = Client(credentials_binance['key'], credentials_binance['secret'],
+                            {'proxies': {'http': '', 'https': ''}})
+            return [s['symbol'] for s in client.get_exchange_info()['symbols']
+                    if s['quoteAsset'] == quote_asset.upper() and s['status'] == 'TRADING']
+        if symbols:
+            return [symbol.upper() for symbol in symbols]
+        return ['BTCUSDT']
+
+    def start_worker(self, worker):
+        """
+        Start the process of a worker.
+        """
+        worker.process = multiprocessing.Process(target=run_worker,
+                                                 args=(worker.index, worker.symbols,
+                                                       self.reports, self.report_interval,
+                                                       self.reader_kwargs),
+                                                 name='BTCreader-{}'.format(worker.index))
+        worker.process.start()
+        worker.started = time.monotonic()
+        worker.retry_at = None
+        self.logger.info("Worker {} started (pid {}) with {} symbols".format(
+            worker.index, worker.process.pid, len(worker.symbols)))
+
+    def stop_worker(self, worker, timeout=30):
+        """
+        Stop a worker with SIGTERM, so the reader closes the websockets and
+        flushes its queue. If it does not finish in timeout seconds, it is
+        killed.
+        """
+        if not worker.is_alive():
+            return
+        worker.process.terminate()
+        worker.process.join(timeout)
+        if worker.process.is_alive():
+            self.logger.error("Worker {} did not stop, killing it".format(worker.index))
+            worker.process.kill()
+            worker.process.join()
+
+    def check_workers(self):
+        """
+        Restart the dead workers. Like the reconnection of the websocket, wait
+        for a second and restart it. If it died soon after the last start,
+        wait for 1 minute before the next try.
+        """
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.is_alive():
+                continue
+            if worker.retry_at is None:
+                self.logger.error("Worker {} died (exit code {})".format(
+                    worker.index, worker.process.exitcode))
+                if now - worker.started < self.min_uptime:
+                    self.logger.error("Worker {} could not stay alive, retrying in 1 minute".format(worker.index))
+                    worker.retry_at = now + 60
+                else:
+                    worker.retry_at = now + 1
+            elif now >= worker.retry_at:
+                self.logger.debug("Restarting worker {}".format(worker.index))
+                self.restarts += 1
+                self.start_worker(worker)
+
+    def collect(self, timeout=1):
+        """
+        Read the reports of the workers and update the message rate of every
+        symbol.
+        """
+        try:
+            index, counts = self.reports.get(timeout=timeout)
+        except queue.Empty:
+            return
+        for symbol, count in counts.items():
+            rate = count / self.report_interval
+            self.rates[symbol] = (self.alpha * rate + (1 - self.alpha) * self.rates[symbol]
+                                  if symbol in self.rates else rate)
+            self.counts[symbol] = self.counts.get(symbol, 0) + count
+            self.received += count
+
+    def rebalance(self):
+        """
+        Move symbols between the shards when the message rates are unbalanced.
+        Only the workers whose shard changed are restarted. All of them are
+        stopped before starting any, so a moved symbol is never read by two
+        workers at the same time.
+        """
+        loads = [sum(self.rates.get(s, 0.0) for s in w.symbols) for w in self.workers]
+        mean = sum(loads) / len(loads)
+        if mean == 0 or max(loads) <= (1 + self.tolerance) * mean:
+            return
+        shards, new_loads = balance(self.symbols, self.rates, len(self.workers))
+        if max(new_loads) >= max(loads):
+            return
+        #keep every new shard in the worker that already reads most of it
+        free = list(self.workers)
+        plan = []
+        for shard in sorted(shards, key=len, reverse=True):
+            worker = max(free, key=lambda w: len(set(w.symbols) & set(shard)))
+            free.remove(worker)
+            plan.append((worker, shard))
+        self.rebalances += 1
+        self.logger.info("Rebalancing the symbols, max rate {:.1f} -> {:.1f} msg/s".format(
+            max(loads), max(new_loads)))
+        changed = [(worker, shard) for worker, shard in plan if set(worker.symbols) != set(shard)]
+        for worker, shard in changed:
+            self.stop_worker(worker)
+        for worker, shard in changed:
+            worker.symbols = shard
+            self.start_worker(worker)
+
+    def log_throughput(self, elapsed):
+        """
+        Log the aggregate throughput since the last log, and the busiest
+        symbols.
+        """
+        rate = self.received / elapsed if elapsed else 0
+        self.received = 0
+        busiest = sorted(self.rates.items(), key=lambda x: -x[1])[:5]
+        self.logger.info("Throughput: {:.1f} msg/s with {}/{} workers alive. Busiest: {}".format(
+            rate, sum(w.is_alive() for w in self.workers), len(self.workers),
+            ', '.join('{} {:.1f}'.format(s, r) for s, r in busiest)))
+
+    def stats(self):
+        return {'workers': len(self.workers),
+                'alive': sum(w.is_alive() for w in self.workers),
+                'restarts': self.restarts,
+                'rebalances': self.rebalances,
+                'rate': sum(self.rates.values()),
+                'messages': sum(self.counts.values())}
+
+    def run(self):
+        """
+        Start the workers and supervise them until the user stops the
+        supervisor.
+        """
+        for worker in self.workers:
+            self.start_worker(worker)
+        last_log = last_rebalance = time.monotonic()
+        try:
+            while True:
+                self.collect()
+                self.check_workers()
+                now = time.monotonic()
+                if now - last_log > self.report_interval:
+                    self.log_throughput(now - last_log)
+                    last_log = now
+                if now - last_rebalance > self.rebalance_interval:
+                    self.rebalance()
+                    last_rebalance = time.monotonic()
+        except KeyboardInterrupt:
+            self.logger.info("Supervisor closed by user")
+        finally:
+            for worker in self.workers:
+                self.stop_worker(worker)
+            self.logger.debug("Supervisor stats: {}".format(self.stats()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read many symbols with several BTCreader processes')
+    parser.add_argument('symbols', nargs='*', help='symbols to read')
+    parser.add_argument('--quote-asset', help='read all the symbols with this quote asset')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker processes')
+    parser.add_argument('--writers', type=int, default=1, help='writer threads of every worker')
+    parser.add_argument('--backpressure', choices=['block', 'drop_oldest', 'spill'], default='block')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads', help='websocket engine of the workers')
+    parser.add_argument('--rebalance-interval', type=int, default=600, help='seconds between rebalances')
+    args = parser.parse_args()
+
+    supervisor = Supervisor(symbols=args.symbols, quote_asset=args.quote_asset,
+                            workers=args.workers,
+                            rebalance_interval=args.rebalance_interval,
+                            reader_kwargs={'writers': args.writers,
+                                           'backpressure': args.backpressure,
+                                           'engine': args.engine})
+    supervisor.run()
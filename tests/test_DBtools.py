@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of DBtools.DB that do not need a MySQL server: the server calls are
+replaced by a stub.
+"""
+import logging
+from datetime import date
+from types import SimpleNamespace
+from utils.DBtools import DB, DAY_MS
+from utils.trades import Trade
+
+#2021-01-01 00:00 UTC in epoch ms
+START = 1609459200000
+
+
+class StubDB(DB):
+    def __init__(self, **kwargs):
+        super().__init__('localhost', 3306, 'user', 'password', db='binance',
+                         logger=logging.getLogger(__name__), **kwargs)
+        self.rebuilt = []
+        self.executed = []
+        self.fail = set()
+        self.con = SimpleNamespace(commit=lambda: None)
+        self.cursor = SimpleNamespace(executemany=lambda query, values: self.executed.append(values))
+
+    def run(self, function):
+        return function()
+
+    def rebuild_day(self, symbol, day):
+        if (symbol, day) in self.fail:
+            raise RuntimeError('lost connection')
+        self.rebuilt.append((symbol, day))
+
+
+def trades(days):
+    return [Trade(START + d*DAY_MS, d, 100.0, 1.0, None, None, START + d*DAY_MS, False) for d in days]
+
+
+def test_duplicates_defer_the_rebuild():
+    db = StubDB(summary=True)
+    #all the trades are new: the summary is updated in the transaction
+    db.update_daily_summary('BTCUSDT', trades([0]), inserted=1)
+    assert len(db.executed) == 1 and db.stale_days == set()
+    #some trades were already stored: nothing is scanned in the writer
+    db.update_daily_summary('BTCUSDT', trades([0, 1]), inserted=1)
+    assert len(db.executed) == 1 and db.rebuilt == []
+    assert db.stale_days == {('BTCUSDT', date(2021, 1, 1)), ('BTCUSDT', date(2021, 1, 2))}
+    assert db.rebuild_stale_days() == 2
+    assert db.rebuilt == [('BTCUSDT', date(2021, 1, 1)), ('BTCUSDT', date(2021, 1, 2))]
+    assert db.stale_days == set()
+
+
+def test_failed_rebuild_is_kept():
+    db = StubDB(summary=True)
+    db.update_daily_summary('BTCUSDT', trades([0, 1]), inserted=0)
+    db.fail = {('BTCUSDT', date(2021, 1, 2))}
+    assert db.rebuild_stale_days() == 1
+    assert db.stale_days == {('BTCUSDT', date(2021, 1, 2))}
+    db.fail = set()
+    assert db.rebuild_stale_days() == 1
+    assert db.stale_days == set()
+
+
+class StubConnection():
+    """
+    Pooled connection: the pool resets the session when it is returned.
+    """
+    def __init__(self):
+        self.time_zone = 'SYSTEM'
+
+    def close(self):
+        self.time_zone = 'SYSTEM'
+
+
+def test_sessions_are_utc():
+    db = StubDB()
+    con = StubConnection()
+    db.pool = SimpleNamespace(get_connection=lambda: con)
+    assert db.checkout().time_zone == '+00:00'
+    con.close()
+    assert db.checkout().time_zone == '+00:00'
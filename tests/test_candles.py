@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the candles built at ingest time, with the trades of a gap merged
+after the live ones.
+"""
+import random
+import time
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import pytest
+from utils import candles
+
+INTERVALS = ('1s', '1m')
+
+
+def synthetic_trades(count, seed=7):
+    """
+    (trade_time, price, quantity, trade_id) of consecutive trades, a few by
+    second.
+    """
+    rng = random.Random(seed)
+    trades, time, price = [], 1700000000000, 100.0
+    for trade_id in range(1, count + 1):
+        time += rng.randint(0, 400)
+        price += rng.uniform(-1, 1)
+        trades.append((time, round(price, 2), round(rng.uniform(0.01, 2), 4), trade_id))
+    return trades
+
+
+def build(builder, trades):
+    """
+    Bars of every interval by open time, closed and current.
+    """
+    bars = {interval: {} for interval in INTERVALS}
+    for trade in trades:
+        for interval, bar in builder.update(*trade):
+            bars[interval][bar[candles.OPEN_TIME]] = bar
+    for interval in INTERVALS:
+        bar = builder.bars[interval]
+        bars[interval][bar[candles.OPEN_TIME]] = bar
+    return bars
+
+
+def rounded(bars):
+    """
+    The volumes are added in other order, round them.
+    """
+    return {t: bar[:candles.VOLUME] + [round(bar[candles.VOLUME], 6)] + bar[candles.VOLUME + 1:]
+            for t, bar in bars.items()}
+
+
+def test_merged_gap():
+    trades = synthetic_trades(2000)
+    expected = build(candles.CandleBuilder('BTCUSDT', INTERVALS), trades)
+    #the trades 500-1200 are missed by the websocket, and backfilled later
+    gap = trades[500:1200]
+    builder = candles.CandleBuilder('BTCUSDT', INTERVALS)
+    bars = build(builder, trades[:500] + trades[1200:])
+    for trade in gap:
+        builder.merge(*trade)
+    merged = builder.pop_merged()
+    assert merged and builder.pop_merged() == []
+    for interval, bar in merged:
+        bars[interval][bar[candles.OPEN_TIME]] = bar
+    assert builder.late_trades == 0
+    for interval in INTERVALS:
+        assert rounded(bars[interval]) == rounded(expected[interval])
+    #the bars of the gap without live trades are new
+    assert any(bar[candles.TRADES] == expected['1s'][bar[candles.OPEN_TIME]][candles.TRADES]
+               and bar[candles.FIRST_ID] > 500 and bar[candles.LAST_ID] < 1201
+               for interval, bar in merged if interval == '1s')
+
+
+def test_trades_older_than_the_bars_kept():
+    trades = synthetic_trades(2000)
+    builder = candles.CandleBuilder('BTCUSDT', INTERVALS, keep=10)
+    build(builder, trades[1500:])
+    #minutes before the first live trade
+    for trade in trades[:100]:
+        builder.merge(*trade)
+    assert builder.late_trades == 100 * len(INTERVALS)
+    assert builder.pop_merged() == []
+    #the bars closed and forgotten can not be changed either
+    builder = candles.CandleBuilder('BTCUSDT', INTERVALS, keep=3)
+    build(builder, trades)
+    builder.merge(*trades[0])
+    assert builder.late_trades == 2 and builder.pop_merged() == []
+
+
+@pytest.fixture
+def local_time_zone(monkeypatch):
+    """
+    The process runs in UTC-3, the database in UTC.
+    """
+    monkeypatch.setenv('TZ', 'America/Argentina/Buenos_Aires')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+class StoredTrades():
+    """
+    Ticker table with the trades stored by FROM_UNIXTIME in an UTC session,
+    and the last 1m bar stored.
+    """
+    def __init__(self, trades, last_candle):
+        self.trades = trades
+        self.last_candle = last_candle
+        self.start_date = None
+
+    def create_candle_table(self, table):
+        pass
+
+    def read_last_candle(self, symbol, interval):
+        return self.last_candle if interval == '1m' else None
+
+    def read_table_chunks(self, table, start_date=None, chunksize=None, columns=None):
+        self.start_date = start_date
+        times = [datetime.fromtimestamp(t[0] / 1000, tz=timezone.utc).replace(tzinfo=None) for t in self.trades]
+        yield pd.DataFrame({'trade_time': np.array(times, dtype='datetime64[ms]'),
+                            'trade_id': [t[3] for t in self.trades],
+                            'price': [t[1] for t in self.trades],
+                            'quantity': [t[2] for t in self.trades]})
+
+
+def test_utc_round_trip(local_time_zone):
+    #2021-01-01 00:00 UTC
+    start = 1609459200000
+    trades = [(start + i*20000, 100.0 + i, 1.0, i) for i in range(10)]
+    builder = candles.CandleBuilder('BTCUSDT', ('1m',))
+    bar = builder.update(*trades[0]) or builder.bars['1m']
+    assert builder.to_row(bar)['open_time'] == '2021-01-01 00:00:00.000000'
+    #the bar of 00:00 is stored, the backfill stores the next ones
+    db = StoredTrades(trades, {'open_time': datetime(2021, 1, 1, 0, 0)})
+    builder = candles.CandleBuilder('BTCUSDT', ('1m',))
+    rows = []
+    builder.backfill(db, lambda table, row: rows.append(row), days=100000)
+    assert db.start_date == '2021-01-01 00:00:00'
+    assert [row['open_time'] for row in rows] == ['2021-01-01 00:01:00.000000', '2021-01-01 00:02:00.000000']
+    assert builder.bars['1m'][candles.OPEN_TIME] == start + 3*60000
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Parquet export (utils.exporter), with an in-memory stand-in of
+DB.read_table_chunks.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from utils import exporter
+
+pytest.importorskip('pyarrow')
+
+
+class MemoryDB():
+    """
+    Ticker table in a DataFrame, read in chunks ordered by trade_id like
+    DB.read_table_chunks.
+    """
+    def __init__(self):
+        self.trades = pd.DataFrame(columns=['trade_id', 'trade_time', 'price', 'quantity'])
+
+    def insert(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = pd.DataFrame({'trade_id': ids,
+                             'trade_time': pd.to_datetime(1609459200000 + ids * 60000, unit='ms'),
+                             'price': 100.0 + ids,
+                             'quantity': 1.0})
+        self.trades = pd.concat([self.trades, rows], ignore_index=True)
+
+    def rename_table_query(self, table):
+        return table.upper()
+
+    def read_table_chunks(self, table, chunksize=100000, after_trade_id=None, until_trade_id=None):
+        df = self.trades.sort_values('trade_id')
+        if after_trade_id is not None:
+            df = df[df['trade_id'] > after_trade_id]
+        if until_trade_id is not None:
+            df = df[df['trade_id'] <= until_trade_id]
+        df = df.astype({'trade_id': 'int64', 'price': 'float64', 'quantity': 'float64'})
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize].reset_index(drop=True)
+
+
+def exported_ids(folder):
+    return sorted(exporter.load_trades('BTCUSDT', folder=folder)['trade_id'])
+
+
+def test_late_trades_are_exported(tmp_path):
+    folder = str(tmp_path)
+    db = MemoryDB()
+    #the trades 5 and 6 are missing (i.e. a reconnection of the websocket)
+    db.insert([1, 2, 3, 4, 7, 8, 9, 10])
+    assert exporter.export_table(db, folder=folder, chunksize=3) == 8
+    assert exporter.last_exported(folder, 'BTCUSDT') == 10
+    assert exporter.missing_ranges(folder, 'BTCUSDT') == [[5, 6]]
+    #the gap backfill stores 5 after the export, and new trades arrive
+    db.insert([5, 11, 12])
+    assert exporter.export_table(db, folder=folder, chunksize=3) == 3
+    assert exported_ids(folder) == [1, 2, 3, 4, 5, 7, 8, 9, 10, 11, 12]
+    assert exporter.missing_ranges(folder, 'BTCUSDT') == [[6, 6]]
+    db.insert([6])
+    assert exporter.export_table(db, folder=folder) == 1
+    assert exported_ids(folder) == list(range(1, 13))
+    assert exporter.missing_ranges(folder, 'BTCUSDT') == []
+    #nothing new
+    assert exporter.export_table(db, folder=folder) == 0
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Paridad del motor fusionado (utils.indicadoresEngine) con
+indicadores.get_indicators, sobre barras sintéticas con semilla, con y sin
+barras en NaN.
+"""
+import numpy as np
+import pytest
+from utils import indicadores, indicadoresEngine
+from benchmarks.benchIndicadores import synthetic_bars
+
+BARS = 500
+
+
+def with_nan(bars):
+    """
+    Barras sin datos: sueltas, una racha, y en la primera fila.
+    """
+    bars = bars.copy()
+    rows = [0, 40, 41, 42, 43, 44, 100, 250, 251, 400]
+    bars.iloc[rows] = np.nan
+    #una barra con el cierre y sin volumen
+    bars.iloc[300, bars.columns.get_loc('Volume')] = np.nan
+    return bars
+
+
+@pytest.mark.parametrize('nan', [False, True])
+def test_parity(nan):
+    bars = synthetic_bars(BARS, seed=42)
+    if nan:
+        bars = with_nan(bars)
+    #get_indicators completa los NaN del DataFrame que recibe
+    expected = indicadores.get_indicators(bars.copy())
+    result = indicadoresEngine.get_indicators(bars)
+    assert list(result.columns) == list(expected.columns)
+    for column in expected.columns:
+        np.testing.assert_allclose(result[column].to_numpy(), expected[column].to_numpy(dtype=float),
+                                   rtol=1e-7, atol=1e-6, equal_nan=True, err_msg=column)
+
+
+def test_fill_follows_the_spec():
+    """
+    Con STOCHASTIC antes que MACD, el MACD usa los datos completados, como
+    las funciones batch llamadas en ese orden.
+    """
+    bars = with_nan(synthetic_bars(BARS, seed=42))
+    df = bars.copy()
+    stoch = indicadores.STOCHASTIC(df, column_name='Close')
+    macd = indicadores.MACD(df, columna='Close')
+    result = indicadoresEngine.get_indicators(bars, spec=[('STOCHASTIC', {}), ('MACD', {})])
+    for expected in (stoch, macd):
+        for column in expected.columns:
+            np.testing.assert_allclose(result[column].to_numpy(), expected[column].to_numpy(dtype=float),
+                                       rtol=1e-7, atol=1e-6, equal_nan=True, err_msg=column)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Paridad de los indicadores incrementales (utils.indicadoresOnline) con las
+funciones batch de utils.indicadores, sobre barras sintéticas con semilla.
+"""
+import numpy as np
+import pytest
+from utils import indicadores, indicadoresOnline
+from benchmarks.benchIndicadores import synthetic_bars
+
+BARS = 500
+
+#caso -> (indicador incremental, función batch)
+CASES = {'MACD': (lambda: indicadoresOnline.MACD('Close'),
+                  lambda df: indicadores.MACD(df, columna='Close')),
+         'RSI': (lambda: indicadoresOnline.RSI('Close'),
+                 lambda df: indicadores.RSI(df, columna='Close')),
+         'VWAP': (lambda: indicadoresOnline.VWAP('Close', 'Volume'),
+                  lambda df: indicadores.VWAP(df, column_price='Close', column_volume='Volume')),
+         'STOCHASTIC': (lambda: indicadoresOnline.STOCHASTIC('Close'),
+                        lambda df: indicadores.STOCHASTIC(df, column_name='Close')),
+         'BB': (lambda: indicadoresOnline.BB('Close'),
+                lambda df: indicadores.BB(df, column_price='Close')),
+         'CCI': (indicadoresOnline.CCI, indicadores.CCI),
+         'ATR': (indicadoresOnline.ATR, indicadores.ATR),
+         'ADX': (indicadoresOnline.ADX, indicadores.ADX)}
+
+#ATR y ADX devuelven los valores de la barra anterior
+LAGGED = ('ATR', 'ADX')
+
+
+@pytest.fixture(scope='module')
+def bars():
+    return synthetic_bars(BARS, seed=42)
+
+
+def stream(indicator, bars):
+    """
+    Pasa las barras de a una por el indicador, y devuelve la lista de
+    resultados (dicts, o None).
+    """
+    return [indicator.update(bar) for bar in bars.to_dict('records')]
+
+
+@pytest.mark.parametrize('case', list(CASES))
+def test_parity(case, bars):
+    online, batch = CASES[case]
+    expected = batch(bars.copy())
+    results = stream(online(), bars)
+    if case in LAGGED:
+        #la barra i se conoce recién con la barra i+1, la última no se conoce
+        assert results[0] is None
+        results = results[1:]
+        expected = expected.iloc[:-1]
+    assert len(results) == len(expected)
+    for column in expected.columns:
+        values = np.array([result[column] for result in results], dtype=float)
+        np.testing.assert_allclose(values, expected[column].to_numpy(dtype=float),
+                                   rtol=1e-7, atol=1e-6, equal_nan=True, err_msg=column)
+
+
+@pytest.mark.parametrize('case', LAGGED)
+def test_lag(case, bars):
+    """
+    El update de la barra i devuelve el valor batch de la barra i-1 (que usa
+    el cierre de la barra i), y no el de la barra i.
+    """
+    online, batch = CASES[case]
+    expected = batch(bars.copy())
+    column = expected.columns[-1]
+    results = stream(online(), bars)
+    values = np.array([result[column] for result in results[100:]], dtype=float)
+    previous = expected[column].to_numpy(dtype=float)[99:-1]
+    current = expected[column].to_numpy(dtype=float)[100:]
+    np.testing.assert_allclose(values, previous, rtol=1e-7)
+    assert not np.allclose(values, current, rtol=1e-7)
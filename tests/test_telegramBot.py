@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the telegram bot and its image feeds, against a local stub HTTP
+server of the random image APIs and a stub database. Nothing is sent to
+Telegram: the commands are called with stub updates and contexts.
+"""
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+from notifiers.telegramBot import telegramBot
+from utils.priceCache import PriceCache
+from utils.trades import Trade
+
+
+class StubAPI(BaseHTTPRequestHandler):
+    """
+    /dog and /cat answer like random.dog and random.cat, after
+    server.delay seconds.
+    """
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        server.release.wait(server.delay)
+        key = 'url' if self.path.startswith('/dog') else 'file'
+        body = json.dumps({key: 'http://images/{}.jpg'.format(server.requests)}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubAPI)
+    server.daemon_threads = True
+    server.requests = 0
+    server.delay = 0
+    server.release = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+class StubDB():
+    def __init__(self):
+        self.reads = 0
+
+    def connect(self):
+        pass
+
+    def read_last_row(self):
+        self.reads += 1
+        return {'price': 100.0, 'trade_time': 'db'}
+
+
+@pytest.fixture
+def make_bot(api, tmp_path):
+    bots = []
+
+    def make(**kwargs):
+        url = 'http://127.0.0.1:{}'.format(api.server_address[1])
+        kwargs.setdefault('price_cache', str(tmp_path))
+        bot = telegramBot('token', 'channel', StubDB(), dog_api=url + '/dog',
+                          cat_api=url + '/cat', run=False, **kwargs)
+        bots.append(bot)
+        return bot
+    yield make
+    api.release.set()
+    for bot in bots:
+        bot.close()
+
+
+def test_price_staleness(make_bot, tmp_path):
+    bot = make_bot()
+    #nothing published yet, the price is read from the DB
+    assert bot.stats()['price_staleness'] is None
+    assert bot.last_price()['trade_time'] == 'db'
+    writer = PriceCache('BTCUSDT', str(tmp_path), writer=True)
+    writer.publish(Trade(1, 1, 123.0, 1.0, None, None, 1000, False))
+    stats = bot.stats()
+    assert 0 <= stats['price_staleness'] < bot.max_staleness
+    assert bot.last_price()['price'] == 123.0
+    assert bot.stats()['cache_hits'] == 1
+    assert bot.stats()['cache_misses'] == 1
+    writer.close()
+
+
+def stub_update(replies):
+    user = SimpleNamespace(username='user')
+    return SimpleNamespace(message=SimpleNamespace(from_user=user, chat_id=1, reply_text=replies.append))
+
+
+def stub_context(photos):
+    bot = SimpleNamespace(send_photo=lambda chat_id, photo: photos.append(photo),
+                          send_message=lambda chat_id, text: photos.append(text))
+    return SimpleNamespace(bot=bot)
+
+
+def test_prefetched_image(make_bot):
+    bot = make_bot()
+    #the ring is filled in the background, the command only takes an URL
+    assert bot.dogs.get(timeout=5).startswith('http://images/')
+    photos = []
+    bot.run_handler(bot.dog, stub_update([]), stub_context(photos))
+    assert len(photos) == 1 and photos[0].startswith('http://images/')
+    assert bot.dogs.stats()['hits'] + bot.dogs.stats()['misses'] == 2
+
+
+def test_prefetch_fallback_waits_for_the_api(api, make_bot):
+    api.delay = 0.5
+    bot = make_bot()
+    #the ring is empty, get waits for the prefetch thread
+    assert bot.cats.get(timeout=5).startswith('http://images/')
+    assert bot.cats.stats()['misses'] == 1
+
+
+def test_handler_timeout(api, make_bot):
+    #the API never answers in time: the command tells the user
+    api.delay = 60
+    bot = make_bot(handler_timeout=1)
+    replies, photos = [], []
+    bot.run_handler(bot.dog, stub_update(replies), stub_context(photos))
+    assert photos == []
+    assert len(replies) == 1 and 'tardando' in replies[0]
+    assert bot.dogs.stats()['misses'] == 1
+
+
+def test_check_timeout(make_bot):
+    bot = make_bot()
+    replies = []
+    blocked = threading.Event()
+    future = bot.pool.submit(blocked.wait, 5)
+    bot.check_timeout(future, bot.dog, stub_update(replies))
+    blocked.set()
+    assert bot.timeouts == 1
+    assert len(replies) == 1
+    #a finished command is not answered twice
+    future.result()
+    bot.check_timeout(future, bot.dog, stub_update(replies))
+    assert bot.timeouts == 1
+
+
+class DailyDB(StubDB):
+    """
+    No daily summary, and a last 1D bar of the given day.
+    """
+    def __init__(self, candle_day):
+        super().__init__()
+        self.candle_day = candle_day
+        self.closes = []
+
+    def read_daily_summary(self, symbol, days):
+        return []
+
+    def read_last_candle(self, interval):
+        return {'open_time': datetime(self.candle_day.year, self.candle_day.month, self.candle_day.day),
+                'close': 90.0}
+
+    def read_close(self, table, day):
+        self.closes.append(day)
+        return 80.0
+
+
+def test_daily_uses_only_yesterday_bar(make_bot):
+    bot = make_bot(price_cache=None)
+    yesterday = datetime.utcnow().date() - timedelta(days=1)
+    messages = []
+    bot.db = DailyDB(yesterday)
+    bot.callback_daily(stub_context(messages))
+    assert '$90.0' in messages[0] and bot.db.closes == []
+    #the reader was stopped yesterday: the last bar is older
+    bot.db = DailyDB(yesterday - timedelta(days=3))
+    bot.callback_daily(stub_context(messages))
+    assert '$80.0' in messages[1] and bot.db.closes == [yesterday]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the local binary trade log (utils.tradeLog).
+"""
+from datetime import date, datetime
+from utils import tradeLog
+from utils.trades import Trade
+
+DAY_MS = tradeLog.DAY_MS
+#2021-01-01 00:00 UTC in epoch ms
+START = 1609459200000
+
+
+def write_days(folder, days=3, per_day=5):
+    log = tradeLog.TradeLog(folder)
+    trades = [Trade(START + d*DAY_MS + i, d*per_day + i, 100.0 + i, 1.0, None, None,
+                    START + d*DAY_MS + i, False)
+              for d in range(days) for i in range(per_day)]
+    log.append('BTCUSDT', trades)
+    log.close()
+    return trades
+
+
+def test_read_range_dates(tmp_path):
+    write_days(str(tmp_path))
+    days = tradeLog.read_range('BTCUSDT', date(2021, 1, 1), date(2021, 1, 2), folder=str(tmp_path))
+    assert [len(d) for d in days] == [5, 5]
+    assert list(days[1]['trade_id']) == [5, 6, 7, 8, 9]
+
+
+def test_read_range_datetimes(tmp_path):
+    write_days(str(tmp_path))
+    #the end day is included even if the end is after its midnight
+    days = tradeLog.read_range('BTCUSDT', datetime(2021, 1, 2, 12), datetime(2021, 1, 3, 12), folder=str(tmp_path))
+    assert [len(d) for d in days] == [5, 5]
+    records = tradeLog.to_frame(days)
+    assert list(records['trade_id']) == list(range(5, 15))
@@ -3,149 +3,548 @@
 Class to handle the Database connection
 The database to use is MySQL.
 """
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
 import mysql.connector
+from mysql.connector import pooling, errorcode
+
+#version of the schema of the ticker tables, stored in the table comment
+SCHEMA_VERSION = 2
+
+#schema of the first version, without keys. Kept to migrate and benchmark.
+TICKER_TABLE_V1 = "CREATE TABLE {} (event_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, trade_id TEXT NOT NULL, price REAL, quantity REAL, bid_id TEXT, ask_id TEXT, trade_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, maker BOOL);"
+
+#ids as integers, prices and quantities as fixed point, clustered by trade_id
+#and with indexes for the queries by trade_time and event_time
+TICKER_TABLE = ("CREATE TABLE {} ("
+                "trade_id BIGINT UNSIGNED NOT NULL, "
+                "event_time DATETIME(3) NOT NULL, "
+                "trade_time DATETIME(3) NOT NULL, "
+                "price DECIMAL(20,8) NOT NULL, "
+                "quantity DECIMAL(20,8) NOT NULL, "
+                "bid_id BIGINT UNSIGNED NULL, "
+                "ask_id BIGINT UNSIGNED NULL, "
+                "maker BOOL, "
+                "PRIMARY KEY (trade_id), "
+                "KEY idx_trade_time (trade_time), "
+                "KEY idx_event_time (event_time)"
+                ") ENGINE=InnoDB COMMENT='schema_version=" + str(SCHEMA_VERSION) + "';")
+
+#time zone of the sessions: FROM_UNIXTIME and the DATETIME columns are UTC,
+#like the epoch ms of the trades and the UTC days of the daily summary
+TIME_ZONE = '+00:00'
+
+#bars built by utils.candles, one table per symbol and interval
+CANDLE_TABLE = ("CREATE TABLE {} ("
+                "open_time DATETIME(3) NOT NULL, "
+                "open DECIMAL(20,8) NOT NULL, "
+                "high DECIMAL(20,8) NOT NULL, "
+                "low DECIMAL(20,8) NOT NULL, "
+                "close DECIMAL(20,8) NOT NULL, "
+                "volume DECIMAL(28,8) NOT NULL, "
+                "trades INT UNSIGNED NOT NULL, "
+                "PRIMARY KEY (open_time)"
+                ") ENGINE=InnoDB COMMENT='schema_version=" + str(SCHEMA_VERSION) + "';")
+
+#a bar stored again (i.e. with the trades of a backfilled gap merged) has more
+#trades than the stored one, and replaces it. trades is updated the last, so
+#the other columns are compared with the stored value
+CANDLE_UPSERT = ("open = IF(VALUES(trades) > trades, VALUES(open), open), "
+                 "high = IF(VALUES(trades) > trades, VALUES(high), high), "
+                 "low = IF(VALUES(trades) > trades, VALUES(low), low), "
+                 "close = IF(VALUES(trades) > trades, VALUES(close), close), "
+                 "volume = IF(VALUES(trades) > trades, VALUES(volume), volume), "
+                 "trades = GREATEST(VALUES(trades), trades)")
+
+#daily rollup of the trades of every symbol (UTC days, like the 1D candles).
+#The first and last trade ids guard the open and close when the batches of
+#trades arrive out of order.
+DAILY_SUMMARY = 'DAILY_SUMMARY'
+DAILY_SUMMARY_TABLE = ("CREATE TABLE {} ("
+                       "symbol VARCHAR(20) NOT NULL, "
+                       "day DATE NOT NULL, "
+                       "open DECIMAL(20,8) NOT NULL, "
+                       "high DECIMAL(20,8) NOT NULL, "
+                       "low DECIMAL(20,8) NOT NULL, "
+                       "close DECIMAL(20,8) NOT NULL, "
+                       "volume DECIMAL(28,8) NOT NULL, "
+                       "quote_volume DECIMAL(36,8) NOT NULL, "
+                       "vwap DECIMAL(20,8) NOT NULL, "
+                       "trades INT UNSIGNED NOT NULL, "
+                       "first_trade_id BIGINT UNSIGNED NOT NULL, "
+                       "last_trade_id BIGINT UNSIGNED NOT NULL, "
+                       "updated_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3), "
+                       "PRIMARY KEY (symbol, day)"
+                       ") ENGINE=InnoDB COMMENT='schema_version=" + str(SCHEMA_VERSION) + "';")
+
+#the assignments are evaluated from left to right, so open and close are
+#compared with the trade ids before updating them
+DAILY_SUMMARY_UPSERT = ("INSERT INTO {} (symbol, day, open, high, low, close, volume, quote_volume, "
+                        "vwap, trades, first_trade_id, last_trade_id) "
+                        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+                        "ON DUPLICATE KEY UPDATE "
+                        "open = IF(VALUES(first_trade_id) < first_trade_id, VALUES(open), open), "
+                        "first_trade_id = LEAST(first_trade_id, VALUES(first_trade_id)), "
+                        "close = IF(VALUES(last_trade_id) > last_trade_id, VALUES(close), close), "
+                        "last_trade_id = GREATEST(last_trade_id, VALUES(last_trade_id)), "
+                        "high = GREATEST(high, VALUES(high)), "
+                        "low = LEAST(low, VALUES(low)), "
+                        "volume = volume + VALUES(volume), "
+                        "quote_volume = quote_volume + VALUES(quote_volume), "
+                        "vwap = quote_volume / volume, "
+                        "trades = trades + VALUES(trades);")
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+#partitioned version: the partition column must be part of the primary key
+PARTITIONED_TICKER_TABLE = TICKER_TABLE.replace("PRIMARY KEY (trade_id)", "PRIMARY KEY (trade_id, trade_time)")[:-1]
+
+PARTITION_PERIODS = ('day', 'month')
+
+#dtypes of the columns of the ticker tables when read as DataFrames
+TICKER_DTYPES = {'event_time': 'datetime64[ms]',
+                 'trade_time': 'datetime64[ms]',
+                 'trade_id': 'int64',
+                 'bid_id': 'float64',
+                 'ask_id': 'float64',
+                 'price': 'float64',
+                 'quantity': 'float64',
+                 'maker': 'bool'}
+
+#columns that are epoch milliseconds in the namedtuple rows
+MS_COLUMNS = ('event_time', 'trade_time', 'open_time')
+
+TICKER_COLUMNS = ('event_time', 'trade_id', 'price', 'quantity', 'bid_id', 'ask_id', 'trade_time', 'maker')
+
+#errors that mean that the connection to the server was lost
+CONNECTION_ERRORS = (errorcode.CR_SERVER_GONE_ERROR,
+                     errorcode.CR_SERVER_LOST,
+                     errorcode.CR_SERVER_LOST_EXTENDED,
+                     errorcode.CR_CONN_HOST_ERROR,
+                     errorcode.CR_CONNECTION_ERROR)
 
 class DB():
-    def __init__(self, host, port, user, password, db = None, logger = None):
+    def __init__(self, host, port, user, password, db = None, logger = None,
+                 pool_size = 5, retries = 3, ping_interval = 30,
+                 partition = None, retention = None, partitions_ahead = 2,
+                 summary = False):
         """
         Initialization of the databse
         The IP and PORT to the MySQL server is needed, also the user and
         password.
         Also the database name must be specified.
+        The connections are taken from a pool of pool_size connections, and
+        every thread checks out its own connection and cursor, so the same
+        DB can be shared by several threads.
+        retries -> number of reconnections before giving up a query when the
+        connection to the server is lost.
+        ping_interval -> seconds between liveness checks of the connection of
+        a thread.
+        partition -> None, 'day' or 'month'. If defined, the new ticker tables
+        are partitioned by range of trade_time, one partition per period.
+        retention -> number of periods to keep when the partitions are
+        rotated (None keeps everything).
+        partitions_ahead -> number of future periods created in advance.
+        summary -> if True, every batch of trades inserted with appendMDmany
+        also updates the daily summary table, in the same transaction.
         """
+        if partition not in (None,) + PARTITION_PERIODS:
+            raise ValueError("Unknown partition period {}, use one of {}".format(partition, PARTITION_PERIODS))
         
         self.__user = user
         self.__password = password
         self.host = host
         self.port = port
         self.db = db
-        self.con = None
-        self.cursor = None
+        self.pool_size = pool_size
+        self.retries = retries
+        self.ping_interval = ping_interval
+        self.partition = partition
+        self.retention = retention
+        self.partitions_ahead = partitions_ahead
+        self.summary = summary
+        self.pool = None
+        self.pool_lock = threading.Lock()
+        #connection, cursors and prepared statements of every thread
+        self.local = threading.local()
+        self.checked_out = []
         self.tables = None
+        #registry of the tables and their schemas, loaded at connect
+        self.table_names = None
+        self.schemas = {}
+        #text of the INSERT statements, by table and columns
+        self.insert_queries = {}
+        #(symbol, day) of the daily summary to rebuild out of the writers
+        #(see update_daily_summary)
+        self.stale_days = set()
+        self.stale_lock = threading.Lock()
         
         if logger is None:
             from utils.createLogger import createLogger
             self.logger = createLogger()
         else:
             self.logger = logger
-        
-    def connect(self):
+
+    @property
+    def con(self):
         """
-        Create the connection with the database in the server.
+        Connection checked out by the current thread.
         """
-        self.con = mysql.connector.connect(user = self.__user,
+        return getattr(self.local, 'con', None)
+
+    @con.setter
+    def con(self, value):
+        self.local.con = value
+
+    @property
+    def cursor(self):
+        """
+        Dictionary cursor of the current thread.
+        """
+        return getattr(self.local, 'cursor', None)
+
+    @cursor.setter
+    def cursor(self, value):
+        self.local.cursor = value
+
+    def bootstrap(self):
+        """
+        Open a connection without pool to choose the database, and create it
+        if it does not exist.
+        """
+        con = mysql.connector.connect(user = self.__user,
                                       password = self.__password,
                                       host=self.host,
                                       port=self.port)
         try:
-            self.cursor = self.con.cursor(dictionary=True)
+            cursor = con.cursor(dictionary=True)
             if self.db is None:
-                self.cursor.execute("SHOW databases;")
+                cursor.execute("SHOW databases;")
                 print("The available databases are:\n")
-                print(self.cursor.fetchall())
+                print(cursor.fetchall())
                 self.db = input('Input the database you want to use or create:')
-            self.cursor.execute("USE {}".format(self.db))
-            self.list_tables()
-            return self.con
-        except mysql.connector.Error as err:
-            self.logger.error("Database {} does not exists.".format(self.db))
-            if err.errno == mysql.connector.errorcode.ER_BAD_DB_ERROR:
-                self.create_db()
-                self.logger.info("Database {} created successfully.".format(self.db))
-                self.cursor.execute("USE {}".format(self.db))
-                self.list_tables()
-                self.logger.debug("Now you are using the database: {}".format(self.db))
-                return self.con
-    
+            try:
+                cursor.execute("USE {}".format(self.db))
+            except mysql.connector.Error as err:
+                self.logger.error("Database {} does not exists.".format(self.db))
+                if err.errno == errorcode.ER_BAD_DB_ERROR:
+                    self.create_db(cursor)
+                    self.logger.info("Database {} created successfully.".format(self.db))
+                else:
+                    raise
+        finally:
+            con.close()
+
+    def connect(self):
+        """
+        Create the connection with the database in the server.
+        The first call creates the pool of connections, and every call checks
+        out a connection (and its cursor) for the current thread.
+        """
+        with self.pool_lock:
+            if self.pool is None:
+                self.bootstrap()
+                self.pool = pooling.MySQLConnectionPool(pool_size=self.pool_size,
+                                                        user = self.__user,
+                                                        password = self.__password,
+                                                        host=self.host,
+                                                        port=self.port,
+                                                        database=self.db)
+                self.logger.debug("Pool of {} connections created, using the database: {}".format(self.pool_size, self.db))
+        self.release()
+        self.con = self.checkout()
+        self.cursor = self.con.cursor(dictionary=True)
+        self.local.prepared = {}
+        self.local.last_check = time.monotonic()
+        #a new connection reloads the registry of tables
+        self.list_tables()
+        return self.con
+
+    def checkout(self, timeout=30):
+        """
+        Get a connection from the pool, waiting if all of them are in use.
+        The pool resets the session of the connections returned to it, so the
+        time zone is set on every checkout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                con = self.pool.get_connection()
+                self.checked_out.append(con)
+                con.time_zone = TIME_ZONE
+                return con
+            except pooling.PoolError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def release(self):
+        """
+        Return the connection of the current thread to the pool.
+        """
+        con = self.con
+        if con is None:
+            return
+        self.con = None
+        self.cursor = None
+        self.local.prepared = {}
+        if con in self.checked_out:
+            self.checked_out.remove(con)
+        try:
+            con.close()
+        except mysql.connector.Error:
+            pass
+
     def close(self):
-        self.con.close()
- 
+        """
+        Return all the connections checked out by the threads to the pool.
+        """
+        for con in list(self.checked_out):
+            try:
+                con.close()
+            except mysql.connector.Error:
+                pass
+        self.checked_out = []
+        self.con = None
+        self.cursor = None
 
     def check_connection(self):
-        if self.con == None or not self.con.is_connected:
-            self.logger.debug("Restoring connection")
+        """
+        Check that the current thread has a live connection. The server is
+        pinged at most every ping_interval seconds, and if the connection is
+        lost, a new one is taken from the pool.
+        """
+        if self.con is None:
             self.connect()
-            self.cursor = self.con.cursor(dictionary=True)
+            return
+        if time.monotonic() - self.local.last_check > self.ping_interval:
+            self.local.last_check = time.monotonic()
+            if not self.con.is_connected():
+                self.logger.debug("Restoring connection")
+                self.connect()
+                return
         if self.cursor is None:
             self.logger.debug("The cursor is None, re setting it")
             self.cursor = self.con.cursor(dictionary=True)
-            
+
+    def run(self, function):
+        """
+        Run function (that uses the connection of the current thread), and if
+        the connection to the server is lost, reconnect and retry it up to
+        self.retries times.
+        """
+        for attempt in range(self.retries + 1):
+            self.check_connection()
+            try:
+                return function()
+            except (mysql.connector.OperationalError, mysql.connector.InterfaceError) as err:
+                if err.errno not in CONNECTION_ERRORS or attempt == self.retries:
+                    raise
+                self.logger.warning("Connection lost ({}), reconnecting. Attempt {} of {}".format(err, attempt + 1, self.retries))
+                self.release()
+                time.sleep(min(2 ** attempt, 10))
+
+    def insert_query(self, table, columns, ignore=False, ms_columns=(), update=None):
+        """
+        Text of the INSERT statement for the table and columns. It is built
+        only once, so the prepared statements can be reused.
+        If ignore is True, the rows with a duplicated key are skipped.
+        The values of the ms_columns are epoch milliseconds, converted to
+        DATETIME by the server.
+        update -> assignments of ON DUPLICATE KEY UPDATE (i.e. CANDLE_UPSERT).
+        """
+        key = (table, tuple(columns), ignore, tuple(ms_columns), update)
+        query = self.insert_queries.get(key)
+        if query is None:
+            placeholders = ', '.join(['FROM_UNIXTIME(%s / 1000)' if c in ms_columns else '%s' for c in columns])
+            query = "INSERT %sINTO %s ( %s ) VALUES ( %s )" % ('IGNORE ' if ignore else '', table, ', '.join(columns), placeholders)
+            if update:
+                query += " ON DUPLICATE KEY UPDATE " + update
+            self.insert_queries[key] = query
+        return query
+
+    def prepared_cursor(self, query):
+        """
+        Prepared cursor of the current thread for the query. The statement is
+        prepared in the server only once per connection.
+        """
+        prepared = self.local.prepared
+        cursor = prepared.get(query)
+        if cursor is None:
+            cursor = self.con.cursor(prepared=True)
+            prepared[query] = cursor
+        return cursor
 
     def exist_table(self, table):
         """
-        check if a table exist
+        check if a table exist, using the registry of tables. The server is
+        only queried if the registry was not loaded yet.
         """
         table = self.rename_table_query(table)
-        self.check_connection()
-        query = "SHOW TABLES LIKE '{}';".format(table)
-        self.cursor.execute(query)
-        if len(self.cursor.fetchall())>0:
-            return True
-        else:
-            return False
+        #other threads may replace the registry, read it only once
+        names = self.table_names
+        if names is None:
+            self.list_tables()
+            names = self.table_names
+        return table in names
 
-    def create_db(self):
+    def create_db(self, cursor=None):
         """
         Create a database file if the file is not found.
         """
         try:
-            self.check_connection()
-            self.cursor.execute(
+            if cursor is None:
+                self.check_connection()
+                cursor = self.cursor
+            cursor.execute(
                 "CREATE DATABASE {} DEFAULT CHARACTER SET 'utf8'".format(self.db))
-            self.con.database = self.db
+            cursor.execute("USE {}".format(self.db))
         except mysql.connector.Error as err:
             self.logger.error("Failed creating database: {}".format(err))
 
     def create_ticker_table(self, ticker):
         """
-        Create a table in the DB with the name provided.
+        Create a table in the DB with the name provided, with the current
+        version of the schema (SCHEMA_VERSION). If self.partition is defined,
+        the table is partitioned by trade_time.
         """
         ticker = self.rename_table_query(ticker)
         self.check_connection()
         try:
             self.check_connection()
-            query = "CREATE TABLE {} (event_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, trade_id TEXT NOT NULL, price REAL, quantity REAL, bid_id TEXT, ask_id TEXT, trade_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, maker BOOL);".format(ticker)
+            if self.partition:
+                query = PARTITIONED_TICKER_TABLE.format(ticker) + self.partition_clause(datetime.utcnow()) + ';'
+            else:
+                query = TICKER_TABLE.format(ticker)
             print(query)
             self.cursor.execute(query)
             self.con.commit()
             self.logger.debug("Table {} was created in the DB".format(ticker))
-            #update the list of tables
-            self.list_tables()
+            #update the registry of tables
+            self.register_table(ticker)
             return True
+        except mysql.connector.Error as err:
+            if err.errno == mysql.connector.errorcode.ER_TABLE_EXISTS_ERROR:
+                #created by another connection, only the registry was outdated
+                self.register_table(ticker)
+                return True
+            self.logger.exception("Error trying to create the ticker table")
+            return False
         except:
             self.logger.exception("Error trying to create the ticker table")
             return False
 
+    def create_candle_table(self, table):
+        """
+        Create the table of the bars of a symbol and interval (i.e.
+        BTCUSDT_1M) if it does not exist.
+        """
+        table = self.rename_table_query(table)
+        if self.exist_table(table):
+            return True
+        self.check_connection()
+        try:
+            self.cursor.execute(CANDLE_TABLE.format(table))
+            self.con.commit()
+            self.logger.debug("Table {} was created in the DB".format(table))
+        except mysql.connector.Error as err:
+            if err.errno != errorcode.ER_TABLE_EXISTS_ERROR:
+                self.logger.exception("Error trying to create the candle table")
+                return False
+        self.register_table(table)
+        return True
+
+    def create_daily_summary_table(self):
+        """
+        Create the daily summary table if it does not exist.
+        """
+        if self.exist_table(DAILY_SUMMARY):
+            return True
+        self.check_connection()
+        try:
+            self.cursor.execute(DAILY_SUMMARY_TABLE.format(DAILY_SUMMARY))
+            self.con.commit()
+            self.logger.debug("Table {} was created in the DB".format(DAILY_SUMMARY))
+        except mysql.connector.Error as err:
+            if err.errno != errorcode.ER_TABLE_EXISTS_ERROR:
+                self.logger.exception("Error trying to create the daily summary table")
+                return False
+        self.register_table(DAILY_SUMMARY)
+        return True
+
     def list_tables(self):
         """
-        list all the tables in the database
+        list all the tables in the database, and reload the registry of tables.
+        The new registry is built apart and replaced in one step, so the other
+        threads never see it empty.
         """
         query = "SHOW TABLES;"
         self.check_connection()
         self.cursor.execute(query)
-        self.tables = self.cursor.fetchall()
-        return self.tables
+        tables = self.cursor.fetchall()
+        self.tables = tables
+        self.schemas = {}
+        self.table_names = set(list(row.values())[0] for row in tables)
+        return tables
+
+    def register_table(self, table):
+        """
+        Add a table to the registry of tables, without asking the server.
+        The registry is copied and replaced, never modified in place.
+        """
+        names = self.table_names
+        if names is None:
+            self.list_tables()
+            names = self.table_names
+        self.table_names = names | {table}
+        self.schemas.pop(table, None)
+
+    def get_schema(self, table):
+        """
+        Return the list of columns of the table. The schema is read from the
+        server only the first time, then it is taken from the registry.
+        """
+        table = self.rename_table_query(table)
+        schema = self.schemas.get(table)
+        if schema is None:
+            self.check_connection()
+            self.cursor.execute("DESCRIBE {}".format(table))
+            schema = self.cursor.fetchall()
+            self.schemas[table] = schema
+        return schema
         
     def describe_table(self, table):
         """
         Describe the database table
         """
-        table = self.rename_table_query(table)
-        self.check_connection()            
-        self.cursor.execute("DESCRIBE {}".format(table))
-        print(self.cursor.fetchall())
+        print(self.get_schema(table))
 
     def remove_table(self, table):
         """
         Remove the table specified
         """
-        self.check_connection()
         table = self.rename_table_query(table)
         
         answer = input('Are you sure you want to delete the table {} (y/n): '.format(table))
         if answer.lower() == 'y':
-            self.cursor.execute("DROP TABLE {};".format(table))
-            self.con.commit()
+            self.drop_table(table)
+
+    def drop_table(self, table):
+        """
+        Remove the table if it exists, without asking (i.e. for scripts and
+        benchmarks).
+        """
+        self.check_connection()
+        table = self.rename_table_query(table)
+        self.cursor.execute("DROP TABLE IF EXISTS {};".format(table))
+        self.con.commit()
+        names = self.table_names
+        if names is not None:
+            self.table_names = names - {table}
+        self.schemas.pop(table, None)
         
     def read_table(self, table='BTCUSDT', start_date=None, end_date=None):
         """
@@ -153,12 +552,11 @@ class DB():
         newest to oldest.
         The table name is equivalent to the ticker of the asset.
         if start_date or end_date or both are defined, the result will be 
-        filtered by the dates. This dates must be strings with the format
+        filtered by the dates. This dates must be UTC strings with the format
         '%Y-%m-%d %H:%M:%S'
         This method return a list of dicts, with the column name and the value.
         """
         table = self.rename_table_query(table)
-        self.check_connection()
         if start_date and end_date:
             query = "SELECT * FROM {} WHERE trade_time between '{}' and '{}' ORDER BY trade_time ASC ;".format(table, start_date, end_date)
         elif start_date:
@@ -166,28 +564,157 @@ class DB():
         else:
             query = "SELECT * FROM {} ORDER BY trade_time ASC;".format(table)
         print(query)
-        self.cursor.execute(query)
-        return self.cursor.fetchall()
+        return self.fetchall(query)
             
+    def read_table_chunks(self, table='BTCUSDT', start_date=None, end_date=None,
+                          chunksize=100000, columns=None, after_trade_id=None,
+                          until_trade_id=None):
+        """
+        Streaming version of read_table. The rows are read with a server side
+        (unbuffered) cursor and yielded as DataFrames of up to chunksize rows,
+        with one typed NumPy column per field (see TICKER_DTYPES), so months
+        of trades can be processed with bounded memory.
+        columns -> list of columns to read (all the ticker columns by default).
+        The dates are UTC strings with the format '%Y-%m-%d %H:%M:%S'.
+        after_trade_id -> if defined, only the trades with a greater trade_id
+        are read, ordered by trade_id (to resume a previous read).
+        until_trade_id -> if defined, only the trades up to this trade_id
+        (included) are read, ordered by trade_id.
+        """
+        table = self.rename_table_query(table)
+        columns = list(columns or TICKER_COLUMNS)
+        conditions = []
+        if start_date:
+            conditions.append("trade_time >= '{}'".format(start_date))
+        if end_date:
+            conditions.append("trade_time <= '{}'".format(end_date))
+        order = 'trade_time'
+        if after_trade_id is not None:
+            conditions.append("trade_id > {}".format(int(after_trade_id)))
+            order = 'trade_id'
+        if until_trade_id is not None:
+            conditions.append("trade_id <= {}".format(int(until_trade_id)))
+            order = 'trade_id'
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        query = "SELECT {} FROM {} {} ORDER BY {} ASC;".format(', '.join(columns), table, where, order)
+        self.logger.debug(query)
+        for rows in self.stream_rows(query, chunksize=chunksize):
+            yield self.rows_to_frame(rows, columns)
+
+    def rows_to_frame(self, rows, columns):
+        """
+        Convert a list of row tuples to a DataFrame, building every column
+        directly as a typed NumPy array.
+        """
+        data = {}
+        for name, values in zip(columns, zip(*rows)):
+            dtype = TICKER_DTYPES.get(name)
+            if dtype is None:
+                data[name] = np.array(values, dtype=object)
+            elif dtype.startswith('datetime64'):
+                data[name] = np.array(values, dtype='datetime64[us]').astype(dtype)
+            elif dtype == 'float64':
+                data[name] = np.array([np.nan if v is None else v for v in values], dtype=dtype)
+            else:
+                data[name] = np.array(values, dtype=dtype)
+        return pd.DataFrame(data, columns=columns)
+
+    def read_candles(self, symbol='BTCUSDT', interval='1m', start_date=None, end_date=None):
+        """
+        Read the bars of the symbol and interval as a DataFrame indexed by
+        open_time. The dates are UTC strings with the format '%Y-%m-%d %H:%M:%S'.
+        """
+        table = self.rename_table_query('{}_{}'.format(symbol, interval))
+        conditions = []
+        if start_date:
+            conditions.append("open_time >= '{}'".format(start_date))
+        if end_date:
+            conditions.append("open_time <= '{}'".format(end_date))
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        rows = self.fetchall("SELECT * FROM {} {} ORDER BY open_time ASC;".format(table, where))
+        bars = pd.DataFrame(rows, columns=['open_time', 'open', 'high', 'low', 'close', 'volume', 'trades'])
+        bars[['open', 'high', 'low', 'close', 'volume']] = bars[['open', 'high', 'low', 'close', 'volume']].astype(float)
+        return bars.set_index('open_time')
+
+    def read_last_candle(self, symbol='BTCUSDT', interval='1m'):
+        """
+        read the last closed bar of the symbol and interval, None if there
+        are no bars.
+        """
+        table = self.rename_table_query('{}_{}'.format(symbol, interval))
+        if not self.exist_table(table):
+            return None
+        rows = self.fetchall("SELECT * FROM {} ORDER BY open_time DESC LIMIT 1;".format(table))
+        return rows[0] if rows else None
+
+    def read_daily_summary(self, symbol='BTCUSDT', days=2):
+        """
+        read the summary of the last days of the symbol (the most recent
+        first), with one lookup by the primary key.
+        """
+        if not self.exist_table(DAILY_SUMMARY):
+            return []
+        query = "SELECT * FROM {} WHERE symbol = %s ORDER BY day DESC LIMIT %s;".format(DAILY_SUMMARY)
+        return self.fetchall(query, (self.rename_table_query(symbol), days))
+
+    def read_close(self, table='BTCUSDT', day=None):
+        """
+        read the close of a UTC day (yesterday by default), the price of the
+        last trade before the end of the day, from the ticker table. None if
+        there are no trades.
+        """
+        if day is None:
+            day = datetime.utcnow().date() - timedelta(days=1)
+        table = self.rename_table_query(table)
+        if not self.exist_table(table):
+            return None
+        end = (datetime(day.year, day.month, day.day) - datetime(1970, 1, 1)).total_seconds() + DAY_MS / 1000
+        query = "SELECT price FROM {} WHERE trade_time < FROM_UNIXTIME(%s) ORDER BY trade_time DESC LIMIT 1;".format(table)
+        rows = self.fetchall(query, (end,))
+        return rows[0]['price'] if rows else None
+
     def read_last_row(self, table='BTCUSDT'):
         """
         read the last row in time from the database
         """
-        self.check_connection()
-        self.rename_table_query(table)
+        table = self.rename_table_query(table)
         query = "SELECT * FROM {} ORDER BY event_time DESC LIMIT 1;".format(table)
-        self.cursor.execute(query)
-        return self.cursor.fetchall()[0]
+        return self.fetchall(query)[0]
 
     def read_last_price(self, table='BTCUSDT'):
         """
         read the last row in time from the database
         """
-        self.check_connection()
-        self.rename_table_query(table)
+        table = self.rename_table_query(table)
         query = "SELECT price FROM {} ORDER BY event_time DESC LIMIT 1;".format(table)
-        self.cursor.execute(query)
-        return self.cursor.fetchone()
+        rows = self.fetchall(query)
+        return rows[0] if rows else None
+
+    def read_last_trade_id(self, table='BTCUSDT'):
+        """
+        read the last trade_id stored in the table (from the primary key), or
+        None if the table is empty. In the tables of the version 1 of the
+        schema the trade_id is a text, it is compared as a number.
+        """
+        table = self.rename_table_query(table)
+        column = 'trade_id'
+        if (self.get_schema_version(table) or SCHEMA_VERSION) < 2:
+            column = 'CAST(trade_id AS UNSIGNED)'
+        query = "SELECT MAX({}) AS trade_id FROM {};".format(column, table)
+        rows = self.fetchall(query)
+        if not rows or rows[0]['trade_id'] is None:
+            return None
+        return int(rows[0]['trade_id'])
+
+    def fetchall(self, query, params=None):
+        """
+        Execute the query with the cursor of the current thread and return
+        all the rows. The query is retried if the connection is lost.
+        """
+        def execute():
+            self.cursor.execute(query, params)
+            return self.cursor.fetchall()
+        return self.run(execute)
 
     def rename_table_query(self,table):
         """
@@ -208,12 +735,424 @@ class DB():
         if not self.exist_table(table):
             self.create_ticker_table(table)
         
-        placeholders = ', '.join(['%s'] * len(MD))
-        columns = ', '.join(MD.keys())
-        query = "INSERT INTO %s ( %s ) VALUES ( %s )" % (table, columns, placeholders)
-        try:
-            self.cursor.execute(query, list(MD.values()))
+        query = self.insert_query(table, list(MD.keys()))
+        def insert():
+            self.prepared_cursor(query).execute(query, list(MD.values()))
             self.con.commit()
+        try:
+            self.run(insert)
         except Exception:
             self.logger.exception("Error trying to insert MarketData into the table {}".format(table))
-        
\ No newline at end of file
+
+    def appendMDmany(self, table, rows, ignore=True):
+        """
+        Method to append a batch of market data to the specified table with
+        a single multi-row INSERT and one commit.
+        If the table is not found, it will be created.
+        The rows are a list of Dicts with the same keys (the columns of the
+        Ticker Table), or a list of namedtuples (like utils.trades.Trade) whose
+        fields are the columns. In the namedtuples, the times are epoch ms.
+        If ignore is True, the trades already stored (same trade_id) are
+        skipped instead of failing the whole batch. The candles (dicts with
+        open_time) already stored are replaced if the new bar has more trades.
+        Return the number of rows sent to the database.
+        """
+        if not rows:
+            return 0
+        table = self.rename_table_query(table)
+        self.check_connection()
+
+        if not self.exist_table(table):
+            self.create_ticker_table(table)
+
+        summary = False
+        if hasattr(rows[0], '_fields'):
+            #the tuples are sent as they are, and the server converts the times
+            columns = rows[0]._fields
+            query = self.insert_query(table, columns, ignore=ignore, ms_columns=MS_COLUMNS)
+            values = rows
+            summary = self.summary and 'trade_id' in columns
+            if summary:
+                self.create_daily_summary_table()
+        else:
+            columns = list(rows[0].keys())
+            if 'open_time' in columns:
+                query = self.insert_query(table, columns, update=CANDLE_UPSERT)
+            else:
+                query = self.insert_query(table, columns, ignore=ignore)
+            values = [[row[c] for c in columns] for row in rows]
+        def insert():
+            self.cursor.executemany(query, values)
+            if summary:
+                self.update_daily_summary(table, rows, inserted=self.cursor.rowcount)
+            self.con.commit()
+        try:
+            self.run(insert)
+            return len(rows)
+        except Exception:
+            self.logger.exception("Error trying to insert a batch of {} rows into the table {}".format(len(rows), table))
+            try:
+                self.con.rollback()
+            except Exception:
+                pass
+            return 0
+
+    def summarize_trades(self, rows):
+        """
+        Aggregate a batch of trades (namedtuples with epoch ms times) by UTC
+        day. Return a dict day -> [open, high, low, close, volume,
+        quote_volume, trades, first_trade_id, last_trade_id].
+        """
+        days = {}
+        for row in rows:
+            day = row.trade_time // DAY_MS
+            agg = days.get(day)
+            if agg is None:
+                days[day] = [row.price, row.price, row.price, row.price, row.quantity,
+                             row.price * row.quantity, 1, row.trade_id, row.trade_id]
+                continue
+            if row.price > agg[1]:
+                agg[1] = row.price
+            elif row.price < agg[2]:
+                agg[2] = row.price
+            agg[4] += row.quantity
+            agg[5] += row.price * row.quantity
+            agg[6] += 1
+            if row.trade_id < agg[7]:
+                agg[0] = row.price
+                agg[7] = row.trade_id
+            if row.trade_id > agg[8]:
+                agg[3] = row.price
+                agg[8] = row.trade_id
+        return {datetime.utcfromtimestamp(day * DAY_MS / 1000).date(): agg for day, agg in days.items()}
+
+    def update_daily_summary(self, symbol, rows, inserted=None):
+        """
+        Add a batch of trades to the daily summary, with the cursor (and the
+        transaction) of the current thread. If some trades were already
+        stored (inserted < len(rows)), adding the batch would count them
+        twice, so the days of the batch are marked to be rebuilt from the
+        ticker table later (see rebuild_stale_days), out of the writer.
+        """
+        days = self.summarize_trades(rows)
+        if inserted is not None and inserted < len(rows):
+            with self.stale_lock:
+                self.stale_days.update((symbol, day) for day in days)
+            return
+        query = DAILY_SUMMARY_UPSERT.format(DAILY_SUMMARY)
+        values = [(symbol, day, agg[0], agg[1], agg[2], agg[3], agg[4], agg[5],
+                   agg[5] / agg[4] if agg[4] else agg[3], agg[6], agg[7], agg[8])
+                  for day, agg in days.items()]
+        self.cursor.executemany(query, values)
+
+    def rebuild_day(self, symbol, day):
+        """
+        Summarize a UTC day of the ticker table of the symbol and replace its
+        row in the daily summary. Runs with the cursor of the current thread,
+        without commit.
+        """
+        table = self.rename_table_query(symbol)
+        start = (datetime(day.year, day.month, day.day) - datetime(1970, 1, 1)).total_seconds()
+        where = "trade_time >= FROM_UNIXTIME(%s) AND trade_time < FROM_UNIXTIME(%s)"
+        params = (start, start + DAY_MS / 1000)
+        self.cursor.execute("SELECT MIN(trade_id) AS first_id, MAX(trade_id) AS last_id, "
+                            "MAX(price) AS high, MIN(price) AS low, SUM(quantity) AS volume, "
+                            "SUM(price * quantity) AS quote_volume, COUNT(*) AS trades "
+                            "FROM {} WHERE {};".format(table, where), params)
+        agg = self.cursor.fetchall()[0]
+        if not agg['trades']:
+            self.cursor.execute("DELETE FROM {} WHERE symbol = %s AND day = %s;".format(DAILY_SUMMARY), (table, day))
+            return
+        prices = "SELECT price FROM {} WHERE trade_id = %s AND {};".format(table, where)
+        self.cursor.execute(prices, (agg['first_id'],) + params)
+        first = self.cursor.fetchall()[0]['price']
+        self.cursor.execute(prices, (agg['last_id'],) + params)
+        last = self.cursor.fetchall()[0]['price']
+        self.cursor.execute("REPLACE INTO {} (symbol, day, open, high, low, close, volume, quote_volume, "
+                            "vwap, trades, first_trade_id, last_trade_id) "
+                            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);".format(DAILY_SUMMARY),
+                            (table, day, first, agg['high'], agg['low'], last, agg['volume'],
+                             agg['quote_volume'], agg['quote_volume'] / agg['volume'] if agg['volume'] else last,
+                             agg['trades'], agg['first_id'], agg['last_id']))
+
+    def rebuild_stale_days(self):
+        """
+        Rebuild the days of the daily summary marked by update_daily_summary,
+        one day (and one commit) at a time, with the connection of the current
+        thread. The days that fail are kept for the next call.
+        Return the number of days rebuilt.
+        """
+        with self.stale_lock:
+            days, self.stale_days = self.stale_days, set()
+        count = 0
+        for symbol, day in sorted(days):
+            def rebuild():
+                self.rebuild_day(symbol, day)
+                self.con.commit()
+            try:
+                self.run(rebuild)
+                count += 1
+            except Exception:
+                self.logger.exception("Error rebuilding the daily summary of {} for {}".format(symbol, day))
+                with self.stale_lock:
+                    self.stale_days.add((symbol, day))
+        return count
+
+    def rebuild_daily_summary(self, symbol, start_date=None, end_date=None):
+        """
+        Rebuild the daily summary of the symbol from its ticker table, one
+        day (and one commit) at a time. The dates are date strings
+        ('%Y-%m-%d'), by default from the first to the last trade stored.
+        Return the number of days rebuilt.
+        """
+        table = self.rename_table_query(symbol)
+        self.create_daily_summary_table()
+        if start_date is None or end_date is None:
+            rows = self.fetchall("SELECT MIN(trade_time) AS first, MAX(trade_time) AS last FROM {};".format(table))
+            if not rows or rows[0]['first'] is None:
+                return 0
+            first = rows[0]['first']
+            end = rows[0]['last']
+        day = pd.Timestamp(start_date or first).date()
+        last = pd.Timestamp(end_date or end).date()
+        count = 0
+        while day <= last:
+            def rebuild():
+                self.rebuild_day(table, day)
+                self.con.commit()
+            self.run(rebuild)
+            count += 1
+            day += timedelta(days=1)
+        self.logger.info("{} days of {} rebuilt in the daily summary".format(count, table))
+        return count
+
+    def stream_rows(self, query, params=None, chunksize=10000, dictionary=False):
+        """
+        Generator that executes the query with an unbuffered cursor in its
+        own connection of the pool, and yields the rows in lists of up to
+        chunksize rows. Only one chunk is kept in memory at a time.
+        """
+        self.check_connection()
+        con = self.checkout()
+        try:
+            cursor = con.cursor(buffered=False, dictionary=dictionary)
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield rows
+            cursor.close()
+        finally:
+            if con in self.checked_out:
+                self.checked_out.remove(con)
+            con.close()
+
+    def get_schema_version(self, table):
+        """
+        Return the version of the schema of the ticker table. The tables
+        created before the versioning (without comment) are version 1.
+        """
+        table = self.rename_table_query(table)
+        rows = self.fetchall("SELECT TABLE_COMMENT FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s;", (self.db, table))
+        if not rows:
+            return None
+        comment = rows[0]['TABLE_COMMENT'] or ''
+        if comment.startswith('schema_version='):
+            return int(comment.split('=')[1])
+        return 1
+
+    def migrate_ticker_table(self, table, chunksize=50000, in_place=False):
+        """
+        Migrate a ticker table to the current version of the schema.
+        * in_place -> ALTER TABLE over the same table. It is the fastest, but
+          it locks the table and fails if there are duplicated trade_id.
+        * chunked (default) -> create a new table, copy the rows in chunks of
+          chunksize rows streaming the old table (duplicates are skipped), and
+          swap both tables with an atomic RENAME. The old table is kept with
+          the suffix _V1 as backup.
+        The trades stored while the migration runs are copied in a last pass
+        before the swap, but it is recommended to stop the BTCreader.
+        """
+        table = self.rename_table_query(table)
+        version = self.get_schema_version(table)
+        if version is None:
+            self.logger.error("The table {} does not exists".format(table))
+            return False
+        if version >= SCHEMA_VERSION:
+            self.logger.info("The table {} is already in the version {} of the schema".format(table, version))
+            return True
+
+        self.check_connection()
+        if in_place:
+            query = ("ALTER TABLE {} "
+                     "MODIFY trade_id BIGINT UNSIGNED NOT NULL, "
+                     "MODIFY event_time DATETIME(3) NOT NULL, "
+                     "MODIFY trade_time DATETIME(3) NOT NULL, "
+                     "MODIFY price DECIMAL(20,8) NOT NULL, "
+                     "MODIFY quantity DECIMAL(20,8) NOT NULL, "
+                     "MODIFY bid_id BIGINT UNSIGNED NULL, "
+                     "MODIFY ask_id BIGINT UNSIGNED NULL, "
+                     "ADD PRIMARY KEY (trade_id), "
+                     "ADD KEY idx_trade_time (trade_time), "
+                     "ADD KEY idx_event_time (event_time), "
+                     "COMMENT='schema_version={}';").format(table, SCHEMA_VERSION)
+            self.logger.info("Migrating the table {} in place".format(table))
+            self.cursor.execute(query)
+            self.con.commit()
+            self.schemas.pop(table, None)
+            return True
+
+        new_table = table + '_V' + str(SCHEMA_VERSION)
+        old_table = table + '_V' + str(version)
+        if not self.exist_table(new_table):
+            self.cursor.execute(TICKER_TABLE.format(new_table))
+            self.con.commit()
+            self.register_table(new_table)
+        columns = ', '.join(TICKER_COLUMNS)
+        insert = self.insert_query(new_table, TICKER_COLUMNS, ignore=True)
+
+        def copy(where=''):
+            copied = 0
+            for rows in self.stream_rows("SELECT {} FROM {} {};".format(columns, table, where), chunksize=chunksize):
+                self.cursor.executemany(insert, rows)
+                self.con.commit()
+                copied += len(rows)
+                self.logger.debug("{} rows copied from {} to {}".format(copied, table, new_table))
+            return copied
+
+        self.logger.info("Migrating the table {} in chunks of {} rows".format(table, chunksize))
+        copy()
+        #last pass for the trades stored while the table was copied
+        last = self.fetchall("SELECT MAX(trade_time) AS last FROM {};".format(new_table))[0]['last']
+        if last is not None:
+            copy("WHERE trade_time >= '{}'".format(last))
+        self.cursor.execute("RENAME TABLE {} TO {}, {} TO {};".format(table, old_table, new_table, table))
+        self.con.commit()
+        self.list_tables()
+        self.logger.info("Table {} migrated, the old version was kept as {}".format(table, old_table))
+        return True
+
+    def period_start(self, date, period=None):
+        """
+        Return the start of the period (day or month) that contains date.
+        """
+        period = period or self.partition
+        date = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        if period == 'month':
+            date = date.replace(day=1)
+        return date
+
+    def next_period(self, date, period=None):
+        """
+        Return the start of the period after the one that starts at date.
+        """
+        period = period or self.partition
+        if period == 'month':
+            return (date.replace(day=1) + timedelta(days=32)).replace(day=1)
+        return date + timedelta(days=1)
+
+    def partition_name(self, date, period=None):
+        """
+        Name of the partition of the period that starts at date.
+        """
+        period = period or self.partition
+        return date.strftime('p%Y%m' if period == 'month' else 'p%Y%m%d')
+
+    def partition_definitions(self, first, last, period=None):
+        """
+        Definitions of the partitions from the period of first to the period
+        of last (both included).
+        """
+        period = period or self.partition
+        start = self.period_start(first, period)
+        definitions = []
+        while start <= last:
+            end = self.next_period(start, period)
+            definitions.append("PARTITION {} VALUES LESS THAN ('{}')".format(
+                self.partition_name(start, period), end.strftime('%Y-%m-%d')))
+            start = end
+        return definitions
+
+    def partition_clause(self, first, period=None):
+        """
+        PARTITION BY clause for a new table, with partitions since the period
+        of first to self.partitions_ahead periods in the future, and a pmax
+        partition for anything later.
+        """
+        period = period or self.partition
+        last = self.period_start(datetime.utcnow(), period)
+        for _ in range(self.partitions_ahead):
+            last = self.next_period(last, period)
+        definitions = self.partition_definitions(first, last, period)
+        definitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+        return " PARTITION BY RANGE COLUMNS(trade_time) ({})".format(', '.join(definitions))
+
+    def list_partitions(self, table):
+        """
+        Return the partitions of the table as a list of dicts with the name
+        and the upper limit, ordered by limit. Empty if the table is not
+        partitioned.
+        """
+        table = self.rename_table_query(table)
+        rows = self.fetchall("SELECT PARTITION_NAME AS name, PARTITION_DESCRIPTION AS upper, TABLE_ROWS AS rows_count "
+                             "FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s "
+                             "AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION;", (self.db, table))
+        return rows
+
+    def partition_table(self, table, period=None):
+        """
+        Partition an existing ticker table by trade_time. The primary key is
+        extended with trade_time, as MySQL needs the partition column in every
+        unique key. This rebuilds the whole table.
+        """
+        period = period or self.partition or 'day'
+        table = self.rename_table_query(table)
+        first = self.fetchall("SELECT MIN(trade_time) AS first FROM {};".format(table))[0]['first'] or datetime.utcnow()
+        self.check_connection()
+        self.logger.info("Partitioning the table {} by {}".format(table, period))
+        self.cursor.execute("ALTER TABLE {} DROP PRIMARY KEY, ADD PRIMARY KEY (trade_id, trade_time){};".format(
+            table, self.partition_clause(first, period)))
+        self.con.commit()
+        self.schemas.pop(table, None)
+
+    def rotate_partitions(self, table, retention=None):
+        """
+        Create the partitions of the next self.partitions_ahead periods,
+        splitting the pmax partition, and drop the partitions older than
+        retention periods (self.retention by default). Dropping a partition
+        is O(1), no rows are deleted one by one.
+        Return the names of the partitions dropped.
+        """
+        table = self.rename_table_query(table)
+        retention = retention if retention is not None else self.retention
+        partitions = [p for p in self.list_partitions(table) if p['name'] != 'pmax']
+        if not partitions:
+            return []
+        period = 'month' if len(partitions[0]['name']) == 7 else 'day'
+        self.check_connection()
+
+        #new partitions
+        last_upper = datetime.strptime(partitions[-1]['upper'].strip("'")[:10], '%Y-%m-%d')
+        target = self.period_start(datetime.utcnow(), period)
+        for _ in range(self.partitions_ahead):
+            target = self.next_period(target, period)
+        if last_upper <= target:
+            definitions = self.partition_definitions(last_upper, target, period)
+            definitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+            self.cursor.execute("ALTER TABLE {} REORGANIZE PARTITION pmax INTO ({});".format(table, ', '.join(definitions)))
+            self.logger.debug("{} partitions added to the table {}".format(len(definitions) - 1, table))
+
+        #old partitions
+        dropped = []
+        if retention:
+            oldest = self.period_start(datetime.utcnow(), period)
+            for _ in range(retention - 1):
+                oldest = self.period_start(oldest - timedelta(days=1), period)
+            dropped = [p['name'] for p in partitions
+                       if datetime.strptime(p['upper'].strip("'")[:10], '%Y-%m-%d') <= oldest]
+            if dropped:
+                self.cursor.execute("ALTER TABLE {} DROP PARTITION {};".format(table, ', '.join(dropped)))
+                self.logger.info("Partitions {} dropped from the table {}".format(dropped, table))
+        self.con.commit()
+        return dropped
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Recovery of the trades missed by the websocket.
+
+The Binance trade ids of a symbol are consecutive, so a jump in the ids seen
+in the websocket is a gap (i.e. after a reconnection). The GapDetector finds
+the gaps, and the Backfiller downloads the missed trades with the REST API
+(historical trades, from the first missing id) in a background thread,
+keeping the request weight under the limit of the API. The trades are sent to
+the same sink as the live trades (the ingest queue), and the database skips
+the ones already stored (INSERT IGNORE by trade_id). When a gap is done,
+on_filled is called, i.e. to store the candles changed by the missed trades.
+"""
+import queue
+import threading
+import time
+from utils.trades import Trade
+
+_STOP = object()
+
+
+def parse_rest_trade(trade):
+    """
+    Build a Trade from a trade of the REST API (historical trades). The REST
+    trades have no event time nor order ids, the trade time is used.
+    """
+    return Trade(trade['time'], trade['id'], float(trade['price']),
+                 float(trade['qty']), None, None, trade['time'],
+                 trade['isBuyerMaker'])
+
+
+class GapDetector():
+    def __init__(self):
+        """
+        Keep the last trade id seen of every symbol.
+        """
+        self.last_ids = {}
+        #metrics
+        self.gaps = 0
+        self.missing = 0
+        self.gaps_by_symbol = {}
+
+    def seed(self, symbol, trade_id):
+        """
+        Start the detection of a symbol from a known trade id (i.e. the last
+        one stored in the database), to find the gap of the downtime.
+        """
+        if trade_id is not None:
+            self.last_ids[symbol] = trade_id
+
+    def check(self, symbol, trade_id):
+        """
+        Check the trade id of a new trade. Return the (first, last) ids missed
+        before it, or None if there is no gap. Repeated or older ids are
+        ignored.
+        """
+        last = self.last_ids.get(symbol)
+        if last is not None and trade_id <= last:
+            return None
+        self.last_ids[symbol] = trade_id
+        if last is None or trade_id == last + 1:
+            return None
+        self.gaps += 1
+        self.missing += trade_id - last - 1
+        self.gaps_by_symbol[symbol] = self.gaps_by_symbol.get(symbol, 0) + 1
+        return last + 1, trade_id - 1
+
+    def stats(self):
+        return {'gaps': self.gaps,
+                'missing': self.missing,
+                'gaps_by_symbol': dict(self.gaps_by_symbol)}
+
+
+class Backfiller():
+    def __init__(self, client, sink, limit=1000, weight=25, max_weight=600,
+                 max_gap=1000000, on_filled=None, logger=None):
+        """
+        client -> binance.client.Client used for the REST requests.
+        sink -> callable(symbol, trade) where the missed trades are sent.
+        limit -> trades by request (1000 is the maximum of the API).
+        weight -> weight of every request of historical trades.
+        max_weight -> weight allowed by minute for the backfill. The limit of
+        the API is shared with the rest of the application, so it is kept
+        under it.
+        max_gap -> maximum number of trades backfilled by gap. In a bigger gap
+        only the last max_gap trades are recovered.
+        on_filled -> callable(symbol) called after every gap, also when it
+        failed (the trades sent until the error are kept).
+        """
+        if logger is None:
+            from utils.createLogger import createLogger
+            self.logger = createLogger()
+        else:
+            self.logger = logger
+        self.client = client
+        self.sink = sink
+        self.limit = limit
+        self.weight = weight
+        self.max_weight = max_weight
+        self.max_gap = max_gap
+        self.on_filled = on_filled
+        self.queue = queue.Queue()
+        self.window_start = time.monotonic()
+        self.window_weight = 0
+
+        #metrics
+        self.gaps_requested = 0
+        self.gaps_filled = 0
+        self.gaps_failed = 0
+        self.trades_backfilled = 0
+        self.requests = 0
+        self.throttled = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+        self.thread = threading.Thread(target=self._work, name='backfill', daemon=True)
+        self.thread.start()
+
+    def request(self, symbol, first_id, last_id):
+        """
+        Queue the backfill of the trades first_id..last_id of the symbol.
+        """
+        if last_id - first_id + 1 > self.max_gap:
+            self.logger.warning("Gap of {} trades in {}, only the last {} will be backfilled".format(
+                last_id - first_id + 1, symbol, self.max_gap))
+            first_id = last_id - self.max_gap + 1
+        self.gaps_requested += 1
+        self.queue.put((symbol, first_id, last_id, time.monotonic()))
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def _throttle(self):
+        """
+        Wait until the next request fits in the weight of the current minute.
+        """
+        now = time.monotonic()
+        if now - self.window_start >= 60:
+            self.window_start = now
+            self.window_weight = 0
+        if self.window_weight + self.weight > self.max_weight:
+            self.throttled += 1
+            time.sleep(max(0, 60 - (now - self.window_start)))
+            self.window_start = time.monotonic()
+            self.window_weight = 0
+        self.window_weight += self.weight
+
+    def _used_weight(self):
+        """
+        Weight used in the current minute by all the requests with this API
+        key, as reported by the server in the last response (if available).
+        """
+        response = getattr(self.client, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        used = headers.get('x-mbx-used-weight-1m') or headers.get('x-mbx-used-weight')
+        return int(used) if used else None
+
+    def fetch(self, symbol, from_id):
+        """
+        Download a batch of historical trades starting in from_id. If the API
+        asks to slow down (HTTP 429/418), wait the time it says and retry.
+        """
+        from binance.exceptions import BinanceAPIException
+        while True:
+            self._throttle()
+            try:
+                self.requests += 1
+                trades = self.client.get_historical_trades(symbol=symbol, fromId=from_id, limit=self.limit)
+            except BinanceAPIException as e:
+                if e.status_code not in (418, 429):
+                    raise
+                retry_after = int(e.response.headers.get('Retry-After', 60))
+                self.throttled += 1
+                self.logger.error("Request weight exceeded, backfill paused for {} seconds".format(retry_after))
+                time.sleep(retry_after)
+                continue
+            used = self._used_weight()
+            if used is not None and used > 2 * self.max_weight:
+                #the rest of the application is using the API too, slow down
+                self.window_weight = self.max_weight
+            return trades
+
+    def backfill(self, symbol, first_id, last_id):
+        """
+        Download the trades first_id..last_id and send them to the sink.
+        Return the number of trades sent.
+        """
+        count = 0
+        from_id = first_id
+        while from_id <= last_id:
+            trades = self.fetch(symbol, from_id)
+            if not trades:
+                break
+            for trade in trades:
+                if trade['id'] > last_id:
+                    break
+                self.sink(symbol, parse_rest_trade(trade))
+                count += 1
+            from_id = trades[-1]['id'] + 1
+        return count
+
+    def _filled(self, symbol):
+        if self.on_filled is None:
+            return
+        try:
+            self.on_filled(symbol)
+        except Exception:
+            self.logger.exception("Error after the backfill of {}".format(symbol))
+
+    def _work(self):
+        """
+        Backfill thread. Process the gaps in order of detection.
+        """
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            symbol, first_id, last_id, detected_at = item
+            try:
+                count = self.backfill(symbol, first_id, last_id)
+            except Exception:
+                self.gaps_failed += 1
+                self.logger.exception("Error backfilling the trades {}-{} of {}".format(first_id, last_id, symbol))
+                continue
+            finally:
+                self._filled(symbol)
+            latency = time.monotonic() - detected_at
+            self.gaps_filled += 1
+            self.trades_backfilled += count
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.logger.info("{} trades of {} backfilled ({}-{}) in {:.1f} s".format(
+                count, symbol, first_id, last_id, latency))
+
+    def close(self, timeout=None):
+        """
+        Stop the thread after the gaps already queued.
+        """
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {'gaps_requested': self.gaps_requested,
+                'gaps_filled': self.gaps_filled,
+                'gaps_failed': self.gaps_failed,
+                'gaps_pending': self.pending(),
+                'trades_backfilled': self.trades_backfilled,
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'last_latency': self.last_latency,
+                'max_latency': self.max_latency}
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental OHLCV candles built at ingest time.
+
+The CandleBuilder keeps in memory the current bar of every interval, and it
+is updated with every trade. When a trade falls in a new period, the bar of
+the previous period is closed and returned, to be stored in its own table
+(SYMBOL_INTERVAL, i.e. BTCUSDT_1M) through DBtools.
+
+The trades recovered late by the gap backfill are older than the current
+bars, so they are merged (see merge) into the bar of their period: the open
+one, or one of the last closed bars kept in memory. The open and close of a
+bar are the prices of its first and last trade ids.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+#length of the intervals in milliseconds
+INTERVALS = {'1s': 1000,
+             '1m': 60 * 1000,
+             '5m': 5 * 60 * 1000,
+             '1h': 60 * 60 * 1000,
+             '1D': 24 * 60 * 60 * 1000}
+
+#position of the fields in the bars
+OPEN_TIME, OPEN, HIGH, LOW, CLOSE, VOLUME, TRADES, FIRST_ID, LAST_ID = range(9)
+
+
+def ms_to_str(ms):
+    """
+    Epoch milliseconds to the datetime string (UTC) used in the database.
+    """
+    return datetime.utcfromtimestamp(ms / 1000).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+class CandleBuilder():
+    def __init__(self, symbol, intervals=tuple(INTERVALS), keep=1500):
+        """
+        symbol -> ticker of the trades (i.e. BTCUSDT).
+        intervals -> intervals of the bars, keys of INTERVALS.
+        keep -> closed bars kept in memory by interval, where the late trades
+        can be merged (i.e. 25 hours of 1m bars).
+        """
+        self.symbol = symbol
+        self.intervals = [(interval, INTERVALS[interval]) for interval in intervals]
+        self.bars = {interval: None for interval in intervals}
+        self.keep = keep
+        #last closed bars by open time, and open time before which the bars
+        #are not known (not kept, or before the first trade)
+        self.closed = {interval: OrderedDict() for interval in intervals}
+        self.horizon = {interval: None for interval in intervals}
+        #open times of the closed bars changed by merge, to store them again
+        self.merged = {interval: set() for interval in intervals}
+        self.late_trades = 0
+        self.merged_trades = 0
+
+    def table(self, interval):
+        """
+        Name of the table of the bars of the interval.
+        """
+        return '{}_{}'.format(self.symbol, interval)
+
+    def update(self, trade_time, price, quantity, trade_id=None):
+        """
+        Update the current bars with a trade. trade_time is in epoch ms.
+        Return a list of (interval, bar) with the bars closed by this trade.
+        """
+        closed = []
+        for interval, length in self.intervals:
+            start = trade_time - trade_time % length
+            bar = self.bars[interval]
+            if bar is None or start > bar[OPEN_TIME]:
+                if bar is not None:
+                    closed.append((interval, bar))
+                    self._keep(interval, bar)
+                else:
+                    self.horizon[interval] = start - length
+                self.bars[interval] = [start, price, price, price, price, quantity, 1, trade_id, trade_id]
+            elif start == bar[OPEN_TIME]:
+                if price > bar[HIGH]:
+                    bar[HIGH] = price
+                elif price < bar[LOW]:
+                    bar[LOW] = price
+                bar[CLOSE] = price
+                bar[VOLUME] += quantity
+                bar[TRADES] += 1
+                bar[LAST_ID] = trade_id
+            else:
+                #trade older than the current bar, it can not be added
+                self.late_trades += 1
+        return closed
+
+    def _keep(self, interval, bar):
+        """
+        Keep a closed bar for the late trades, and forget the oldest one.
+        """
+        closed = self.closed[interval]
+        closed[bar[OPEN_TIME]] = bar
+        if len(closed) > self.keep:
+            open_time, _ = closed.popitem(last=False)
+            self.horizon[interval] = max(self.horizon[interval], open_time)
+
+    def merge(self, trade_time, price, quantity, trade_id):
+        """
+        Add a trade recovered late (older than the live trades, i.e. by the
+        gap backfill) to the bar of its period. A closed bar that changes is
+        returned later by pop_merged, to be stored again. A period without
+        bar had no live trades, so a new bar is created.
+        The trades older than the bars kept are counted in late_trades.
+        """
+        for interval, length in self.intervals:
+            start = trade_time - trade_time % length
+            current = self.bars[interval]
+            if current is None or start > current[OPEN_TIME] or start <= self.horizon[interval]:
+                self.late_trades += 1
+                continue
+            if start == current[OPEN_TIME]:
+                self._merge_trade(current, price, quantity, trade_id)
+                continue
+            bar = self.closed[interval].get(start)
+            if bar is None:
+                bar = [start, price, price, price, price, quantity, 1, trade_id, trade_id]
+                self.closed[interval][start] = bar
+            else:
+                self._merge_trade(bar, price, quantity, trade_id)
+            self.merged[interval].add(start)
+        self.merged_trades += 1
+
+    def _merge_trade(self, bar, price, quantity, trade_id):
+        if trade_id < bar[FIRST_ID]:
+            bar[OPEN] = price
+            bar[FIRST_ID] = trade_id
+        if trade_id > bar[LAST_ID]:
+            bar[CLOSE] = price
+            bar[LAST_ID] = trade_id
+        bar[HIGH] = max(bar[HIGH], price)
+        bar[LOW] = min(bar[LOW], price)
+        bar[VOLUME] += quantity
+        bar[TRADES] += 1
+
+    def pop_merged(self):
+        """
+        Return a list of (interval, bar) with the closed bars changed by merge
+        since the last call.
+        """
+        bars = []
+        for interval, open_times in self.merged.items():
+            closed = self.closed[interval]
+            bars.extend((interval, closed[t]) for t in sorted(open_times) if t in closed)
+            open_times.clear()
+        return bars
+
+    def to_row(self, bar):
+        """
+        Convert a bar to a dict with the columns of the candle tables.
+        """
+        return {'open_time': ms_to_str(bar[OPEN_TIME]),
+                'open': bar[OPEN],
+                'high': bar[HIGH],
+                'low': bar[LOW],
+                'close': bar[CLOSE],
+                'volume': bar[VOLUME],
+                'trades': bar[TRADES]}
+
+    def backfill(self, db, store, days=2, chunksize=100000):
+        """
+        Rebuild the bars from the raw trades stored in the database since the
+        last bar persisted (at most days ago), and call store(table, row) for
+        every closed bar that was not persisted yet.
+        The bars still open stay in memory, to be continued by the live trades.
+        """
+        last = {}
+        for interval, length in self.intervals:
+            db.create_candle_table(self.table(interval))
+            row = db.read_last_candle(self.symbol, interval)
+            last[interval] = row['open_time'] if row else None
+        start = datetime.utcnow() - timedelta(days=days)
+        persisted = [t for t in last.values() if t is not None]
+        if len(persisted) == len(last):
+            start = max(start, min(persisted))
+
+        #the times are stored as naive UTC datetimes, back to epoch ms
+        limits = {interval: (int(t.replace(tzinfo=timezone.utc).timestamp() * 1000) if t is not None else None)
+                  for interval, t in last.items()}
+        count = 0
+        for df in db.read_table_chunks(self.symbol, start_date=start.strftime('%Y-%m-%d %H:%M:%S'),
+                                       chunksize=chunksize, columns=['trade_time', 'trade_id', 'price', 'quantity']):
+            times = df['trade_time'].values.astype('datetime64[ms]').astype(np.int64)
+            for trade_time, trade_id, price, quantity in zip(times.tolist(), df['trade_id'].tolist(),
+                                                             df['price'].tolist(), df['quantity'].tolist()):
+                for interval, bar in self.update(trade_time, price, quantity, trade_id):
+                    if limits[interval] is None or bar[OPEN_TIME] > limits[interval]:
+                        store(self.table(interval), self.to_row(bar))
+                        count += 1
+        return count
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Export of the ticker tables to Parquet files, and loader for the analysis.
+
+The trades are streamed from the database in chunks (DB.read_table_chunks)
+and written in a Hive-like layout partitioned by date:
+
+    <folder>/<TABLE>/date=YYYY-MM-DD/part-<first trade_id>-<last trade_id>.parquet
+
+The last exported trade_id is saved in <folder>/<TABLE>/_state.json after
+every chunk, so the next export resumes from there. The trade ids of a symbol
+are consecutive, so the state also keeps the ranges of ids missing below the
+last one: the trades stored late (i.e. by the gap backfill, or by a writer
+that committed after another one) are exported by the next run.
+The loader reads only the dates and columns requested, and returns the
+DataFrames used by indicadores.getOHLC / getOHLC_fast and get_indicators, so
+the notebooks and batch jobs do not need to query the production database.
+
+It needs pyarrow.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+def _state_path(folder, table):
+    return os.path.join(folder, table, '_state.json')
+
+
+def _read_state(folder, table):
+    path = _state_path(folder, table)
+    if not os.path.exists(path):
+        return {'last_trade_id': None, 'missing': []}
+    with open(path) as f:
+        state = json.load(f)
+    state.setdefault('missing', [])
+    return state
+
+
+def last_exported(folder, table):
+    """
+    Last trade_id exported of the table, None if nothing was exported.
+    """
+    return _read_state(folder, table)['last_trade_id']
+
+
+def missing_ranges(folder, table):
+    """
+    Ranges of trade ids [first, last] below the last exported one that were
+    not in the database when they were exported.
+    """
+    return _read_state(folder, table)['missing']
+
+
+def _save_state(folder, table, last_trade_id, missing):
+    path = _state_path(folder, table)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'last_trade_id': int(last_trade_id),
+                   'missing': [[int(a), int(b)] for a, b in missing]}, f)
+    os.replace(tmp, path)
+
+
+def _gaps(ids, first, last):
+    """
+    Ranges [a, b] of the ids between first and last (both included) that are
+    not in ids (sorted).
+    """
+    bounds = np.concatenate(([first - 1], ids, [last + 1]))
+    holes = np.flatnonzero(np.diff(bounds) > 1)
+    return [[int(bounds[i] + 1), int(bounds[i + 1] - 1)] for i in holes]
+
+
+def _write_parts(df, folder, table):
+    """
+    Write a chunk of trades (sorted by trade_id) in one file per date.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    dates = df['trade_time'].values.astype('datetime64[D]')
+    for date in np.unique(dates):
+        part = df[dates == date]
+        path = os.path.join(folder, table, 'date={}'.format(date),
+                            'part-{}-{}.parquet'.format(part['trade_id'].iloc[0], part['trade_id'].iloc[-1]))
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        pq.write_table(pa.Table.from_pandas(part, preserve_index=False), path)
+
+
+def export_table(db, table='BTCUSDT', folder='data/parquet', chunksize=200000, logger=None,
+                 max_missing=1000):
+    """
+    Export the trades of the table (not exported yet) to Parquet files
+    partitioned by date: first the ones missing in the previous exports, then
+    the ones after the last trade_id exported. Return the number of trades
+    exported.
+    max_missing -> maximum number of missing ranges kept in the state (the
+    oldest are forgotten).
+    """
+    table = db.rename_table_query(table)
+    state = _read_state(folder, table)
+    last = state['last_trade_id']
+    exported = 0
+
+    #trades stored late, below the last trade_id exported
+    missing = []
+    for first, end in state['missing']:
+        found = []
+        for df in db.read_table_chunks(table, chunksize=chunksize, after_trade_id=first - 1,
+                                       until_trade_id=end):
+            _write_parts(df, folder, table)
+            found.append(df['trade_id'].to_numpy())
+            exported += len(df)
+        ids = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+        missing.extend(_gaps(ids, first, end))
+    if exported and logger is not None:
+        logger.info("{} trades of {} stored late were exported".format(exported, table))
+    if last is not None:
+        _save_state(folder, table, last, missing[-max_missing:])
+
+    for df in db.read_table_chunks(table, chunksize=chunksize, after_trade_id=-1 if last is None else last):
+        ids = df['trade_id'].to_numpy()
+        _write_parts(df, folder, table)
+        #the ids between chunks (and since the last export) are consecutive
+        missing.extend(_gaps(ids, ids[0] if last is None else last + 1, ids[-1]))
+        last = ids[-1]
+        missing = missing[-max_missing:]
+        exported += len(df)
+        _save_state(folder, table, last, missing)
+        if logger is not None:
+            logger.debug("{} trades of {} exported".format(exported, table))
+    return exported
+
+
+def load_trades(table='BTCUSDT', start_date=None, end_date=None, columns=None, folder='data/parquet'):
+    """
+    Load the exported trades as a DataFrame indexed by trade_time.
+    Only the files of the dates between start_date and end_date are read
+    (strings '%Y-%m-%d' or '%Y-%m-%d %H:%M:%S'), and only the columns
+    requested (all by default).
+    """
+    import pyarrow.dataset as ds
+
+    path = os.path.join(folder, table.upper())
+    dataset = ds.dataset(path, format='parquet', partitioning='hive', exclude_invalid_files=True)
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + ['trade_time']))
+    condition = None
+    if start_date:
+        start = pd.Timestamp(start_date)
+        condition = (ds.field('date') >= start.strftime('%Y-%m-%d')) & (ds.field('trade_time') >= start)
+    if end_date:
+        end = pd.Timestamp(end_date)
+        upper = (ds.field('date') <= end.strftime('%Y-%m-%d')) & (ds.field('trade_time') <= end)
+        condition = upper if condition is None else condition & upper
+    df = dataset.to_table(columns=columns, filter=condition).to_pandas()
+    if 'trade_id' in df.columns:
+        #an export interrupted before saving its state writes the chunk again
+        df = df.drop_duplicates(subset='trade_id')
+    df = df.drop(columns=['date'], errors='ignore').set_index('trade_time').sort_index()
+    return df
+
+
+def load_ohlcv(table='BTCUSDT', period='1h', start_date=None, end_date=None, folder='data/parquet'):
+    """
+    Bars of the exported trades with the columns used by
+    indicadores.get_indicators (Open, High, Low, Close, Volume).
+    """
+    from utils import indicadores
+    trades = load_trades(table, start_date, end_date, columns=['trade_id', 'price', 'quantity'], folder=folder)
+    bars = indicadores.getOHLC_fast(trades, period=period)
+    return bars.rename(columns={'open': 'Open', 'high': 'High', 'low': 'Low',
+                                'close': 'Close', 'volume': 'Volume'})
@@ -23,9 +23,7 @@ def MACD(df,columna,short_window=12,long_window=26,smooth_signal=9):
     df2 = df.copy()
     MACD = pd.DataFrame()
     df2['EMA{}'.format(short_window)] = df[columna].ewm(span=short_window).mean()
-    df2['EMA{}'.format(short_window)].fillna(df2['EMA{}'.format(short_window)], inplace=True)
     df2['EMA{}'.format(long_window)] = df[columna].ewm(span=long_window).mean()
-    df2['EMA{}'.format(long_window)].fillna(df2['EMA{}'.format(long_window)], inplace=True)
     MACD['MACD'] = df2['EMA{}'.format(short_window)] - df2['EMA{}'.format(long_window)]
     MACD['MACD_SIGNAL'] = MACD['MACD'].rolling(window=smooth_signal,min_periods=1).mean()
     MACD['MACD_HIST'] = MACD['MACD'] - MACD['MACD_SIGNAL']
@@ -63,7 +61,7 @@ def RSI(df,columna,window_length=14):
     # Calculate the RSI based on SMA
     RSI['RSI_SMA'] = 100.0 - (100.0 / (1.0 + roll_up2 / roll_down2))
     # Completo los valores NaN con el primer valor
-    RSI.fillna(method='ffill', inplace=True)
+    RSI.ffill(inplace=True)
     return RSI
 
 def PP(df, close_col = 'close', high_col = 'high', low_col = 'low'):
@@ -86,7 +84,7 @@ def VWAP(df,column_price, column_volume):
     outputs
         * new datafrma with
     """    
-    df.fillna(method='ffill', inplace=True)
+    df.ffill(inplace=True)
     q = df[column_volume].values
     p = df[column_price].values
     vwap = (p * q).cumsum() / q.cumsum()
@@ -114,7 +112,7 @@ def STOCHASTIC(df, column_name = 'Close',window=14, smoothk=1,smoothd=3):
         inputs:
             * df = dataframe with close price
     """
-    df.fillna(method='ffill', inplace=True)
+    df.ffill(inplace=True)
     stoch = pd.DataFrame(index=df.index)
     max, min = df[column_name].rolling(window=window).max(), df[column_name].rolling(window=window).min()
     stoch['STO_K'] = 100*(df[column_name] - min)/(max-min)
@@ -146,8 +144,8 @@ def ADX(df, col_close='Close', col_high='High', col_low='Low', window_length=14)
     
     #direction movements
     dm = pd.concat([moveup, movedown], axis=1)
-    dm['pdm'] = 0
-    dm['ndm'] = 0
+    dm['pdm'] = 0.0
+    dm['ndm'] = 0.0
     
     condition = (moveup['MoveUp']>0) & (moveup['MoveUp']>movedown['MoveDown'])
     dm.loc[condition, 'pdm'] = moveup.loc[condition, 'MoveUp']
@@ -214,19 +212,68 @@ def get_indicators(df):
     return pd.concat([macd, rsi, vwap, roc5, stoch, bb, adx, pct_change, em, cci], axis=1)
 
 
-def drop_high_corr_indicators(indicators, condition = 0.7):
+def select_uncorrelated(indicators, condition = 0.7, window = None, sample = None, plot = None, seed = 0):
+    """
+    Selección de columnas sin gráficos, vectorizada en NumPy (float32).
+    Se descarta cada columna que tiene una correlación absoluta mayor a
+    condition con alguna columna anterior (mismo criterio que
+    drop_high_corr_indicators).
+    inputs:
+        * indicators -> DataFrame con los indicadores.
+        * condition -> correlación máxima permitida.
+        * window -> si se define, se usan solo las últimas window filas.
+        * sample -> si se define, se usa una muestra de sample filas.
+        * plot -> nombre de archivo donde guardar la matriz de correlación
+          (opcional, no se muestra nada en pantalla).
+    Los NaN se reemplazan por la media de la columna, por lo que no aportan
+    a la covarianza.
+    outputs:
+        * kept, dropped -> listas con los nombres de las columnas.
+    """
+    x = indicators.to_numpy(dtype=np.float32)
+    if window is not None:
+        x = x[-window:]
+    if sample is not None and sample < len(x):
+        rows = np.random.default_rng(seed).choice(len(x), size=sample, replace=False)
+        x = x[np.sort(rows)]
+    x = np.where(np.isfinite(x), x, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = x - np.nanmean(x, axis=0)
+        x = np.nan_to_num(x, nan=0.0)
+        std = np.sqrt(np.einsum('ij,ij->j', x, x))
+        corr = np.abs((x.T @ x) / np.outer(std, std))
+    to_drop = (np.triu(corr, k=1) > condition).any(axis=0)
+    columns = np.asarray(indicators.columns)
+    kept, dropped = list(columns[~to_drop]), list(columns[to_drop])
+
+    if plot:
+        #Figure sin pyplot: no abre ventanas ni cambia el backend del proceso
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=(12, 6))
+        axes = fig.subplots(1, 2)
+        axes[0].matshow(corr)
+        axes[0].set_title('all')
+        axes[1].matshow(corr[np.ix_(~to_drop, ~to_drop)])
+        axes[1].set_title('kept')
+        fig.savefig(plot)
+    return kept, dropped
+
+
+def drop_high_corr_indicators(indicators, condition = 0.7, plot = True):
     import matplotlib.pyplot as plt
     corr_matrix = indicators.corr().abs()
-    upper = corr_matrix.where(np.triu(np.ones(corr_matrix.shape), k=1).astype(np.bool))
+    upper = corr_matrix.where(np.triu(np.ones(corr_matrix.shape), k=1).astype(bool))
 
     # Find index of feature columns with correlation greater than 0.95
     to_drop = [column for column in upper.columns if any(upper[column] > condition)]
     
-    plt.matshow(corr_matrix)
-    plt.show()
+    if plot:
+        plt.matshow(corr_matrix)
+        plt.show()
     indicators.drop(indicators[to_drop], axis=1, inplace=True)
-    plt.matshow(indicators.corr().abs())
-    plt.show()
+    if plot:
+        plt.matshow(indicators.corr().abs())
+        plt.show()
     
     return indicators
 
@@ -244,8 +291,109 @@ def getOHLC(df,column_name_price = 'price', column_name_size = 'quantity',period
     try:
         vol  = df[column_name_size].resample(period).sum()
 
-        ohlcv = pd.concat([ohlc, vol], axis=1, join_axes=[ohlc.index])
+        ohlcv = pd.concat([ohlc, vol], axis=1).reindex(ohlc.index)
         ohlcv.rename(columns={column_name_size:'volume'}, inplace=True)
         return ohlcv
     except:
-        return ohlc
\ No newline at end of file
+        return ohlc
+
+def getOHLC_chunks(chunks, column_name_price = 'price', column_name_size = 'quantity', period='1D', time_col='trade_time'):
+    """
+    OHLCV from an iterable of DataFrames of trades (like DB.read_table_chunks),
+    keeping in memory only one chunk and the bars.
+    Every chunk is resampled, and the partial bars of a period that falls in
+    two chunks are merged (first open, max high, min low, last close and the
+    sum of the volume).
+    """
+    parts = []
+    for df in chunks:
+        df = df.set_index(time_col)
+        ohlc = df[column_name_price].resample(period).ohlc()
+        ohlc['volume'] = df[column_name_size].resample(period).sum()
+        parts.append(ohlc.dropna(subset=['open']))
+    if not parts:
+        return pd.DataFrame(columns=['open', 'high', 'low', 'close', 'volume'])
+    bars = pd.concat(parts).groupby(level=0, sort=True)
+    return pd.DataFrame({'open': bars['open'].first(),
+                         'high': bars['high'].max(),
+                         'low': bars['low'].min(),
+                         'close': bars['close'].last(),
+                         'volume': bars['volume'].sum()})
+
+
+def ohlcv_ticks(times, price, quantity, period='1D', trade_id=None):
+    """
+    OHLCV de trades en una sola pasada, con reducciones por segmento de NumPy.
+    inputs:
+        * times -> array int64 de epoch en milisegundos, ordenado.
+        * price, quantity -> arrays float con el precio y el tamaño.
+        * period -> período de las barras ('1s', '1min', '1h', '1D', ...).
+        * trade_id -> si se define, se descartan los trades repetidos.
+    output:
+        * DataFrame indexado por el inicio de cada período (solo los períodos
+          con trades) con open, high, low, close, volume, trades y vwap.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    price = np.asarray(price, dtype=np.float64)
+    quantity = np.asarray(quantity, dtype=np.float64)
+    if trade_id is not None:
+        trade_id = np.asarray(trade_id)
+        step = np.diff(trade_id)
+        if len(step) == 0 or step.min() >= 0:
+            #ids ordenados, los repetidos son consecutivos
+            drop = np.flatnonzero(step == 0) + 1
+        else:
+            keep = np.zeros(len(trade_id), dtype=bool)
+            keep[np.unique(trade_id, return_index=True)[1]] = True
+            drop = np.flatnonzero(~keep)
+        if len(drop):
+            times, price, quantity = np.delete(times, drop), np.delete(price, drop), np.delete(quantity, drop)
+    columns = ['open', 'high', 'low', 'close', 'volume', 'trades', 'vwap']
+    if len(times) == 0:
+        return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], name='date'))
+
+    length = pd.Timedelta(period).value // 10**6
+    first, last = times[0] // length, times[-1] // length
+    if last - first < len(times):
+        #límites de los períodos por búsqueda binaria, sin recorrer los trades
+        opens = np.arange(first, last + 2, dtype=np.int64) * length
+        limits = np.searchsorted(times, opens)
+        full = limits[1:] > limits[:-1]
+        starts, opens = limits[:-1][full], opens[:-1][full]
+    else:
+        bucket = times // length
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        opens = bucket[starts] * length
+    ends = np.r_[starts[1:], len(times)]
+    volume = np.add.reduceat(quantity, starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vwap = np.add.reduceat(price * quantity, starts) / volume
+    index = pd.DatetimeIndex(opens.astype('datetime64[ms]'), name='date')
+    return pd.DataFrame({'open': price[starts],
+                         'high': np.maximum.reduceat(price, starts),
+                         'low': np.minimum.reduceat(price, starts),
+                         'close': price[ends - 1],
+                         'volume': volume,
+                         'trades': ends - starts,
+                         'vwap': vwap}, index=index, columns=columns)
+
+
+def getOHLC_fast(df, column_name_price = 'price', column_name_size = 'quantity', period='1D', time_col=None, id_col='trade_id'):
+    """
+    Versión rápida de getOHLC usando ohlcv_ticks. Los tiempos se toman del
+    índice o de la columna time_col, y si existe la columna id_col se
+    descartan los trades repetidos.
+    """
+    times = df.index if time_col is None else df[time_col]
+    times = np.asarray(times, dtype='datetime64[ms]').astype(np.int64)
+    trade_id = df[id_col].to_numpy() if id_col in df.columns else None
+    order = None
+    if len(times) > 1 and not (times[1:] >= times[:-1]).all():
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        trade_id = trade_id[order] if trade_id is not None else None
+    price = df[column_name_price].to_numpy(dtype=np.float64)
+    quantity = df[column_name_size].to_numpy(dtype=np.float64)
+    if order is not None:
+        price, quantity = price[order], quantity[order]
+    return ohlcv_ticks(times, price, quantity, period=period, trade_id=trade_id)
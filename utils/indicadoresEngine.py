@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de indicadores fusionado.
+
+Recibe una lista declarativa de indicadores con sus parámetros, y los calcula
+todos juntos sobre arrays de NumPy:
+    * las sub-expresiones comunes (shifts, EMAs, medias y desvíos móviles,
+      el True Range, el ATR, etc.) se calculan una sola vez y se reutilizan
+      entre indicadores y entre sets de parámetros.
+    * los resultados se escriben en un único bloque de columnas reservado de
+      antemano, y se devuelve un solo DataFrame sin pd.concat.
+Los valores son los mismos que los de las funciones de utils.indicadores
+llamadas en el orden del spec, también con NaN en la entrada: como VWAP y
+STOCHASTIC completan los NaN del DataFrame (ffill), los indicadores anteriores
+usan los datos originales y los siguientes los datos completados.
+
+Ejemplo:
+    engine = IndicatorEngine([('MACD', {}), ('RSI', {'window_length': 10}),
+                              ('BB', {'n_std': 2}), ('BB', {'n_std': 3})])
+    indicators = engine.compute(df)
+"""
+import numpy as np
+import pandas as pd
+
+#mismos indicadores y parámetros que indicadores.get_indicators
+DEFAULT_SPEC = [('MACD', {}),
+                ('RSI', {}),
+                ('VWAP', {}),
+                ('ROC', {'n': 5}),
+                ('STOCHASTIC', {}),
+                ('BB', {}),
+                ('ADX', {'window_length': 14}),
+                ('PCT_CHANGE', {}),
+                ('EASYMOVEMENT', {}),
+                ('CCI', {})]
+
+#parámetros por defecto de cada indicador (los de utils.indicadores)
+DEFAULTS = {'MACD': {'short_window': 12, 'long_window': 26, 'smooth_signal': 9},
+            'RSI': {'window_length': 14},
+            'VWAP': {},
+            'ROC': {'n': 2},
+            'STOCHASTIC': {'window': 14, 'smoothk': 1, 'smoothd': 3},
+            'BB': {'window_length': 20, 'n_std': 2},
+            'ATR': {'window_length': 14},
+            'ADX': {'window_length': 14},
+            'PCT_CHANGE': {},
+            'EASYMOVEMENT': {'window_length': 14, 'x': 100000000},
+            'CCI': {'window_length': 20, 'constant': .015}}
+
+#indicadores que en utils.indicadores completan los NaN del DataFrame (ffill)
+FILL = ('VWAP', 'STOCHASTIC')
+
+
+def columns_of(name, params):
+    """
+    Nombres de las columnas que devuelve el indicador con esos parámetros.
+    """
+    if name == 'MACD':
+        return ['MACD', 'MACD_SIGNAL', 'MACD_HIST']
+    if name == 'RSI':
+        return ['RSI_EWMA', 'RSI_SMA']
+    if name == 'VWAP':
+        return ['VWAP']
+    if name == 'ROC':
+        return ['ROC_{}'.format(params['n'])]
+    if name == 'STOCHASTIC':
+        return ['STO_K', 'STO_D']
+    if name == 'BB':
+        return ['BB_m', 'BB_u', 'BB_d']
+    if name == 'ATR':
+        return ['ATR']
+    if name == 'ADX':
+        return ['PDI', 'NDI', 'ADX']
+    if name == 'PCT_CHANGE':
+        return ['PCT_CHANGE']
+    if name == 'EASYMOVEMENT':
+        return ['EM_1', 'EM_{}'.format(params['window_length'])]
+    if name == 'CCI':
+        return ['CCI']
+    raise ValueError("Unknown indicator {}".format(name))
+
+
+class IndicatorEngine():
+    def __init__(self, spec=DEFAULT_SPEC, col_close='Close', col_high='High',
+                 col_low='Low', col_volume='Volume'):
+        """
+        spec -> lista de (nombre del indicador, dict de parámetros). Los
+        parámetros que no se indican toman el valor por defecto.
+        col_* -> nombres de las columnas del DataFrame de entrada.
+        """
+        self.columns_in = {'close': col_close, 'high': col_high, 'low': col_low, 'volume': col_volume}
+        self.spec = []
+        for name, params in spec:
+            if name not in DEFAULTS:
+                raise ValueError("Unknown indicator {}".format(name))
+            full = dict(DEFAULTS[name])
+            full.update(params)
+            self.spec.append((name, full))
+        #nombres de columnas, con sufijo de parámetros si se repiten
+        names = [columns_of(name, params) for name, params in self.spec]
+        flat = [c for cols in names for c in cols]
+        self.layout = []
+        self.columns = []
+        for (name, params), cols in zip(self.spec, names):
+            if any(flat.count(c) > 1 for c in cols):
+                suffix = '_'.join(str(v) for v in params.values())
+                cols = ['{}_{}'.format(c, suffix) for c in cols]
+            self.layout.append((name, params, len(self.columns), len(cols)))
+            self.columns.extend(cols)
+        self.cache = {}
+
+    def compute(self, df):
+        """
+        Calcula todos los indicadores del spec sobre df y devuelve un solo
+        DataFrame con el índice de df.
+        """
+        self.n = len(df)
+        inputs = {key: df[column] for key, column in self.columns_in.items() if column in df.columns}
+        self.cache = {key: x.to_numpy(dtype=np.float64) for key, x in inputs.items()}
+        filled = not any(x.isna().any() for x in inputs.values())
+        block = np.empty((self.n, len(self.columns)), dtype=np.float64)
+        for name, params, start, width in self.layout:
+            if name in FILL and not filled:
+                #desde acá se usan los datos completados, y las sub-expresiones
+                #calculadas con los NaN ya no sirven
+                self.cache = {key: x.ffill().to_numpy(dtype=np.float64) for key, x in inputs.items()}
+                filled = True
+            getattr(self, '_' + name)(block[:, start:start + width], **params)
+        self.cache = {}
+        return pd.DataFrame(block, index=df.index, columns=self.columns, copy=False)
+
+    #%% sub-expresiones comunes
+    def get(self, key, function):
+        """
+        Devuelve la sub-expresión key, calculándola solo la primera vez.
+        """
+        value = self.cache.get(key)
+        if value is None:
+            value = function()
+            self.cache[key] = value
+        return value
+
+    def next_bar(self, key):
+        """
+        Serie desplazada una barra hacia atrás (shift(-1)).
+        """
+        def shift():
+            x = self.cache[key]
+            out = np.empty_like(x)
+            out[:-1] = x[1:]
+            out[-1:] = np.nan
+            return out
+        return self.get(('next', key), shift)
+
+    def ewm(self, key, min_periods=0, **kwargs):
+        return self.get(('ewm', key, min_periods, tuple(sorted(kwargs.items()))),
+                        lambda: pd.Series(self.cache[key]).ewm(min_periods=min_periods, **kwargs).mean().to_numpy())
+
+    def rolling(self, key, window, stat, min_periods=None):
+        return self.get(('rolling', key, window, stat, min_periods),
+                        lambda: getattr(pd.Series(self.cache[key]).rolling(window=window, min_periods=min_periods), stat)().to_numpy())
+
+    def derived(self, key, function):
+        """
+        Registra una serie derivada (por ejemplo el precio típico) para que se
+        pueda usar en ewm/rolling.
+        """
+        self.get(key, function)
+        return key
+
+    def atr(self, window_length):
+        tr = self.derived('true_range', lambda: np.fmax(np.fmax(self.cache['high'] - self.cache['low'],
+                                                                np.abs(self.cache['high'] - self.next_bar('close'))),
+                                                        np.abs(self.cache['low'] - self.next_bar('close'))))
+        return self.rolling(tr, window_length, 'mean')
+
+    #%% indicadores
+    def _MACD(self, out, short_window, long_window, smooth_signal):
+        np.subtract(self.ewm('close', span=short_window), self.ewm('close', span=long_window), out=out[:, 0])
+        key = self.derived(('macd', short_window, long_window), lambda: out[:, 0].copy())
+        out[:, 1] = self.rolling(key, smooth_signal, 'mean', min_periods=1)
+        np.subtract(out[:, 0], out[:, 1], out=out[:, 2])
+
+    def _RSI(self, out, window_length):
+        def parts():
+            delta = np.diff(self.cache['close'])
+            up = np.where(delta < 0, 0.0, delta)
+            down = np.abs(np.where(delta > 0, 0.0, delta))
+            self.cache['rsi_up'], self.cache['rsi_down'] = up, down
+            return True
+        self.get('rsi_parts', parts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ewma = 100.0 - 100.0 / (1.0 + self.ewm('rsi_up', com=window_length, min_periods=window_length) /
+                                    self.ewm('rsi_down', com=window_length, min_periods=window_length))
+            sma = 100.0 - 100.0 / (1.0 + self.rolling('rsi_up', window_length, 'mean', min_periods=window_length) /
+                                   self.rolling('rsi_down', window_length, 'mean', min_periods=window_length))
+        out[:1] = np.nan
+        out[1:, 0] = ewma
+        out[1:, 1] = sma
+        out[:] = pd.DataFrame(out).ffill().to_numpy()
+
+    def _VWAP(self, out):
+        p, q = self.cache['close'], self.cache['volume']
+        np.divide(np.cumsum(p * q), np.cumsum(q), out=out[:, 0])
+
+    def _ROC(self, out, n):
+        out[:, 0] = np.gradient(self.cache['close'])
+
+    def _STOCHASTIC(self, out, window, smoothk, smoothd):
+        high = self.rolling('close', window, 'max')
+        low = self.rolling('close', window, 'min')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            k = self.derived(('sto_raw', window), lambda: 100*(self.cache['close'] - low)/(high - low))
+        k = self.derived(('sto_k', window, smoothk), lambda: self.rolling(k, smoothk, 'mean'))
+        out[:, 0] = self.cache[k]
+        out[:, 1] = self.rolling(k, smoothd, 'mean')
+
+    def _BB(self, out, window_length, n_std):
+        mean = self.rolling('close', window_length, 'mean')
+        std = self.rolling('close', window_length, 'std')
+        out[:, 0] = mean
+        out[:, 1] = mean + std*n_std
+        out[:, 2] = mean - std*n_std
+
+    def _ATR(self, out, window_length):
+        out[:, 0] = self.atr(window_length)
+
+    def _ADX(self, out, window_length):
+        def movements():
+            moveup = self.cache['high'] - self.next_bar('high')
+            movedown = self.next_bar('low') - self.cache['low']
+            with np.errstate(invalid='ignore'):
+                self.cache['pdm'] = np.where((moveup > 0) & (moveup > movedown), moveup, 0.0)
+                self.cache['ndm'] = np.where((movedown > 0) & (movedown > moveup), movedown, 0.0)
+            return True
+        self.get('movements', movements)
+        atr = self.atr(window_length)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(100*self.ewm('pdm', span=window_length), atr, out=out[:, 0])
+            np.divide(100*self.ewm('ndm', span=window_length), atr, out=out[:, 1])
+            np.divide(100*np.abs(out[:, 0] - out[:, 1]), out[:, 0] + out[:, 1], out=out[:, 2])
+
+    def _PCT_CHANGE(self, out):
+        close = self.cache['close']
+        out[:1, 0] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(close[1:], close[:-1], out=out[1:, 0])
+        out[1:, 0] -= 1
+
+    def _EASYMOVEMENT(self, out, window_length, x):
+        def spem():
+            high, low = self.cache['high'], self.cache['low']
+            distance = (high + low)/2 - (self.next_bar('high') + self.next_bar('low'))/2
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return distance / ((self.cache['volume']/x)/(high - low))
+        key = self.derived(('spem', x), spem)
+        out[:, 0] = self.cache[key]
+        out[:, 1] = self.rolling(key, window_length, 'mean')
+
+    def _CCI(self, out, window_length, constant):
+        #mismo precio típico que indicadores.CCI
+        key = self.derived('typical_price', lambda: (self.cache['high'] + self.cache['low'] + self.cache['low'])/3)
+        mean = self.rolling(key, window_length, 'mean')
+        std = self.rolling(key, window_length, 'std')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(self.cache[key] - mean, constant*std, out=out[:, 0])
+
+
+def get_indicators(df, spec=DEFAULT_SPEC):
+    """
+    Versión fusionada de indicadores.get_indicators.
+    """
+    return IndicatorEngine(spec).compute(df)
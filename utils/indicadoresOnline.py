@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Versiones incrementales (streaming) de los indicadores de utils.indicadores.
+
+Cada indicador es un objeto con estado, y el método update(bar) agrega una
+barra nueva en O(1) y devuelve un dict con los mismos nombres de columnas y
+los mismos valores que la función batch para esa barra. La barra es un dict
+(o una fila de un DataFrame) con las columnas indicadas en el constructor.
+
+ATR y ADX en su versión batch usan la barra siguiente (shift(-1)), por lo que
+su update devuelve los valores de la barra anterior (None en la primera).
+"""
+from collections import deque
+import math
+
+NAN = float('nan')
+
+
+def isnan(x):
+    return x is None or x != x
+
+
+def div(a, b):
+    """
+    División con la semántica de pandas: x/0 es +-inf y 0/0 es NaN.
+    """
+    if b == 0:
+        if isnan(a) or a == 0:
+            return NAN
+        return math.copysign(float('inf'), a) * math.copysign(1, b)
+    return a / b
+
+
+class EWMA():
+    """
+    Media móvil exponencial equivalente a Series.ewm(alpha).mean() con
+    adjust=True.
+    """
+    def __init__(self, alpha, min_periods=0):
+        self.decay = 1 - alpha
+        self.min_periods = max(min_periods, 1)
+        self.num = 0.0
+        self.den = 0.0
+        self.count = 0
+
+    def update(self, x):
+        self.num *= self.decay
+        self.den *= self.decay
+        if not isnan(x):
+            self.num += x
+            self.den += 1
+            self.count += 1
+        if self.count < self.min_periods:
+            return NAN
+        return self.num / self.den
+
+
+class RollingMean():
+    """
+    Media móvil equivalente a Series.rolling(window, min_periods).mean().
+    Mantiene la suma de la ventana.
+    """
+    def __init__(self, window, min_periods=None):
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.values = deque()
+        self.sum = 0.0
+        self.count = 0
+
+    def update(self, x):
+        self.values.append(x)
+        if not isnan(x):
+            self.sum += x
+            self.count += 1
+        if len(self.values) > self.window:
+            old = self.values.popleft()
+            if not isnan(old):
+                self.sum -= old
+                self.count -= 1
+        if self.count < self.min_periods or self.count == 0:
+            return NAN
+        return self.sum / self.count
+
+
+class RollingStats():
+    """
+    Media y desvío estándar (ddof=1) de una ventana móvil, con la
+    actualización de Welford para agregar y quitar valores.
+    """
+    def __init__(self, window, min_periods=None):
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.values = deque()
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def _add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def _remove(self, x):
+        if self.count == 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        delta = x - self.mean
+        self.count -= 1
+        self.mean -= delta / self.count
+        self.m2 -= delta * (x - self.mean)
+
+    def update(self, x):
+        """
+        Agrega x y devuelve (media, desvío).
+        """
+        self.values.append(x)
+        if not isnan(x):
+            self._add(x)
+        if len(self.values) > self.window:
+            old = self.values.popleft()
+            if not isnan(old):
+                self._remove(old)
+        if self.count < self.min_periods or self.count == 0:
+            return NAN, NAN
+        std = math.sqrt(max(self.m2, 0.0) / (self.count - 1)) if self.count > 1 else NAN
+        return self.mean, std
+
+
+class RollingExtreme():
+    """
+    Máximo (o mínimo) de una ventana móvil con una deque monótona, O(1)
+    amortizado por valor.
+    """
+    def __init__(self, window, maximum=True):
+        self.window = window
+        self.maximum = maximum
+        self.candidates = deque()
+        self.index = 0
+        self.valid = deque()
+        self.valid_count = 0
+
+    def update(self, x):
+        i = self.index
+        self.index += 1
+        self.valid.append(not isnan(x))
+        self.valid_count += self.valid[-1]
+        if len(self.valid) > self.window:
+            self.valid_count -= self.valid.popleft()
+        if not isnan(x):
+            if self.maximum:
+                while self.candidates and self.candidates[-1][1] <= x:
+                    self.candidates.pop()
+            else:
+                while self.candidates and self.candidates[-1][1] >= x:
+                    self.candidates.pop()
+            self.candidates.append((i, x))
+        while self.candidates and self.candidates[0][0] <= i - self.window:
+            self.candidates.popleft()
+        if self.valid_count < self.window or not self.candidates:
+            return NAN
+        return self.candidates[0][1]
+
+
+class MACD():
+    def __init__(self, columna, short_window=12, long_window=26, smooth_signal=9):
+        self.columna = columna
+        self.ema_short = EWMA(2 / (short_window + 1))
+        self.ema_long = EWMA(2 / (long_window + 1))
+        self.signal = RollingMean(smooth_signal, min_periods=1)
+
+    def update(self, bar):
+        x = bar[self.columna]
+        macd = self.ema_short.update(x) - self.ema_long.update(x)
+        signal = self.signal.update(macd)
+        return {'MACD': macd, 'MACD_SIGNAL': signal, 'MACD_HIST': macd - signal}
+
+
+class RSI():
+    def __init__(self, columna, window_length=14):
+        self.columna = columna
+        alpha = 1 / (1 + window_length)
+        self.up_ewm = EWMA(alpha, min_periods=window_length)
+        self.down_ewm = EWMA(alpha, min_periods=window_length)
+        self.up_sma = RollingMean(window_length)
+        self.down_sma = RollingMean(window_length)
+        self.previous = None
+        self.last = {'RSI_EWMA': NAN, 'RSI_SMA': NAN}
+
+    def update(self, bar):
+        x = bar[self.columna]
+        if self.previous is None:
+            self.previous = x
+            return dict(self.last)
+        delta = x - self.previous
+        self.previous = x
+        up = delta if delta > 0 else 0.0
+        down = -delta if delta < 0 else 0.0
+        if isnan(delta):
+            up = down = NAN
+        values = {'RSI_EWMA': 100.0 - div(100.0, 1.0 + div(self.up_ewm.update(up), self.down_ewm.update(down))),
+                  'RSI_SMA': 100.0 - div(100.0, 1.0 + div(self.up_sma.update(up), self.down_sma.update(down)))}
+        #como en la versión batch, los NaN se completan con el último valor
+        for key, value in values.items():
+            if not isnan(value):
+                self.last[key] = value
+        return dict(self.last)
+
+
+class VWAP():
+    def __init__(self, column_price, column_volume):
+        self.column_price = column_price
+        self.column_volume = column_volume
+        self.price = NAN
+        self.volume = NAN
+        self.pq = 0.0
+        self.q = 0.0
+
+    def update(self, bar):
+        price, volume = bar[self.column_price], bar[self.column_volume]
+        if not isnan(price):
+            self.price = price
+        if not isnan(volume):
+            self.volume = volume
+        if not isnan(self.price) and not isnan(self.volume):
+            self.pq += self.price * self.volume
+            self.q += self.volume
+        return {'VWAP': div(self.pq, self.q)}
+
+
+class STOCHASTIC():
+    def __init__(self, column_name='Close', window=14, smoothk=1, smoothd=3):
+        self.column_name = column_name
+        self.max = RollingExtreme(window, maximum=True)
+        self.min = RollingExtreme(window, maximum=False)
+        self.smoothk = RollingMean(smoothk)
+        self.smoothd = RollingMean(smoothd)
+        self.last = NAN
+
+    def update(self, bar):
+        x = bar[self.column_name]
+        if isnan(x):
+            x = self.last
+        self.last = x
+        high, low = self.max.update(x), self.min.update(x)
+        k = self.smoothk.update(div(100 * (x - low), high - low))
+        return {'STO_K': k, 'STO_D': self.smoothd.update(k)}
+
+
+class BB():
+    def __init__(self, column_price='Close', window_length=20, n_std=2):
+        self.column_price = column_price
+        self.n_std = n_std
+        self.stats = RollingStats(window_length)
+
+    def update(self, bar):
+        mean, std = self.stats.update(bar[self.column_price])
+        return {'BB_m': mean, 'BB_u': mean + std*self.n_std, 'BB_d': mean - std*self.n_std}
+
+
+class ATR():
+    """
+    Devuelve los valores de la barra anterior, ya que el True Range de una
+    barra usa el cierre de la siguiente.
+    """
+    def __init__(self, col_close='Close', col_high='High', col_low='Low', window_length=14):
+        self.col_close, self.col_high, self.col_low = col_close, col_high, col_low
+        self.mean = RollingMean(window_length)
+        self.previous = None
+
+    def true_range(self, previous, close):
+        high, low = previous[self.col_high], previous[self.col_low]
+        ranges = [r for r in (high - low, abs(high - close), abs(low - close)) if not isnan(r)]
+        return max(ranges) if ranges else NAN
+
+    def update(self, bar):
+        previous, self.previous = self.previous, bar
+        if previous is None:
+            return None
+        return {'ATR': self.mean.update(self.true_range(previous, bar[self.col_close]))}
+
+
+class ADX():
+    """
+    Devuelve los valores de la barra anterior, ya que los movimientos
+    direccionales de una barra usan la barra siguiente.
+    """
+    def __init__(self, col_close='Close', col_high='High', col_low='Low', window_length=14):
+        self.col_high, self.col_low = col_high, col_low
+        self.atr = ATR(col_close=col_close, col_high=col_high, col_low=col_low, window_length=window_length)
+        self.pdm = EWMA(2 / (window_length + 1))
+        self.ndm = EWMA(2 / (window_length + 1))
+        self.previous = None
+
+    def update(self, bar):
+        previous, self.previous = self.previous, bar
+        atr = self.atr.update(bar)
+        if previous is None:
+            return None
+        moveup = previous[self.col_high] - bar[self.col_high]
+        movedown = bar[self.col_low] - previous[self.col_low]
+        pdm = moveup if moveup > 0 and moveup > movedown else 0.0
+        ndm = movedown if movedown > 0 and movedown > moveup else 0.0
+        pdi = div(100*self.pdm.update(pdm), atr['ATR'])
+        ndi = div(100*self.ndm.update(ndm), atr['ATR'])
+        return {'PDI': pdi, 'NDI': ndi, 'ADX': div(100*abs(pdi - ndi), pdi + ndi)}
+
+
+class CCI():
+    def __init__(self, col_close='Close', col_high='High', col_low='Low', window_length=20, constant=.015):
+        self.col_high, self.col_low = col_high, col_low
+        self.constant = constant
+        self.stats = RollingStats(window_length)
+
+    def update(self, bar):
+        #mismo precio típico que la versión batch
+        typical_price = (bar[self.col_high] + bar[self.col_low] + bar[self.col_low])/3
+        mean, std = self.stats.update(typical_price)
+        return {'CCI': div(typical_price - mean, self.constant*std)}
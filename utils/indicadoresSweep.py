@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Barrido de parámetros de indicadores en un pool de procesos.
+
+Los arrays de entrada (close, high, low, volume) se copian una sola vez a
+memoria compartida, y cada worker los lee de ahí sin recibir DataFrames
+serializados. Cada combinación de parámetros se calcula con el motor de
+utils.indicadoresEngine y se escribe directamente en un bloque de salida, también
+en memoria compartida, de forma (combinaciones, filas, columnas) por indicador.
+
+Ejemplo:
+    grid = {'MACD': {'short_window': [8, 12], 'long_window': [21, 26, 34]},
+            'RSI': {'window_length': range(5, 30)},
+            'BB': {'n_std': [1.5, 2, 2.5]}}
+    results = sweep(df, grid)
+    results['RSI'].values  # array (25, len(df), 2)
+"""
+from collections import namedtuple
+from itertools import product
+from multiprocessing import Pool, shared_memory
+import os
+import numpy as np
+import pandas as pd
+from utils.indicadoresEngine import IndicatorEngine, DEFAULTS, columns_of
+
+INPUTS = ('Close', 'High', 'Low', 'Volume')
+
+SweepResult = namedtuple('SweepResult', ['params', 'columns', 'values'])
+
+#memoria compartida de cada worker, se conecta una sola vez en el initializer
+_shared = {}
+
+
+def expand_grid(grid):
+    """
+    Lista de (indicador, dict de parámetros) con todas las combinaciones de
+    la grilla.
+    """
+    combinations = []
+    for name, params in grid.items():
+        keys = list(params)
+        for values in product(*[list(params[k]) for k in keys]):
+            combinations.append((name, dict(zip(keys, values))))
+    return combinations
+
+
+def _attach(name):
+    #los workers comparten el resource tracker del proceso principal, que es
+    #el dueño de la memoria y el que la libera
+    return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(input_name, shape, outputs):
+    shm = _attach(input_name)
+    _shared['input'] = (shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+    _shared['outputs'] = {}
+    for indicator, (name, out_shape) in outputs.items():
+        out = _attach(name)
+        _shared['outputs'][indicator] = (out, np.ndarray(out_shape, dtype=np.float64, buffer=out.buf))
+
+
+def _work(task):
+    indicator, position, params = task
+    data = _shared['input'][1]
+    df = pd.DataFrame({column: data[:, i] for i, column in enumerate(INPUTS)}, copy=False)
+    values = IndicatorEngine([(indicator, params)]).compute(df).to_numpy()
+    _shared['outputs'][indicator][1][position] = values
+    return position
+
+
+def sweep(df, grid, processes=None, col_close='Close', col_high='High', col_low='Low', col_volume='Volume'):
+    """
+    Calcula todas las combinaciones de parámetros de la grilla sobre df en
+    un pool de processes procesos (todos los cores por defecto).
+    grid -> dict de indicador a dict de parámetro a lista de valores.
+    Devuelve un dict de indicador a SweepResult, con la lista de parámetros
+    (completos, con los valores por defecto), los nombres de las columnas y
+    el array de valores (combinaciones, filas, columnas).
+    """
+    n = len(df)
+    columns = {'Close': col_close, 'High': col_high, 'Low': col_low, 'Volume': col_volume}
+    tasks = []
+    params_by_indicator = {}
+    for name, params in expand_grid(grid):
+        full = dict(DEFAULTS[name])
+        full.update(params)
+        position = len(params_by_indicator.setdefault(name, []))
+        params_by_indicator[name].append(full)
+        tasks.append((name, position, full))
+
+    owned = []
+    try:
+        data = shared_memory.SharedMemory(create=True, size=max(n * len(INPUTS) * 8, 1))
+        owned.append(data)
+        block = np.ndarray((n, len(INPUTS)), dtype=np.float64, buffer=data.buf)
+        for i, column in enumerate(INPUTS):
+            if columns[column] in df.columns:
+                block[:, i] = df[columns[column]].to_numpy(dtype=np.float64)
+            else:
+                block[:, i] = np.nan
+
+        outputs = {}
+        names = {}
+        for name, params_list in params_by_indicator.items():
+            names[name] = columns_of(name, params_list[0])
+            shape = (len(params_list), n, len(names[name]))
+            out = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+            owned.append(out)
+            outputs[name] = (out.name, shape)
+
+        processes = processes or os.cpu_count()
+        with Pool(processes, initializer=_init_worker, initargs=(data.name, (n, len(INPUTS)), outputs)) as pool:
+            for _ in pool.imap_unordered(_work, tasks, chunksize=max(1, len(tasks) // (processes * 4))):
+                pass
+
+        results = {}
+        for name, (shm_name, shape) in outputs.items():
+            shm = next(s for s in owned if s.name == shm_name)
+            values = np.array(np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+            results[name] = SweepResult(params_by_indicator[name], names[name], values)
+        return results
+    finally:
+        for shm in owned:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Producer/consumer pipeline between the websocket callback and the database.
+
+The callback only puts the parsed rows in a bounded queue, and one or more
+writer threads drain the queue into a TradeWriter (that owns the connection
+to the database). When the queue is full, the backpressure policy decides
+what to do with the new rows:
+    * block -> the producer waits until there is room in the queue.
+    * drop_oldest -> the oldest row in the queue is discarded.
+    * spill -> the row is appended to a file in disk, and it is ingested
+      again by the writers when the queue is empty.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from utils.trades import Trade
+
+POLICIES = ('block', 'drop_oldest', 'spill')
+_STOP = object()
+
+
+class IngestQueue():
+    def __init__(self, writer_factory, maxsize=10000, policy='block', workers=1,
+                 spill_path='spill/ingest.jsonl', logger=None):
+        """
+        writer_factory -> callable that returns a new TradeWriter. Every worker
+        owns its writer, and therefore its connection to the database.
+        maxsize -> maximum number of rows waiting in the queue.
+        policy -> backpressure policy when the queue is full (see POLICIES).
+        workers -> number of writer threads.
+        spill_path -> file used by the spill policy.
+        """
+        if policy not in POLICIES:
+            raise ValueError("Unknown backpressure policy {}, use one of {}".format(policy, POLICIES))
+        if logger is None:
+            from utils.createLogger import createLogger
+            self.logger = createLogger()
+        else:
+            self.logger = logger
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.spill_path = spill_path
+        self.spill_lock = threading.Lock()
+
+        #metrics
+        self.enqueued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.unspilled = 0
+        self.max_depth = 0
+        self.last_queue_wait = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+        self.writers = []
+        self.threads = []
+        for i in range(workers):
+            writer = writer_factory()
+            thread = threading.Thread(target=self._work, args=(writer,),
+                                      name='ingest-writer-{}'.format(i), daemon=True)
+            self.writers.append(writer)
+            self.threads.append(thread)
+            thread.start()
+
+    def put(self, table, row):
+        """
+        Put a row in the queue, applying the backpressure policy if the queue
+        is full.
+        """
+        item = (table, row, time.monotonic())
+        if self.policy == 'block':
+            self.queue.put(item)
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                if self.policy == 'drop_oldest':
+                    self._drop_oldest(item)
+                else:
+                    self._spill(table, row)
+                    return
+        self.enqueued += 1
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _drop_oldest(self, item):
+        while True:
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                continue
+
+    def _spill(self, table, row):
+        with self.spill_lock:
+            folder = os.path.dirname(self.spill_path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(self.spill_path, 'a') as f:
+                f.write(json.dumps([table, row, isinstance(row, Trade)]) + '\n')
+            self.spilled += 1
+
+    def _unspill(self, writer):
+        """
+        Ingest again the rows spilled to disk. The file is renamed before
+        reading it, so new spills go to a fresh file.
+        """
+        with self.spill_lock:
+            if not os.path.exists(self.spill_path):
+                return
+            draining = self.spill_path + '.draining'
+            os.replace(self.spill_path, draining)
+        self.logger.info("Ingesting the rows spilled to {}".format(self.spill_path))
+        with open(draining) as f:
+            for line in f:
+                table, row, is_trade = json.loads(line)
+                if is_trade:
+                    row = Trade(*row)
+                writer.add(table, row)
+                self.unspilled += 1
+        writer.flush()
+        os.remove(draining)
+
+    def _work(self, writer):
+        """
+        Writer thread. Drain the queue into the writer, and flush it when the
+        stream is quiet.
+        """
+        oldest = None
+        flushes = writer.flushes
+        while True:
+            try:
+                item = self.queue.get(timeout=writer.max_age)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                if self.policy == 'spill':
+                    self._unspill(writer)
+                writer.close()
+                self._update_lag(oldest)
+                return
+            if item is not None:
+                table, row, enqueued_at = item
+                self.last_queue_wait = time.monotonic() - enqueued_at
+                if oldest is None:
+                    oldest = enqueued_at
+                try:
+                    writer.add(table, row)
+                except Exception:
+                    self.logger.exception("Error in the writer thread")
+            else:
+                writer.flush_if_due()
+                if self.policy == 'spill' and self.queue.empty():
+                    try:
+                        self._unspill(writer)
+                    except Exception:
+                        self.logger.exception("Error ingesting the spilled rows")
+            if writer.flushes != flushes:
+                flushes = writer.flushes
+                self._update_lag(oldest)
+                oldest = None
+
+    def _update_lag(self, oldest):
+        """
+        End to end lag: time since the oldest row of the batch was enqueued
+        until the batch was committed.
+        """
+        if oldest is None:
+            return
+        self.last_lag = time.monotonic() - oldest
+        self.max_lag = max(self.max_lag, self.last_lag)
+
+    def close(self, timeout=None):
+        """
+        Stop the writer threads after draining the queue (and the spill file).
+        Every writer is flushed before the thread ends.
+        """
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def stats(self):
+        """
+        Return the metrics of the queue and the writers as a dict.
+        """
+        return {'depth': self.queue.qsize(),
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'spilled': self.spilled,
+                'unspilled': self.unspilled,
+                'last_queue_wait': self.last_queue_wait,
+                'last_lag': self.last_lag,
+                'max_lag': self.max_lag,
+                'writers': [writer.stats() for writer in self.writers]}
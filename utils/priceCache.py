@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Last price of every symbol, shared between processes through memory mapped
+files (one small file per symbol, data/prices/BTCUSDT.bin).
+
+The reader (BTCreader) publishes every trade and every closed 1m bar, and any
+other process (i.e. the telegram bot) reads the last values without querying
+the database. There is only one writer by symbol, and the readers never lock
+it: the record is protected with a sequence lock. The writer increments the
+sequence before (odd) and after (even) writing the record, and the reader
+retries if the sequence was odd or changed while it was reading.
+"""
+import mmap
+import os
+import struct
+import time
+
+SEQ = struct.Struct('<Q')
+RECORD = struct.Struct('<qqddqqddddd')
+FIELDS = ('published', 'trade_id', 'price', 'quantity', 'trade_time',
+          'bar_open_time', 'bar_open', 'bar_high', 'bar_low', 'bar_close',
+          'bar_volume')
+SIZE = SEQ.size + RECORD.size
+
+
+class PriceCache():
+    def __init__(self, symbol, folder='data/prices', writer=False):
+        """
+        symbol -> ticker of the prices (i.e. BTCUSDT).
+        folder -> folder of the files of all the symbols.
+        writer -> True only in the process that publishes the prices. The
+        readers open the file when it exists (the writer may start later).
+        """
+        self.symbol = symbol
+        self.path = os.path.join(folder, '{}.bin'.format(symbol))
+        self.writer = writer
+        self.map = None
+        self.seq = 0
+        self.bar = (0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        #metrics of the readers
+        self.reads = 0
+        self.retries = 0
+        if writer:
+            os.makedirs(folder, exist_ok=True)
+            #keep the file if it exists, the readers may have it mapped
+            with open(self.path, 'ab') as f:
+                if f.tell() < SIZE:
+                    f.truncate(SIZE)
+            self.file = open(self.path, 'r+b')
+            self.map = mmap.mmap(self.file.fileno(), SIZE)
+            self.seq = SEQ.unpack_from(self.map, 0)[0]
+            if self.seq % 2:
+                #the last writer died in the middle of a write
+                self.seq += 1
+
+    def _open(self):
+        """
+        Map the file for reading. Return False if it does not exist yet.
+        """
+        if self.map is not None:
+            return True
+        try:
+            self.file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+        self.map = mmap.mmap(self.file.fileno(), SIZE, access=mmap.ACCESS_READ)
+        return True
+
+    def publish_bar(self, bar):
+        """
+        Keep the last closed bar (a bar of candles.CandleBuilder), it is
+        published with the next trade.
+        """
+        self.bar = tuple(bar[:6])
+
+    def publish(self, trade):
+        """
+        Publish the last trade (a trades.Trade) and the last closed bar.
+        """
+        self.seq += 1
+        SEQ.pack_into(self.map, 0, self.seq)
+        RECORD.pack_into(self.map, SEQ.size, int(time.time() * 1000), trade.trade_id,
+                         trade.price, trade.quantity, trade.trade_time, *self.bar)
+        self.seq += 1
+        SEQ.pack_into(self.map, 0, self.seq)
+
+    def read(self, retries=100):
+        """
+        Read the last record as a dict (see FIELDS), or None if nothing was
+        published yet.
+        """
+        if not self._open():
+            return None
+        self.reads += 1
+        for _ in range(retries):
+            start = SEQ.unpack_from(self.map, 0)[0]
+            if start % 2 == 0:
+                values = RECORD.unpack_from(self.map, SEQ.size)
+                if SEQ.unpack_from(self.map, 0)[0] == start:
+                    if start == 0:
+                        return None
+                    return dict(zip(FIELDS, values))
+            self.retries += 1
+        return None
+
+    def staleness(self, record=None):
+        """
+        Seconds since the last publication, None if nothing was published.
+        """
+        record = record or self.read()
+        if record is None:
+            return None
+        return time.time() - record['published'] / 1000
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+            self.map = None
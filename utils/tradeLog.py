@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Local append-only log of trades.
+
+Every trade is stored as a fixed-width binary record (TRADE_DTYPE) in one file
+per symbol and day (UTC):
+
+    <folder>/<SYMBOL>/<YYYY-MM-DD>.bin
+
+The files can be memory-mapped as NumPy structured arrays without copying
+them (read_day), so the indicators can process months of trades straight
+from the disk. The records of a file are in the order they were written, that
+is, the order of arrival (sort by trade_id if needed).
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+TRADE_DTYPE = np.dtype([('trade_id', '<i8'),
+                        ('event_time', '<i8'),
+                        ('trade_time', '<i8'),
+                        ('price', '<f8'),
+                        ('quantity', '<f8'),
+                        ('bid_id', '<i8'),
+                        ('ask_id', '<i8'),
+                        ('maker', 'u1'),
+                        ('pad', 'V7')])
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class TradeLog():
+    def __init__(self, folder='data/trades'):
+        """
+        folder -> root folder of the log files.
+        """
+        self.folder = folder
+        self.files = {}
+        self.lock = threading.Lock()
+        self.records_written = 0
+
+    def path(self, symbol, day):
+        """
+        Path of the file of the symbol and day (a date or a 'YYYY-MM-DD' str).
+        """
+        if not isinstance(day, str):
+            day = day.strftime('%Y-%m-%d')
+        return os.path.join(self.folder, symbol.upper(), day + '.bin')
+
+    def _file(self, symbol, day_number):
+        key = (symbol, day_number)
+        f = self.files.get(key)
+        if f is None:
+            #only the file of the current day (and the previous one, for the
+            #late trades) are kept open
+            for old in [k for k in self.files if k[0] == symbol and k[1] < day_number - 1]:
+                self.files.pop(old).close()
+            day = datetime(1970, 1, 1) + timedelta(days=day_number)
+            path = self.path(symbol, day)
+            folder = os.path.dirname(path)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            f = open(path, 'ab')
+            self.files[key] = f
+        return f
+
+    def append(self, symbol, trades):
+        """
+        Append a batch of Trades (utils.trades.Trade) of the symbol to the log.
+        The missing bid_id and ask_id are stored as -1.
+        """
+        if not trades:
+            return 0
+        records = np.empty(len(trades), dtype=TRADE_DTYPE)
+        records['trade_id'] = [t.trade_id for t in trades]
+        records['event_time'] = [t.event_time for t in trades]
+        records['trade_time'] = [t.trade_time for t in trades]
+        records['price'] = [t.price for t in trades]
+        records['quantity'] = [t.quantity for t in trades]
+        records['bid_id'] = [-1 if t.bid_id is None else t.bid_id for t in trades]
+        records['ask_id'] = [-1 if t.ask_id is None else t.ask_id for t in trades]
+        records['maker'] = [t.maker for t in trades]
+        days = records['trade_time'] // DAY_MS
+        with self.lock:
+            for day_number in np.unique(days):
+                f = self._file(symbol.upper(), int(day_number))
+                records[days == day_number].tofile(f)
+                f.flush()
+            self.records_written += len(records)
+        return len(records)
+
+    def close(self):
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+
+def read_day(symbol, day, folder='data/trades'):
+    """
+    Memory-map the file of the symbol and day as a structured array of
+    TRADE_DTYPE, without copying it. A record partially written at the end of
+    the file (i.e. after a crash) is ignored.
+    Return an empty array if the file does not exist.
+    """
+    path = TradeLog(folder).path(symbol, day)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=TRADE_DTYPE)
+    count = os.path.getsize(path) // TRADE_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=TRADE_DTYPE)
+    return np.memmap(path, dtype=TRADE_DTYPE, mode='r', shape=(count,))
+
+
+def read_range(symbol, start, end, folder='data/trades'):
+    """
+    List of the memory-mapped arrays (one per day) from the start date to the
+    end date (both included, dates or datetimes). Nothing is copied.
+    """
+    days = []
+    day = datetime(start.year, start.month, start.day)
+    end = datetime(end.year, end.month, end.day)
+    while day <= end:
+        data = read_day(symbol, day, folder)
+        if len(data):
+            days.append(data)
+        day += timedelta(days=1)
+    return days
+
+
+def to_frame(records, sort=True):
+    """
+    DataFrame of trades indexed by trade_time (datetime64[ms]), with the
+    columns used by indicadores.getOHLC and getOHLC_fast. This copies the
+    columns.
+    """
+    if isinstance(records, list):
+        records = np.concatenate(records) if records else np.empty(0, dtype=TRADE_DTYPE)
+    if sort and len(records) > 1 and (np.diff(records['trade_id']) < 0).any():
+        records = records[np.argsort(records['trade_id'], kind='stable')]
+    return pd.DataFrame({'trade_id': records['trade_id'],
+                         'price': records['price'],
+                         'quantity': records['quantity'],
+                         'maker': records['maker'].astype(bool)},
+                        index=pd.DatetimeIndex(records['trade_time'].astype('datetime64[ms]'), name='trade_time'))
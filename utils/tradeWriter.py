@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Buffered writer between the websocket callback and the database.
+
+The trades are collected in memory per table and written to the database
+with one multi-row INSERT and one commit per batch, instead of one round
+trip and one commit per trade.
+"""
+import threading
+import time
+from utils.trades import Trade
+
+
+class TradeWriter():
+    def __init__(self, db, batch_size=500, max_age=1.0, logger=None,
+                 trade_log=None, store_db=True):
+        """
+        db -> DBtools.DB instance where the trades are stored.
+        batch_size -> number of buffered rows that triggers a flush.
+        max_age -> seconds since the oldest buffered row that triggers a flush.
+        trade_log -> optional tradeLog.TradeLog where the trades are also
+        appended.
+        store_db -> if False, the trades are only stored in the trade_log (the
+        other rows, like the candles, still go to the database).
+        """
+        self.db = db
+        self.trade_log = trade_log
+        self.store_db = store_db
+        self.batch_size = batch_size
+        self.max_age = max_age
+        if logger is None:
+            from utils.createLogger import createLogger
+            self.logger = createLogger()
+        else:
+            self.logger = logger
+
+        self.buffers = {}
+        self.pending = 0
+        self.oldest = None
+        # the buffer lock protects the buffers, the flush lock serializes
+        # the writes to the database.
+        self.buffer_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+        #counters
+        self.rows_buffered = 0
+        self.rows_flushed = 0
+        self.rows_failed = 0
+        self.flushes = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def add(self, table, row):
+        """
+        Add a row to the buffer of the table. If the size or age threshold
+        is reached, the buffers are flushed to the database.
+        """
+        with self.buffer_lock:
+            self.buffers.setdefault(table, []).append(row)
+            self.pending += 1
+            self.rows_buffered += 1
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+        if self.is_due():
+            self.flush()
+
+    def is_due(self):
+        """
+        Check if the size or age threshold is reached.
+        """
+        if self.pending >= self.batch_size:
+            return True
+        oldest = self.oldest
+        return oldest is not None and time.monotonic() - oldest >= self.max_age
+
+    def flush_if_due(self):
+        """
+        Flush the buffers only if a threshold is reached. Useful to call it
+        periodically when the stream is quiet.
+        """
+        if self.is_due():
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """
+        Write all the buffered rows to the database, one batch per table.
+        Return the number of rows written. The rows of a table that can not be
+        written are counted in rows_failed.
+        """
+        with self.flush_lock:
+            with self.buffer_lock:
+                buffers = self.buffers
+                self.buffers = {}
+                self.pending = 0
+                self.oldest = None
+            if not buffers:
+                return 0
+            start = time.perf_counter()
+            written = 0
+            for table, rows in buffers.items():
+                #an error in one table (i.e. no connection available) must not
+                #lose the batches of the other tables
+                try:
+                    is_trade = isinstance(rows[0], Trade)
+                    if is_trade and self.trade_log is not None:
+                        self.trade_log.append(table, rows)
+                    if is_trade and not self.store_db:
+                        written += len(rows)
+                        continue
+                    n = self.db.appendMDmany(table=table, rows=rows)
+                except Exception:
+                    self.logger.exception("Error flushing {} rows to the table {}".format(len(rows), table))
+                    n = 0
+                written += n
+                self.rows_failed += len(rows) - n
+            latency = time.perf_counter() - start
+            self.rows_flushed += written
+            self.flushes += 1
+            self.last_flush_latency = latency
+            self.total_flush_latency += latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.logger.debug("{} rows flushed to the database in {:.1f} ms".format(written, latency*1000))
+            return written
+
+    def close(self):
+        """
+        Flush everything that is still in the buffers.
+        """
+        return self.flush()
+
+    def stats(self):
+        """
+        Return the counters of the writer as a dict.
+        """
+        return {'rows_buffered': self.rows_buffered,
+                'rows_pending': self.pending,
+                'rows_flushed': self.rows_flushed,
+                'rows_failed': self.rows_failed,
+                'flushes': self.flushes,
+                'last_flush_latency': self.last_flush_latency,
+                'max_flush_latency': self.max_flush_latency,
+                'avg_flush_latency': self.total_flush_latency / self.flushes if self.flushes else 0.0}
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Compact representation of the trades received in the websocket.
+
+A Trade is a namedtuple (no dict per trade) with the fields in the same order
+as the columns of the ticker tables. The times are kept as integer epoch
+milliseconds, and they are converted by the database in bulk when the batch
+is inserted (see DB.appendMDmany). The prices and quantities are parsed once
+to float.
+"""
+from collections import namedtuple
+
+Trade = namedtuple('Trade', ['event_time', 'trade_id', 'price', 'quantity',
+                             'bid_id', 'ask_id', 'trade_time', 'maker'])
+
+#fields with epoch milliseconds
+MS_FIELDS = ('event_time', 'trade_time')
+
+
+def parse_trade(msg):
+    """
+    Build a Trade from a trade message of the Binance websocket.
+    The buyer and seller order ids (b, a) are not sent anymore by Binance,
+    so they are optional.
+    """
+    return Trade(msg['E'], msg['t'], float(msg['p']), float(msg['q']),
+                 msg.get('b'), msg.get('a'), msg['T'], msg['m'])